@@ -0,0 +1,77 @@
+import re
+import runpy
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+from vcc_py.plugin import Plugin
+
+def load_ban(path: Path) -> Any:
+    """the BanFilter of a fresh ban plugin which keeps its rules in path"""
+    configs: Any = SimpleNamespace(config={"ban_file": str(path)})
+    plugin = Plugin(SimpleNamespace(), configs, "ban")
+    return runpy.run_module("vcc_py.plugins.ban", {"plugin": plugin})["ban_filter"]
+
+def test_every_kind_of_rule(tmp_path: Path) -> None:
+    ban = load_ban(tmp_path / "ban.json")
+    ban.update("users", ["mallory"], True)
+    ban.update("globs", ["bot*"], True)
+    ban.update("regexes", [r"spam\d+"], True)
+    ban.update("phrases", ["Buy Now"], True)
+    assert ban.banned("mallory", "hi")
+    assert ban.banned("bot7", "hi")
+    assert ban.banned("spam42", "hi")
+    assert not ban.banned("spam42x", "hi")
+    assert ban.banned("alice", "please buy now!")
+    assert not ban.banned("alice", "hi")
+
+def test_regexes_keep_their_flags(tmp_path: Path) -> None:
+    ban = load_ban(tmp_path / "ban.json")
+    ban.update("regexes", ["(?i)foo.*", "(?x) b a r  # a comment", "(?i)(?i)baz", "qu+x"], True)
+    assert ban.banned("FOObar", "")
+    assert ban.banned("bar", "")
+    assert ban.banned("BAZ", "")
+    assert ban.banned("quuux", "")
+    # the flags of a rule don't leak into the others
+    assert not ban.banned("QUX", "")
+    assert not ban.banned("b a r", "")
+
+@pytest.mark.parametrize("rule", [r"(a)\1", "(?P<name>a)", "(a)|b"])
+def test_regexes_with_groups_are_refused(tmp_path: Path, rule: str) -> None:
+    ban = load_ban(tmp_path / "ban.json")
+    with pytest.raises(ValueError):
+        ban.update("regexes", [rule], True)
+    ban.update("regexes", ["(?:a)+"], True)
+    assert ban.banned("aa", "")
+
+@pytest.mark.parametrize("kind", ["users", "globs", "regexes", "phrases"])
+def test_empty_rules_are_refused(tmp_path: Path, kind: str) -> None:
+    ban = load_ban(tmp_path / "ban.json")
+    with pytest.raises(ValueError):
+        ban.update(kind, [" "], True)
+    assert not ban.rules[kind]
+    assert not ban.banned("", "hi")
+
+def test_bad_regex_changes_nothing(tmp_path: Path) -> None:
+    ban = load_ban(tmp_path / "ban.json")
+    ban.update("regexes", ["ok"], True)
+    with pytest.raises(re.error):
+        ban.update("regexes", ["("], True)
+    assert ban.rules["regexes"] == {"ok"}
+    # still usable
+    ban.update("regexes", ["ok"], False)
+    assert not ban.banned("ok", "")
+
+def test_rules_are_saved_and_loaded(tmp_path: Path) -> None:
+    ban = load_ban(tmp_path / "ban.json")
+    ban.update("globs", ["bot*"], True)
+    assert load_ban(tmp_path / "ban.json").banned("bot1", "")
+
+def test_bad_ban_file_doesnt_stop_the_plugin(tmp_path: Path, capsys: Any) -> None:
+    path = tmp_path / "ban.json"
+    path.write_text('{"regexes": ["("]}')
+    ban = load_ban(path)
+    assert "Cannot load the ban list" in capsys.readouterr().out
+    assert not ban.banned("(", "")
@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any
+
+from vcc_py.constants import *
+from vcc_py.codec import RelayView, RequestView, decode_frame, pack_relay, pack_request
+from vcc_py.plugin import Plugin, Plugins
+
+def request_view(msg: str = "hello") -> RequestView:
+    view = decode_frame(pack_request(magic=VCC_MAGIC, type=REQ.MSG_NEW, uid=3, session=2, flags=1, usrname="alice", msg=msg))
+    assert isinstance(view, RequestView)
+    return view
+
+def test_request_view_matches_the_tuple() -> None:
+    view = request_view()
+    req = view.to_tuple()
+    assert req == Request(VCC_MAGIC, REQ.MSG_NEW, 3, 2, 1, "alice", "hello")
+    assert tuple(view) == tuple(req)
+    assert all(getattr(view, i) == getattr(req, i) for i in Request._fields)
+    assert view._asdict() == req._asdict()
+    assert view.raw_msg.rstrip(b"\0") == b"hello"
+    assert view.to_raw().usrname.rstrip(b"\0") == b"alice"
+
+def test_replace_gives_a_tuple() -> None:
+    changed = request_view()._replace(msg="changed")
+    assert isinstance(changed, Request) and changed.msg == "changed" and changed.usrname == "alice"
+
+def test_relay_view_matches_the_tuple() -> None:
+    frame = pack_relay(magic=VCC_MAGIC_RL, type=REQ.REL_MSG, uid=1, session=2, usrname="alice", visible="bob", msg="x" * 1000)
+    view = decode_frame(bytes(frame))
+    assert isinstance(view, RelayView)
+    relay = view.to_tuple()
+    assert (relay.usrname, relay.visible, relay.msg, relay.session) == ("alice", "bob", "x" * 1000, 2)
+    assert view.size == len(frame)
+    assert tuple(view) == tuple(relay)
+
+def plugins(*hooks: Any) -> Plugins:
+    plugs = Plugins(SimpleNamespace())  # type: ignore[arg-type]
+    plugin = Plugin(SimpleNamespace(), SimpleNamespace())  # type: ignore[arg-type]
+    for hook in hooks:
+        plugin.register_recv_hook(hook)
+    plugs.plugs = [plugin]
+    plugs.rebuild()
+    return plugs
+
+def test_hooks_get_the_view() -> None:
+    seen: list[Any] = []
+    def hook(req: Any) -> Any:
+        seen.append(req)
+        return req
+    view = request_view()
+    assert asyncio.run(plugins(hook, hook).recv_msg(view)) is view
+    assert seen == [view, view]
+
+def test_a_hook_can_change_the_view() -> None:
+    def hook(req: Any) -> Any:
+        return req._replace(msg=req.msg.upper())
+    result = asyncio.run(plugins(hook).recv_msg(request_view()))
+    assert isinstance(result, Request) and result.msg == "HELLO"
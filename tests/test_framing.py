@@ -0,0 +1,94 @@
+import asyncio
+import socket
+import struct
+
+import pytest
+
+from vcc_py.constants import *
+from vcc_py.codec import RELAY_HEADER_STRUCT, RelayView, RequestView, decode_frame, frame_size, pack_relay, pack_request
+from vcc_py.sock import FrameReader
+
+def request(msg: str) -> bytes:
+    return pack_request(magic=VCC_MAGIC, type=REQ.MSG_SEND, uid=0, session=1, flags=0, usrname="a", msg=msg)
+
+def relay(msg: str) -> bytes:
+    return bytes(pack_relay(magic=VCC_MAGIC_RL, type=REQ.REL_MSG, uid=0, session=1, usrname="a", visible="b", msg=msg))
+
+async def read_all(chunks: list[bytes], count: int, bufsize: int = 65536) -> list[bytes]:
+    """write chunks one at a time into a socket pair, read count frames on the other end"""
+    reader_sock, writer_sock = socket.socketpair()
+    reader_sock.setblocking(False)
+    reader = FrameReader(reader_sock, bufsize)
+    try:
+        async def write() -> None:
+            for chunk in chunks:
+                writer_sock.sendall(chunk)
+                # let the reader see every chunk on its own
+                await asyncio.sleep(0.01)
+        writing = asyncio.create_task(write())
+        frames = [await asyncio.wait_for(reader.read_frame(), 2) for _ in range(count)]
+        await writing
+        return frames
+    finally:
+        reader_sock.close()
+        writer_sock.close()
+
+def test_frame_split_across_reads() -> None:
+    frame = request("hello")
+    frames = asyncio.run(read_all([frame[:3], frame[3:100], frame[100:]], 1))
+    assert frames == [frame]
+
+def test_many_frames_in_one_read() -> None:
+    frames = [request(f"m{i}") for i in range(5)]
+    assert asyncio.run(read_all([b"".join(frames)], 5)) == frames
+
+def test_relay_frames_mixed_with_requests() -> None:
+    frames = [request("one"), relay("two" * 100), request("three")]
+    data = b"".join(frames)
+    # cut inside the relay header and inside its body
+    chunks = [data[:REQ_SIZE + 6], data[REQ_SIZE + 6:REQ_SIZE + 200], data[REQ_SIZE + 200:]]
+    received = asyncio.run(read_all(chunks, 3))
+    assert received == frames
+    view = decode_frame(received[1])
+    assert isinstance(view, RelayView) and view.msg == "two" * 100
+    assert isinstance(decode_frame(received[2]), RequestView)
+
+def test_frames_larger_than_the_buffer() -> None:
+    # the buffer grows, and an incomplete frame is moved to the front
+    frames = [relay("x" * 3000), request("y"), relay("z" * 5000)]
+    data = b"".join(frames)
+    chunks = [data[i:i + 700] for i in range(0, len(data), 700)]
+    assert asyncio.run(read_all(chunks, 3, bufsize=1024)) == frames
+
+def test_closed_in_the_middle_of_a_frame() -> None:
+    async def run() -> None:
+        reader_sock, writer_sock = socket.socketpair()
+        reader_sock.setblocking(False)
+        writer_sock.sendall(request("cut")[:100])
+        writer_sock.close()
+        try:
+            with pytest.raises(ConnectionResetError):
+                await FrameReader(reader_sock).read_frame()
+        finally:
+            reader_sock.close()
+    asyncio.run(run())
+
+def test_relay_size_too_large() -> None:
+    header = bytearray(relay("big")[:RELAY_HEADER_STRUCT.size])
+    struct.pack_into("!I", header, 8, MAX_RELAY_SIZE + 1)
+    with pytest.raises(ValueError):
+        frame_size(header)
+    async def run() -> None:
+        reader_sock, writer_sock = socket.socketpair()
+        reader_sock.setblocking(False)
+        writer_sock.sendall(bytes(header))
+        try:
+            reader = FrameReader(reader_sock)
+            with pytest.raises(ValueError):
+                await reader.read_frame()
+            # nothing was allocated for it
+            assert len(reader._buf) == 65536
+        finally:
+            reader_sock.close()
+            writer_sock.close()
+    asyncio.run(run())
@@ -0,0 +1,75 @@
+import asyncio
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+from vcc_py.commands import show_history
+from vcc_py.history import History, to_fts_query
+
+def test_concurrent_flushes_lose_nothing(tmp_path: Path) -> None:
+    async def main() -> int:
+        async with History(tmp_path / "history.db", flush_interval=0.001) as history:
+            async def add(i: int) -> None:
+                history.add("alice", f"message {i}", 0)
+                await history.flush()
+            await asyncio.gather(*[add(i) for i in range(200)])
+            return len(await history.page(limit=1000))
+    assert asyncio.run(main()) == 200
+
+def test_history_is_kept_after_closing(tmp_path: Path) -> None:
+    async def main() -> list[str]:
+        async with History(tmp_path / "history.db") as history:
+            for i in range(3):
+                history.add("alice", f"message {i}", 1)
+        async with History(tmp_path / "history.db") as history:
+            return [i.msg for i in await history.page(session=1)]
+    assert asyncio.run(main()) == ["message 0", "message 1", "message 2"]
+
+def test_search_finds_flushed_messages(tmp_path: Path) -> None:
+    async def main() -> list[str]:
+        async with History(tmp_path / "history.db") as history:
+            history.add("alice", "the quick brown fox", 0)
+            history.add("bob", "a lazy dog", 0)
+            history.add("bob", "quick quick fox", 0)
+            await history.flush()
+            await history._write(history._index)
+            return [i.msg for i in await history.search("QUICK fox")]
+    assert sorted(asyncio.run(main())) == ["quick quick fox", "the quick brown fox"]
+
+@pytest.mark.parametrize("text", ["", "   "])
+def test_empty_search_is_rejected(tmp_path: Path, capsys: Any, text: str) -> None:
+    assert to_fts_query(text) == ""
+    async def main() -> None:
+        async with History(tmp_path / "history.db") as history:
+            conn: Any = SimpleNamespace(data=SimpleNamespace(history=history))
+            await show_history(conn, "-search", [text], search=True)
+    asyncio.run(main())
+    assert capsys.readouterr().out.startswith("usage: -search")
+
+def test_query_syntax_is_quoted(tmp_path: Path) -> None:
+    async def main() -> list[str]:
+        async with History(tmp_path / "history.db") as history:
+            history.add("alice", 'say "NEAR" OR not', 0)
+            await history.flush()
+            await history._write(history._index)
+            return [i.msg for i in await history.search('"NEAR" OR')]
+    assert asyncio.run(main()) == ['say "NEAR" OR not']
+
+def test_search_doesnt_wait_for_the_index(tmp_path: Path, capsys: Any) -> None:
+    async def main() -> None:
+        # the writer task sleeps, nothing is indexed but by hand
+        async with History(tmp_path / "history.db", flush_interval=60, index_batch=2) as history:
+            for i in range(5):
+                history.add("alice", f"word {i}", 0)
+            await history.flush()
+            assert await history.search("word") == []
+            assert await history.index_lag() == 5
+            await history._write(history._index)
+            assert len(await history.search("word")) == 2
+            conn: Any = SimpleNamespace(data=SimpleNamespace(history=history))
+            await show_history(conn, "-search", ["word"], search=True)
+    asyncio.run(main())
+    out = capsys.readouterr().out
+    assert "(2 messages)" in out and "about 3 messages can't be found yet" in out
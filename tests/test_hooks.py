@@ -0,0 +1,117 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Any
+
+from vcc_py.constants import *
+from vcc_py.plugin import Plugin, Plugins
+
+def message(type: int = REQ.MSG_NEW, session: int = 1, usrname: str = "alice", msg: str = "hi") -> Request:
+    return Request(VCC_MAGIC, type, 0, session, 0, usrname, msg)
+
+def plugins(*plugs: Plugin) -> Plugins:
+    result = Plugins(SimpleNamespace())  # type: ignore[arg-type]
+    result.plugs = list(plugs)
+    result.rebuild()
+    return result
+
+def new_plugin(name: str = "test") -> Plugin:
+    return Plugin(SimpleNamespace(), SimpleNamespace(), name)  # type: ignore[arg-type]
+
+def test_hooks_only_see_what_they_want() -> None:
+    plugin = new_plugin()
+    seen: dict[str, list[str]] = {"all": [], "types": [], "sessions": [], "users": [], "prefixes": []}
+    def record(name: str) -> Any:
+        def hook(req: Any) -> Any:
+            seen[name].append(req.msg)
+            return req
+        return hook
+    plugin.register_recv_hook(record("all"))
+    plugin.register_recv_hook(types={REQ.MSG_NEW})(record("types"))
+    plugin.register_recv_hook(sessions={2})(record("sessions"))
+    plugin.register_recv_hook(usrnames={"bob"})(record("users"))
+    plugin.register_recv_hook(prefixes=("-x", "-y"))(record("prefixes"))
+    plugs = plugins(plugin)
+    async def main() -> None:
+        await plugs.recv_msg(message(msg="one"))
+        await plugs.recv_msg(message(session=2, msg="two"))
+        await plugs.recv_msg(message(usrname="bob", msg="three"))
+        await plugs.recv_msg(message(msg="-y four"))
+        await plugs.recv_msg(message(type=REQ.CTL_SESS, msg="five"))
+    asyncio.run(main())
+    assert seen == {
+        "all": ["one", "two", "three", "-y four", "five"],
+        "types": ["one", "two", "three", "-y four"],
+        "sessions": ["two"],
+        "users": ["three"],
+        "prefixes": ["-y four"],
+    }
+
+def test_hooks_run_in_order_and_can_drop() -> None:
+    first, second = new_plugin("first"), new_plugin("second")
+    @first.register_recv_hook
+    def _(req: Any) -> Any:
+        return None if req.msg == "drop" else req._replace(msg=req.msg + " first")
+    @second.register_recv_hook
+    async def _(req: Any) -> Any:
+        return req._replace(msg=req.msg + " second")
+    plugs = plugins(first, second)
+    async def main() -> list[Any]:
+        return [await plugs.recv_msg(message(msg=i)) for i in ("keep", "drop")]
+    kept, dropped = asyncio.run(main())
+    assert kept.msg == "keep first second" and dropped is None
+
+def test_hooks_registered_later_are_used() -> None:
+    plugin = new_plugin()
+    plugs = plugins(plugin)
+    plugin._on_change = plugs.rebuild
+    async def main() -> Any:
+        # the chain of MSG_NEW in session 1 is cached now
+        await plugs.recv_msg(message())
+        plugin.register_recv_hook(types={REQ.MSG_NEW})(lambda req: None)
+        return await plugs.recv_msg(message())
+    assert asyncio.run(main()) is None
+
+def observing_plugin(overflow: str, release: asyncio.Event, seen: list[str]) -> Plugin:
+    plugin = new_plugin()
+    plugin.concurrency = 1
+    plugin.queue_size = 2
+    plugin.overflow = overflow  # type: ignore[assignment]
+    @plugin.register_recv_hook(observe=True)
+    async def _(req: Any) -> None:
+        await release.wait()
+        seen.append(req.msg)
+    return plugin
+
+def test_observing_hooks_drop_when_full() -> None:
+    async def main() -> tuple[list[str], int]:
+        release, seen = asyncio.Event(), []
+        plugin = observing_plugin("drop", release, seen)
+        plugs = plugins(plugin)
+        for i in range(5):
+            # the hook's result is ignored, the message goes on at once
+            assert (await plugs.recv_msg(message(msg=str(i)))).msg == str(i)  # type: ignore[union-attr]
+        release.set()
+        await asyncio.sleep(0.05)
+        await plugin.close()
+        assert plugin._runner is not None
+        return seen, plugin._runner.dropped
+    assert asyncio.run(main()) == (["0", "1"], 3)
+
+def test_observing_hooks_block_when_full() -> None:
+    async def main() -> list[str]:
+        release, seen = asyncio.Event(), []
+        plugin = observing_plugin("block", release, seen)
+        plugs = plugins(plugin)
+        async def receive() -> None:
+            for i in range(5):
+                await plugs.recv_msg(message(msg=str(i)))
+        receiving = asyncio.create_task(receive())
+        await asyncio.sleep(0.05)
+        # the worker holds one and the queue two, the receiver waits
+        assert not receiving.done()
+        release.set()
+        await receiving
+        await asyncio.sleep(0.05)
+        await plugin.close()
+        return seen
+    assert asyncio.run(main()) == ["0", "1", "2", "3", "4"]
@@ -0,0 +1,75 @@
+import asyncio
+
+import pytest
+
+from vcc_py.constants import *
+from vcc_py.codec import RelayView, RequestView
+from vcc_py.mockd import ClientProtocol, MockServer
+from vcc_py.sock import Connection
+
+def record_types(server: MockServer) -> list[int]:
+    """the types of the frames the server receives, in order"""
+    seen: list[int] = []
+    handle = server.handle
+    def recording(client: ClientProtocol, req: RequestView | RelayView) -> None:
+        seen.append(req.type)
+        handle(client, req)
+    server.handle = recording  # type: ignore[method-assign]
+    return seen
+
+def test_control_lane_goes_first() -> None:
+    async def main() -> None:
+        async with MockServer() as server:
+            async with Connection("127.0.0.1", server.port, "alice") as conn:
+                await conn.login("")
+                seen = record_types(server)
+                async with conn.batch():
+                    await conn.send(type=REQ.MSG_SEND, msg="one")
+                    await conn.send_relay(msg="two", visible="bob")
+                    await conn.send(type=REQ.CTL_SESS)
+                await conn.send(type=REQ.CTL_SESS)
+                while len(seen) < 4:
+                    await asyncio.sleep(0.01)
+                assert seen == [REQ.CTL_SESS, REQ.MSG_SEND, REQ.REL_MSG, REQ.CTL_SESS]
+    asyncio.run(main())
+
+def test_chat_senders_wait_for_room() -> None:
+    async def main() -> None:
+        async with MockServer() as server:
+            async with Connection("127.0.0.1", server.port, "alice", max_queued=2 * REQ_SIZE) as conn:
+                await conn.login("")
+                seen = record_types(server)
+                async with conn.batch():
+                    for i in range(5):
+                        await conn.send(type=REQ.MSG_SEND, msg=str(i))
+                        assert len(conn._lanes[1].buf) <= conn.max_queued
+                    # control frames are never held back
+                    for i in range(5):
+                        await conn.send(type=REQ.CTL_SESS)
+                    assert len(conn._lanes[0].buf) == 5 * REQ_SIZE
+                assert conn.blocked > 0
+                while len(seen) < 10:
+                    await asyncio.sleep(0.01)
+                assert seen.count(REQ.MSG_SEND) == 5
+    asyncio.run(main())
+
+def test_cancelling_the_flush_task() -> None:
+    async def main() -> None:
+        async with MockServer() as server:
+            async with Connection("127.0.0.1", server.port, "alice") as conn:
+                await conn.login("")
+                for client in server.clients:
+                    assert client.transport is not None
+                    client.transport.pause_reading()
+                # more than the socket buffers hold, so the write can't finish
+                data = bytes(REQ_SIZE) * 65536
+                waiter = conn._write(data, True)
+                task = conn._flush_task
+                assert task is not None
+                await asyncio.sleep(0.1)
+                assert not task.done()
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+                assert waiter.cancelled()
+    asyncio.run(main())
@@ -0,0 +1,22 @@
+from types import SimpleNamespace
+from typing import Any
+
+from vcc_py.metrics import REGISTRY, Registry
+from vcc_py.plugin import Plugin
+
+def test_label_values_are_escaped() -> None:
+    registry = Registry()
+    registry.counter("vcc_test_total", "a test", path='C:\\dir "x"\nnext').inc()
+    assert 'vcc_test_total{path="C:\\\\dir \\"x\\"\\nnext"} 1' in registry.render()
+
+def test_hooks_are_labelled_by_their_place() -> None:
+    plugin = Plugin(SimpleNamespace(), SimpleNamespace(), "labels")  # type: ignore[arg-type]
+    def _(req: Any) -> Any:
+        return req
+    plugin.register_recv_hook(_)
+    plugin.register_recv_hook(_)
+    timers = [i.timer for i in plugin._recv_hooks]
+    assert timers[0].histogram is not timers[1].histogram
+    rendered = REGISTRY.render()
+    assert 'vcc_hook_seconds_count{hook="0",kind="recv",plugin="labels"}' in rendered
+    assert 'vcc_hook_seconds_count{hook="1",kind="recv",plugin="labels"}' in rendered
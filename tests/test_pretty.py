@@ -0,0 +1,52 @@
+import asyncio
+import io
+import sys
+import threading
+import time
+
+import pytest
+
+from vcc_py.pretty import Renderer
+
+class SlowTerminal(io.StringIO):
+    def __init__(self) -> None:
+        super().__init__()
+        self.threads: set[int] = set()
+
+    def write(self, text: str) -> int:
+        self.threads.add(threading.get_ident())
+        time.sleep(0.2)
+        return super().write(text)
+
+def test_a_slow_terminal_doesnt_block_the_loop(monkeypatch: pytest.MonkeyPatch) -> None:
+    terminal = SlowTerminal()
+    monkeypatch.setattr(sys, "stdout", terminal)
+    async def main() -> float:
+        renderer = Renderer(lambda: "$: ", rate=1000, max_lines=5)
+        renderer.add("first")
+        renderer.flush()
+        # the loop goes on while the first write sleeps
+        start = time.monotonic()
+        for i in range(20):
+            renderer.add(f"line {i}")
+            await asyncio.sleep(0.001)
+        elapsed = time.monotonic() - start
+        await renderer.drain()
+        return elapsed
+    assert asyncio.run(main()) < 0.15
+    assert threading.get_ident() not in terminal.threads
+    out = terminal.getvalue()
+    assert out.index("first") < out.index("15 messages skipped") < out.index("line 19")
+    assert "line 14\n" not in out
+
+def test_drain_comes_before_what_is_printed_next(monkeypatch: pytest.MonkeyPatch) -> None:
+    terminal = SlowTerminal()
+    monkeypatch.setattr(sys, "stdout", terminal)
+    async def main() -> None:
+        renderer = Renderer(lambda: "$: ")
+        renderer.add("message")
+        await renderer.drain()
+        print("command output")
+    asyncio.run(main())
+    out = terminal.getvalue()
+    assert out.index("message") < out.index("command output")
@@ -0,0 +1,43 @@
+import pytest
+
+from vcc_py.constants import *
+from vcc_py.ratelimit import RateLimiter, TokenBucket, parse_rate
+
+def test_bucket_refills_at_its_rate() -> None:
+    bucket = TokenBucket(10, 5)
+    now = bucket.updated
+    assert [bucket.reserve(1, now) for _ in range(5)] == [0, 0, 0, 0, 0]
+    # empty, the next token comes in 0.1s and the one after in 0.2s
+    assert bucket.reserve(1, now) == pytest.approx(0.1)
+    assert bucket.wait_time(1, now) == pytest.approx(0.2)
+    assert bucket.wait_time(1, now + 0.2) == pytest.approx(0)
+
+def test_bucket_saves_at_most_burst() -> None:
+    bucket = TokenBucket(10, 5)
+    now = bucket.updated + 100
+    assert [bucket.reserve(1, now) for _ in range(5)] == [0, 0, 0, 0, 0]
+    assert bucket.wait_time(1, now) > 0
+
+@pytest.mark.parametrize("text, expected", [("10/20", (10, 20)), ("5", (5, 5)), ("0.5", (0.5, 1))])
+def test_parse_rate(text: str, expected: tuple[float, float]) -> None:
+    assert parse_rate(text) == expected
+
+@pytest.mark.parametrize("text", ["0", "-1/5", "x", "10/0"])
+def test_parse_bad_rate(text: str) -> None:
+    with pytest.raises(ValueError):
+        parse_rate(text)
+
+def test_bad_config_turns_limits_off() -> None:
+    assert RateLimiter.from_config_or_none({"rate_limit_types": "NOPE=1/1"}) is None
+    assert RateLimiter.from_config_or_none({"rate_limit": "0"}) is None
+    assert RateLimiter.from_config_or_none({}) is None
+
+def test_control_frames_skip_the_chat_buckets() -> None:
+    limiter = RateLimiter.from_config({"rate_limit": "1/1", "rate_limit_session": "1/1", "rate_limit_types": "CTL_SESS=1/1"})
+    assert limiter is not None
+    limiter.reserve(REQ.MSG_SEND, 0)
+    assert limiter.wait_time(REQ.MSG_SEND, 0) > 0
+    assert limiter.wait_time(REQ.CTL_UINFO, 0) == 0
+    # a limit given for the type still applies
+    limiter.reserve(REQ.CTL_SESS, 0)
+    assert limiter.wait_time(REQ.CTL_SESS, 0) > 0
@@ -0,0 +1,86 @@
+import asyncio
+from typing import Callable
+
+import pytest
+
+from vcc_py.constants import *
+from vcc_py.mockd import MockServer, UserInfo
+from vcc_py.reconnect import ReconnectError, ReconnectingConnection
+from vcc_py.sock import Connection
+
+async def wait_until(check: Callable[[], bool], timeout: float = 5.0) -> None:
+    async def poll() -> None:
+        while not check():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), timeout)
+
+def test_outbox_is_sent_after_reconnecting() -> None:
+    async def main() -> None:
+        async with MockServer() as server:
+            async with Connection("127.0.0.1", server.port, "bob") as bob, \
+                    ReconnectingConnection("127.0.0.1", server.port, "alice", min_delay=0.2, max_delay=0.2) as alice:
+                await bob.login("")
+                await alice.login("")
+                receiving = asyncio.create_task(alice.recv_view())
+                for client in list(server.clients):
+                    if client.usrname == "alice":
+                        client.close()
+                await wait_until(lambda: not alice.online)
+                await alice.send(type=REQ.MSG_SEND, session=0, msg="while offline")
+                assert len(alice._outbox) == 1
+                await wait_until(lambda: alice.reconnects == 1)
+                view = await asyncio.wait_for(bob.recv_view(), 5)
+                assert (view.type, view.usrname, view.msg) == (REQ.MSG_NEW, "alice", "while offline")
+                assert not alice._outbox
+                receiving.cancel()
+    asyncio.run(main())
+
+def test_refused_login_raises() -> None:
+    async def main() -> None:
+        async with MockServer(users={"alice": "secret"}) as server:
+            async with ReconnectingConnection("127.0.0.1", server.port, "alice", min_delay=0.01, max_delay=0.01) as alice:
+                await alice.login("secret")
+                server.users["alice"].password = "changed"
+                for client in list(server.clients):
+                    client.close()
+                with pytest.raises(ReconnectError):
+                    await asyncio.wait_for(alice.recv_view(), 5)
+    asyncio.run(main())
+
+def test_login_without_answer_is_retried(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("vcc_py.reconnect.REQUEST_TIMEOUT", 0.2)
+    async def main() -> None:
+        async with MockServer() as server:
+            async with ReconnectingConnection("127.0.0.1", server.port, "alice", min_delay=0.01, max_delay=0.01) as alice:
+                await alice.login("")
+                # the server accepts the connection but never answers the login
+                handle = server.handle
+                server.handle = lambda client, req: None  # type: ignore[method-assign]
+                for client in list(server.clients):
+                    client.close()
+                receiving = asyncio.create_task(alice.recv_view())
+                await asyncio.sleep(0.5)
+                assert not alice.online and not receiving.done()
+                server.handle = handle  # type: ignore[method-assign]
+                await wait_until(lambda: alice.reconnects == 1)
+                receiving.cancel()
+    asyncio.run(main())
+
+def test_requests_sent_offline_keep_their_responses() -> None:
+    async def main() -> None:
+        async with MockServer() as server:
+            server.users["bob"] = UserInfo(score=10, level=2)
+            async with ReconnectingConnection("127.0.0.1", server.port, "alice", min_delay=0.2, max_delay=0.2) as alice:
+                await alice.login("")
+                async def receive() -> None:
+                    while True:
+                        await alice.recv_view()
+                receiving = asyncio.create_task(receive())
+                for client in list(server.clients):
+                    client.close()
+                await wait_until(lambda: not alice.online)
+                # answered after the bootstrap lookup of alice if the outbox is replayed last
+                view = await alice.request(type=REQ.CTL_UINFO, msg="bob")
+                assert view.raw_msg[8:11] == b"bob"
+                receiving.cancel()
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+import asyncio
+from typing import Any, Awaitable, Callable
+
+import pytest
+
+from vcc_py.constants import *
+from vcc_py.mockd import MockServer, UserInfo
+from vcc_py.sock import Connection
+
+def run(test: Callable[[MockServer, Connection], Awaitable[Any]]) -> Any:
+    """run test with a server and a connection logged in as alice, whose frames are being received"""
+    async def main() -> Any:
+        async with MockServer() as server:
+            server.users["bob"] = UserInfo(score=10, level=2)
+            server.users["carol"] = UserInfo(score=20, level=3)
+            async with Connection("127.0.0.1", server.port, "alice") as conn:
+                await conn.login("")
+                async def receive() -> None:
+                    while True:
+                        await conn.recv_view()
+                receiving = asyncio.create_task(receive())
+                try:
+                    return await test(server, conn)
+                finally:
+                    receiving.cancel()
+    return asyncio.run(main())
+
+def test_responses_are_matched_in_order() -> None:
+    async def test(server: MockServer, conn: Connection) -> None:
+        views = await asyncio.gather(*[conn.request(type=REQ.CTL_UINFO, msg=name) for name in ("bob", "carol", "bob")])
+        assert [i.raw_msg[8:13].rstrip(b"\0") for i in views] == [b"bob", b"carol", b"bob"]
+        assert not conn._pending
+    run(test)
+
+def test_timeout_removes_the_waiter() -> None:
+    async def test(server: MockServer, conn: Connection) -> None:
+        # the mock server doesn't answer CTL_IALOG
+        with pytest.raises(asyncio.TimeoutError):
+            await conn.request(type=REQ.CTL_IALOG, timeout=0.1)
+        assert not conn._pending
+    run(test)
+
+def test_requests_wait_for_dispatch() -> None:
+    async def main() -> list[str]:
+        async with MockServer() as server:
+            async with Connection("127.0.0.1", server.port, "alice") as conn:
+                await conn.login("")
+                conn.dispatching = True
+                order: list[str] = []
+                async def receive() -> None:
+                    while True:
+                        view = await conn.recv_view()
+                        await asyncio.sleep(0.01)
+                        order.append("handled")
+                        conn.dispatched(view)
+                receiving = asyncio.create_task(receive())
+                await conn.request(type=REQ.CTL_UINFO, msg="alice")
+                order.append("returned")
+                receiving.cancel()
+                return order
+    assert asyncio.run(main()) == ["handled", "returned"]
+
+def test_tracked_requests_keep_their_place() -> None:
+    async def test(server: MockServer, conn: Connection) -> None:
+        # the response of alice comes first and mustn't be taken for bob
+        await conn.send_tracked(type=REQ.CTL_UINFO, msg="alice")
+        info = await conn.data.users.lookup(conn, "bob")
+        assert info is not None and (info.usrname, info.level) == ("bob", 2)
+    run(test)
+
+def test_lookups_are_batched_and_cached() -> None:
+    async def test(server: MockServer, conn: Connection) -> None:
+        infos = await conn.data.users.lookup_many(conn, ["bob", "carol", "nobody", "bob"])
+        assert {k: v and v.score for k, v in infos.items()} == {"bob": 10, "carol": 20, "nobody": None}
+        server.users["bob"].score = 11
+        # served from the cache
+        info = await conn.data.users.lookup(conn, "bob")
+        assert info is not None and info.score == 10
+    run(test)
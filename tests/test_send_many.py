@@ -0,0 +1,52 @@
+import asyncio
+
+from vcc_py.constants import *
+from vcc_py.codec import RelayView, RequestView
+from vcc_py.mockd import ClientProtocol, MockServer
+from vcc_py.sock import Connection
+
+def record_msgs(server: MockServer) -> list[str]:
+    """the messages the server receives, in order"""
+    seen: list[str] = []
+    handle = server.handle
+    def recording(client: ClientProtocol, req: RequestView | RelayView) -> None:
+        seen.append(req.msg)
+        handle(client, req)
+    server.handle = recording  # type: ignore[method-assign]
+    return seen
+
+async def wait_for_count(seen: list[str], count: int) -> None:
+    async def poll() -> None:
+        while len(seen) < count:
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(poll(), 5)
+
+def test_send_many_is_one_write() -> None:
+    async def main() -> None:
+        async with MockServer() as server:
+            async with Connection("127.0.0.1", server.port, "alice") as conn:
+                await conn.login("")
+                seen = record_msgs(server)
+                writes = conn.writes
+                await conn.send_many([Request(VCC_MAGIC, REQ.MSG_SEND, 0, 0, 0, "alice", str(i)) for i in range(50)])
+                assert conn.writes == writes + 1
+                await wait_for_count(seen, 50)
+                assert seen == [str(i) for i in range(50)]
+    asyncio.run(main())
+
+def test_sends_in_a_batch_are_coalesced() -> None:
+    async def main() -> None:
+        async with MockServer() as server:
+            async with Connection("127.0.0.1", server.port, "alice") as conn:
+                await conn.login("")
+                seen = record_msgs(server)
+                writes = conn.writes
+                async with conn.batch():
+                    for i in range(3):
+                        await conn.send(type=REQ.MSG_SEND, msg=str(i))
+                    # nothing is written before the end of the batch
+                    assert conn.writes == writes
+                assert conn.writes == writes + 1
+                await wait_for_count(seen, 3)
+                assert seen == ["0", "1", "2"]
+    asyncio.run(main())
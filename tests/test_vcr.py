@@ -0,0 +1,40 @@
+import asyncio
+import runpy
+import sys
+from types import SimpleNamespace
+from typing import Any
+
+from vcc_py.plugin import Plugin
+
+def load_vcr() -> dict[str, Any]:
+    configs: Any = SimpleNamespace(config={"vcr_listen_sid": 3, "vcr_executable": "cat", "vcr_mode": "worker"})
+    plugin = Plugin(SimpleNamespace(), configs, "vcr")
+    return runpy.run_module("vcc_py.plugins.vcr", {"plugin": plugin})
+
+def test_replies_are_parsed() -> None:
+    parse_reply = load_vcr()["parse_reply"]
+    assert parse_reply("plain text") == ("plain text", 3)
+    assert parse_reply('{"msg": "hi"}') == ("hi", 3)
+    assert parse_reply('{"msg": "hi", "session": 5}') == ("hi", 5)
+    assert parse_reply('{"msg": "hi", "session": "5"}') == ("hi", 5)
+    assert parse_reply('[1, 2]') == ("[1, 2]", 3)
+    for session in ['"five"', "1.5", "true", "null", "[]", "-1", "4294967296", '"\\u00b2"']:
+        assert parse_reply(f'{{"msg": "hi", "session": {session}}}') is None
+
+def test_bad_replies_dont_stop_the_reader() -> None:
+    module = load_vcr()
+    sent: list[tuple[int, str]] = []
+    async def send(*, type: int, session: int, msg: str) -> None:
+        if msg == "fail":
+            raise ValueError("can't send it")
+        sent.append((session, msg))
+    data: Any = SimpleNamespace(plugs=SimpleNamespace(connection=SimpleNamespace(send=send)))
+    lines = ['{"msg": "a", "session": "x"}', "fail", '{"msg": "b", "session": 1}', "c"]
+    async def main() -> None:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-c", f"print({chr(10).join(lines)!r})", stdout=asyncio.subprocess.PIPE
+        )
+        await module["Workers"](data).read_replies(proc)
+        await proc.wait()
+    asyncio.run(main())
+    assert sent == [(1, "b"), (3, "c")]
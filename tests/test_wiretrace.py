@@ -0,0 +1,39 @@
+import asyncio
+import io
+from pathlib import Path
+
+import pytest
+
+from vcc_py.constants import *
+from vcc_py.mockd import MockServer
+from vcc_py.sock import Connection
+from vcc_py.wiretrace import RECORD_STRUCT, RECV, SEND, START, TRACE_MAGIC, WireTrace, describe, read_trace
+
+def test_frames_are_recorded_and_read_back(tmp_path: Path) -> None:
+    path = tmp_path / "vcc.trace"
+    async def main() -> None:
+        async with MockServer() as server:
+            async with Connection("127.0.0.1", server.port, "alice") as alice, Connection("127.0.0.1", server.port, "bob") as bob:
+                with WireTrace(path) as tracer:
+                    alice.tracer = tracer
+                    await alice.login("secret")
+                    await bob.login("")
+                    await bob.send_relay(session=0, msg="psst", visible="alice")
+                    await alice.recv_view()
+                    await alice.send(type=REQ.MSG_SEND, session=0, msg="hello")
+    asyncio.run(main())
+    with open(path, "rb") as file:
+        records = list(read_trace(file))
+    assert [i.direction for i in records] == [START, SEND, RECV, RECV, SEND]
+    login = records[1].view()
+    assert login.type == REQ.CTL_LOGIN and login.msg == ""
+    lines = [describe(i, records[0].time) for i in records]
+    assert lines[0].startswith("---- run started at")
+    assert " send CTL_LOGIN " in lines[1] and "secret" not in lines[1]
+    assert " recv REL_NEW " in lines[3] and "msg='psst'" in lines[3]
+    assert " send MSG_SEND " in lines[4] and "msg='hello'" in lines[4]
+
+def test_corrupt_record_kind() -> None:
+    data = TRACE_MAGIC + RECORD_STRUCT.pack(0.0, 200, 0)
+    with pytest.raises(ValueError):
+        list(read_trace(io.BytesIO(data)))
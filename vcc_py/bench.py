@@ -0,0 +1,266 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General 
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at 
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the 
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public 
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see 
+# <https://www.gnu.org/licenses/>. 
+
+# Benchmarks of the client hot paths against an in-process MockServer. Results can be saved as a JSON
+# baseline and compared with a later run, e.g.
+#   python -m vcc_py.bench --save baseline.json
+#   python -m vcc_py.bench --compare baseline.json
+
+from __future__ import annotations
+
+from typing import Any, Awaitable, Callable, NamedTuple
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import platform
+import struct
+import sys
+import time
+import tracemalloc
+
+from .constants import *
+from .codec import RequestView, decode_frame, pack_relay, pack_request
+from .config import Configs
+from .mockd import MockServer, pack_names
+from .plugin import Plugin, Plugins
+from .sock import Connection
+from .bh import do_bh
+from . import pretty
+
+class Result(NamedTuple):
+    name: str
+    ops: int
+    throughput: float
+    p50_us: float
+    p99_us: float
+    alloc_bytes: float
+
+def percentile(samples: list[int], pct: float) -> float:
+    """percentile of sorted nanosecond samples, in microseconds"""
+    return samples[min(len(samples) - 1, int(len(samples) * pct))] / 1000
+
+def make_result(name: str, samples: list[int], total_ns: int, alloc_bytes: float) -> Result:
+    samples.sort()
+    return Result(name, len(samples), len(samples) / (total_ns / 1e9), percentile(samples, 0.5), percentile(samples, 0.99), alloc_bytes)
+
+def measure_allocs(op: Callable[[], Any], count: int) -> float:
+    """average peak of memory allocated by one call"""
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(count):
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            op()
+            total += tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return total / count
+
+async def ameasure_allocs(op: Callable[[], Awaitable[Any]], count: int) -> float:
+    tracemalloc.start()
+    try:
+        total = 0
+        for _ in range(count):
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            await op()
+            total += tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    return total / count
+
+def measure(name: str, op: Callable[[], Any], count: int) -> Result:
+    for _ in range(max(1, count // 10)):
+        op()
+    samples: list[int] = []
+    clock = time.perf_counter_ns
+    start = clock()
+    for _ in range(count):
+        t = clock()
+        op()
+        samples.append(clock() - t)
+    total = clock() - start
+    return make_result(name, samples, total, measure_allocs(op, max(1, count // 10)))
+
+async def ameasure(name: str, op: Callable[[], Awaitable[Any]], count: int) -> Result:
+    for _ in range(max(1, count // 10)):
+        await op()
+    samples: list[int] = []
+    clock = time.perf_counter_ns
+    start = clock()
+    for _ in range(count):
+        t = clock()
+        await op()
+        samples.append(clock() - t)
+    total = clock() - start
+    return make_result(name, samples, total, await ameasure_allocs(op, max(1, count // 10)))
+
+def make_plugins(conn: Connection, count: int) -> Plugins:
+    """Plugins with count plugins which have a pass-through send and recv hook each"""
+    configs = Configs({})
+    plugs = Plugins(conn, configs=configs)
+    plugs.configs = configs
+    plugs.modules = []
+    for _ in range(count):
+        plug = Plugin(conn.data, configs)
+        plug.register_send_hook(lambda msg: msg)
+        plug.register_recv_hook(lambda req: req)
+        plugs.plugs.append(plug)
+    plugs.rebuild()
+    return plugs
+
+async def bench_wire(count: int) -> list[Result]:
+    results: list[Result] = []
+    async with MockServer() as server:
+        async with (
+            Connection("127.0.0.1", server.port, "bench-sender") as sender,
+            Connection("127.0.0.1", server.port, "bench-receiver") as receiver,
+        ):
+            await sender.login("")
+            await receiver.login("")
+            results.append(await ameasure("send", lambda: sender.send(msg="benchmark message"), count))
+            results.append(await ameasure("send_relay", lambda: sender.send_relay(msg="benchmark message", visible=""), count))
+
+            # everything above was fanned out to the receiver, drain it first
+            await sender.send(type=REQ.CTL_SENAME, session=-1)
+            while (await sender.recv_view()).type != REQ.CTL_SENAME:
+                pass
+            await receiver.send(type=REQ.CTL_SENAME, session=-1)
+            while (await receiver.recv_view()).type != REQ.CTL_SENAME:
+                pass
+            # warming up, timing and counting allocations take count + 2 * count // 10 messages
+            total = count + 2 * max(1, count // 10)
+            await sender.send_many([Request(VCC_MAGIC, REQ.MSG_SEND, 0, 0, 0, "bench-sender", "benchmark message")] * total)
+            results.append(await ameasure("recv", receiver.recv, count))
+    return results
+
+def bench_decode(count: int) -> list[Result]:
+    frame = pack_request(magic=VCC_MAGIC, type=REQ.MSG_NEW, uid=0, session=1, flags=0, usrname="someone", msg="benchmark message")
+    raw = RawRequest._make(struct.unpack(VCC_REQUEST_FORMAT, frame))
+    return [
+        measure("decode", lambda: decode_frame(frame).to_tuple(), count),
+        measure("to_normal", lambda: [Connection.to_normal(i) for i in raw], count),
+    ]
+
+async def bench_hooks(count: int, plugin_count: int) -> list[Result]:
+    conn = Connection("127.0.0.1")
+    plugs = make_plugins(conn, plugin_count)
+    req = Request(VCC_MAGIC, REQ.MSG_NEW, 0, 1, 0, "someone", "benchmark message")
+    return [
+        await ameasure(f"recv_msg[{plugin_count}]", lambda: plugs.recv_msg(req), count),
+        await ameasure(f"send_msg[{plugin_count}]", lambda: plugs.send_msg("benchmark message"), count),
+    ]
+
+def bench_bh(count: int) -> list[Result]:
+    data = Connection("127.0.0.1").data
+    users = [f"user{i}" for i in range(1000)]
+    users_frame = pack_relay(magic=VCC_MAGIC_RL, type=REQ.CTL_USRS, uid=len(users), session=0, usrname="", visible="", msg=pack_names(users))
+    sessions = [f"session{i}" for i in range(MSG_SIZE // USERNAME_SIZE)]
+    sess_frame = pack_request(magic=VCC_MAGIC, type=REQ.CTL_SESS, uid=len(sessions), session=0, flags=0, usrname="", msg=pack_names(sessions))
+    users_view, sess_view = decode_frame(users_frame), decode_frame(sess_frame)
+    users_req, users_raw = users_view.to_tuple(), users_view.to_raw()
+    sess_req, sess_raw = sess_view.to_tuple(), sess_view.to_raw()
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        def ls() -> None:
+            do_bh(users_req, users_raw, data)
+            out.seek(0)
+            out.truncate()
+        def lsse() -> None:
+            assert isinstance(sess_view, RequestView)
+            data.sessions.observe(sess_view)
+            do_bh(sess_req, sess_raw, data)
+            out.seek(0)
+            out.truncate()
+        return [
+            measure(f"do_bh CTL_USRS[{len(users)}]", ls, max(1, count // 100)),
+            measure(f"do_bh CTL_SESS[{len(sessions)}]", lsse, count),
+        ]
+
+def bench_pretty(count: int) -> list[Result]:
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        def show() -> None:
+            pretty.show_msg("someone", "benchmark message", 1, newlinefirst=True)
+            out.seek(0)
+            out.truncate()
+        renderer = pretty.Renderer(lambda: "$: ", out=out)
+        def render() -> None:
+            renderer.show_msg("someone", "benchmark message", 1)
+            if len(renderer._lines) >= 100:
+                renderer.flush()
+                out.seek(0)
+                out.truncate()
+        results = [measure("show_msg", show, count), measure("Renderer.show_msg", render, count)]
+        renderer.flush()
+        return results
+
+async def run(count: int, plugin_count: int) -> list[Result]:
+    results = await bench_wire(count)
+    results += bench_decode(count)
+    results += await bench_hooks(count, plugin_count)
+    results += bench_bh(count)
+    results += bench_pretty(count)
+    return results
+
+def to_json(results: list[Result]) -> dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": {i.name: i._asdict() for i in results},
+    }
+
+def compare(results: list[Result], baseline: dict[str, Any], threshold: float) -> bool:
+    """print the difference from the baseline, return whether something is slower than threshold"""
+    regressed = False
+    old_results: dict[str, dict[str, float]] = baseline["results"]
+    for i in results:
+        old = old_results.get(i.name)
+        if old is None:
+            continue
+        change = i.throughput / old["throughput"] - 1
+        mark = ""
+        if change < -threshold:
+            mark = "  REGRESSION"
+            regressed = True
+        print(f"{i.name:<24}{old['throughput']:>14.0f} -> {i.throughput:<14.0f}{change:+8.1%}{mark}")
+    return regressed
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the hot paths of vcc", prog="vcc-bench")
+    parser.add_argument("-n", "--count", type=int, metavar="count", default=10000, help="iterations of each benchmark (default: 10000)")
+    parser.add_argument("--plugins", type=int, metavar="count", default=10, help="plugins loaded for the hook benchmarks (default: 10)")
+    parser.add_argument("--save", type=str, metavar="file", help="save the results as a JSON baseline")
+    parser.add_argument("--compare", type=str, metavar="file", help="compare the results with a JSON baseline")
+    parser.add_argument("--threshold", type=float, metavar="ratio", default=0.1, help="throughput drop reported as a regression (default: 0.1)")
+    return parser.parse_args()
+
+def main() -> None:
+    args = parse_args()
+    results = asyncio.run(run(args.count, args.plugins))
+    print(f"{'benchmark':<24}{'ops/s':>12}{'p50 us':>10}{'p99 us':>10}{'alloc B/op':>12}")
+    for i in results:
+        print(f"{i.name:<24}{i.throughput:>12.0f}{i.p50_us:>10.2f}{i.p99_us:>10.2f}{i.alloc_bytes:>12.0f}")
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(to_json(results), f, indent=4)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
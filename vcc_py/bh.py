@@ -11,44 +11,42 @@
 # You should have received a copy of the GNU General Public License along with vcc.py. If not, see 
 # <https://www.gnu.org/licenses/>. 
 
-import struct
-import socket
+from typing import Final
 import logging
+import time
 
 from .constants import *
+from .users import UserInfo, parse_user
+from .metrics import REGISTRY
+
+BH_TIME: Final = REGISTRY.histogram("vcc_bh_seconds", "time to handle a response")
 
 def do_lsse_bh(req: Request, req_raw: RawRequest, data: MyData) -> None:
     """List the sessions"""
-    logging.debug(f"Lsse bh: score: {req.uid}")
-    data.sess_list = [req_raw.msg[i * USERNAME_SIZE: (i + 1) * USERNAME_SIZE].decode().split("\0", 2)[0] for i in range(req.uid)]
+    logging.debug("Lsse bh: score: %d", req.uid)
+    # Connection has put them into data.sessions
+    data.sess_list = data.sessions.names()
     if not data.type:
         print("\n".join(data.sess_list))
     data.type = False
 
-USER_FORMAT = f"<ii{USERNAME_SIZE}s{PASSWD_SIZE}s{MSG_SIZE - USERNAME_SIZE - PASSWD_SIZE - 2 * 4}x"
-
-def do_uinfo_bh(req: Request, req_raw: RawRequest, data: MyData) -> None:
+def show_user(info: UserInfo | None, data: MyData) -> None:
     """Show user info"""
-    logging.debug(f"Uinfo bh: uid: {req.uid}")
-    if req.uid == -1:
-        print("User not found")
-        return
-    score: int
-    level: int
-    username: bytes
-    score, level, username, _ = struct.unpack(USER_FORMAT, req_raw.msg)
-    logging.debug(f"Uinfo bh: score (not ntohl): {score}")
-    logging.debug(f"Uinfo bh: level (not ntohl): {level}")
-    if score < 0 or level < 0:
+    if info is None:
         print("User not found")
-        return
-    if data.usrname == username.decode().split("\x00")[0]:
-        print(f"level of yourself: {socket.ntohl(level)}")
-        data.level = socket.ntohl(level)
+    elif data.usrname == info.usrname:
+        print(f"level of yourself: {info.level}")
     else:
-        print(f"{username.decode().split(chr(0))[0]}'s info: ")
+        print(f"{info.usrname}'s info: ")
         print("\tscore\tlevel")
-        print(f"\t{socket.ntohl(score):<5}\t{socket.ntohl(level):<5}")
+        print(f"\t{info.score:<5}\t{info.level:<5}")
+
+def do_uinfo_bh(req: Request, req_raw: RawRequest, data: MyData) -> None:
+    """Keep the level of myself, -uinfo and -lself show the user themselves"""
+    logging.debug("Uinfo bh: uid: %d", req.uid)
+    info = parse_user(req.uid, req_raw.msg)
+    if info is not None and info.usrname == data.usrname:
+        data.level = info.level
 
 def do_incr_bh(req: Request) -> None:
     """Increase score"""
@@ -60,7 +58,7 @@ def do_incr_bh(req: Request) -> None:
 
 def do_ls_bh(req: Relay, req_raw: RawRelay) -> None:
     """List the users"""
-    logging.debug(f"Number of the response of '-ls': {req.uid}")
+    logging.debug("Number of the response of '-ls': %d", req.uid)
     for i in range(req.uid):
         print(req_raw.msg[i * USERNAME_SIZE: (i + 1) * USERNAME_SIZE].decode())
 
@@ -70,8 +68,25 @@ def do_sename_bh(req: Request) -> None:
         return
     print(f"{req.session}: {req.msg}")
 
+def do_newse_bh(req: Request) -> None:
+    if req.session == -1:
+        print("Cannot create the session")
+        return
+    print(f"New session: {req.session}: {req.msg}")
+
+def do_joins_bh(req: Request) -> None:
+    if req.uid:
+        print("No such session")
+
 def do_bh(req: Request | Relay, req_raw: RawRequest | RawRelay, data: MyData) -> None:
-    logging.debug(f"Message type: {req.type}")
+    start = time.perf_counter()
+    try:
+        handle_response(req, req_raw, data)
+    finally:
+        BH_TIME.record((time.perf_counter() - start) * 1e6)
+
+def handle_response(req: Request | Relay, req_raw: RawRequest | RawRelay, data: MyData) -> None:
+    logging.debug("Message type: %d", req.type)
     if not (isinstance(req, Request) and isinstance(req_raw, RawRequest)) and not (isinstance(req, Relay) and isinstance(req_raw, RawRelay)):
         raise Exception(f"Internal error")
     if isinstance(req, Request) and isinstance(req_raw, RawRequest):
@@ -84,6 +99,12 @@ def do_bh(req: Request | Relay, req_raw: RawRequest | RawRelay, data: MyData) ->
                 do_incr_bh(req)
             case REQ.CTL_SENAME:
                 do_sename_bh(req)
+            case REQ.CTL_NEWSE:
+                do_newse_bh(req)
+            case REQ.CTL_JOINS:
+                do_joins_bh(req)
+            case REQ.CTL_QUITS:
+                pass
             case _:
                 raise Exception(f"Unknown response type: {req.type}, please update and retry")
     elif isinstance(req, Relay) and isinstance(req_raw, RawRelay):
@@ -0,0 +1,228 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General 
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at 
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the 
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public 
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see 
+# <https://www.gnu.org/licenses/>. 
+
+from __future__ import annotations
+
+from typing import Any, Final, Iterator
+import socket
+import struct
+
+from .constants import *
+
+REQUEST_STRUCT: Final = struct.Struct(VCC_REQUEST_FORMAT)
+RELAY_HEADER_STRUCT: Final = struct.Struct(VCC_RELAY_HEADER_FORMAT)
+
+# ints on the wire are in network byte order, except flags which is sent as it is
+_NET_INT: Final = struct.Struct("!i")
+_NET_UINT: Final = struct.Struct("!I")
+_LE_INT: Final = struct.Struct("<i")
+
+# the same layout, but network order ints are packed as unsigned so every 32-bit value fits
+_REQUEST_PACK: Final = struct.Struct(f"<IIIIi{USERNAME_SIZE}s{MSG_SIZE}s")
+_RELAY_HEADER_PACK: Final = struct.Struct(f"<IIIII{USERNAME_SIZE}s{USERNAME_SIZE}s")
+
+_USRNAME_END: Final = 5 * 4 + USERNAME_SIZE
+_VISIBLE_END: Final = RELAY_HEADER_STRUCT.size
+
+def _unpack_int(st: struct.Struct, buf: memoryview, offset: int) -> int:
+    value: int = st.unpack_from(buf, offset)[0]
+    return value
+
+def htonl(value: int) -> int:
+    return socket.htonl(value & 0xffffffff)
+
+def encode_str(string: str | bytes) -> bytes:
+    """encode a string field, the NUL terminator is added to str"""
+    return (string + "\0").encode() if isinstance(string, str) else string
+
+def pack_request_into(
+    buf: bytearray | memoryview, offset: int, *,
+    magic: int, type: int, uid: int, session: int, flags: int, usrname: str | bytes, msg: str | bytes
+) -> None:
+    """pack a request into buf, it takes REQ_SIZE bytes"""
+    _REQUEST_PACK.pack_into(
+        buf, offset,
+        htonl(magic), htonl(type), htonl(uid), htonl(session), flags,
+        encode_str(usrname), encode_str(msg)
+    )
+
+def pack_request(
+    *, magic: int, type: int, uid: int, session: int, flags: int, usrname: str | bytes, msg: str | bytes
+) -> bytearray:
+    buf = bytearray(REQ_SIZE)
+    pack_request_into(buf, 0, magic=magic, type=type, uid=uid, session=session, flags=flags, usrname=usrname, msg=msg)
+    return buf
+
+def pack_relay(
+    *, magic: int, type: int, uid: int, session: int, usrname: str | bytes, visible: str | bytes, msg: str | bytes
+) -> bytearray:
+    """pack a relay header and its body into one buffer"""
+    body = encode_str(msg)
+    size = RELAY_HEADER_STRUCT.size + len(body)
+    buf = bytearray(size)
+    _RELAY_HEADER_PACK.pack_into(
+        buf, 0,
+        htonl(magic), htonl(type), htonl(size), htonl(uid), htonl(session),
+        encode_str(usrname), encode_str(visible)
+    )
+    buf[RELAY_HEADER_STRUCT.size:] = body
+    return buf
+
+def decode_str(buf: bytes | bytearray | memoryview) -> str:
+    """decode a NUL-terminated string field"""
+    return bytes(buf).split(b"\0", 1)[0].decode(errors="ignore")
+
+def frame_size(buf: bytes | bytearray | memoryview, start: int = 0, end: int | None = None) -> int | None:
+    """Size of the frame which starts at buf[start], or None if more data is needed to tell"""
+    available = (len(buf) if end is None else end) - start
+    if available < 4:
+        return None
+    if _NET_INT.unpack_from(buf, start)[0] == VCC_MAGIC:
+        return REQ_SIZE
+    if available < RELAY_HEADER_STRUCT.size:
+        return None
+    size: int = _NET_UINT.unpack_from(buf, start + 8)[0]
+    if not RELAY_HEADER_STRUCT.size <= size <= MAX_RELAY_SIZE:
+        raise ValueError(f"bad relay size: {size}")
+    return size
+
+def is_request_frame(frame: bytes | bytearray | memoryview) -> bool:
+    """tell a normal frame from a relay one by its magic"""
+    return len(frame) == REQ_SIZE and _NET_INT.unpack_from(frame)[0] == VCC_MAGIC
+
+class RequestView:
+    """A received request which only decodes a field when it is accessed
+
+    It has the same fields as Request, use to_tuple() or to_raw() to get the NamedTuples
+    """
+    __slots__ = ("_frame",)
+    _fields = Request._fields
+
+    def __init__(self, frame: bytes | bytearray | memoryview) -> None:
+        self._frame = memoryview(frame)
+
+    @property
+    def magic(self) -> int:
+        return _unpack_int(_NET_INT, self._frame, 0)
+
+    @property
+    def type(self) -> int:
+        return _unpack_int(_NET_INT, self._frame, 4)
+
+    @property
+    def uid(self) -> int:
+        return _unpack_int(_NET_INT, self._frame, 8)
+
+    @property
+    def session(self) -> int:
+        return _unpack_int(_NET_INT, self._frame, 12)
+
+    @property
+    def flags(self) -> int:
+        return _unpack_int(_LE_INT, self._frame, 16)
+
+    @property
+    def usrname(self) -> str:
+        return decode_str(self._frame[20:_USRNAME_END])
+
+    @property
+    def msg(self) -> str:
+        return decode_str(self._frame[_USRNAME_END:])
+
+    @property
+    def raw_msg(self) -> bytes:
+        return bytes(self._frame[_USRNAME_END:])
+
+    def to_raw(self) -> RawRequest:
+        return RawRequest._make(REQUEST_STRUCT.unpack_from(self._frame))
+
+    def to_tuple(self) -> Request:
+        return Request(self.magic, self.type, self.uid, self.session, self.flags, self.usrname, self.msg)
+
+    def _replace(self, **kwargs: Any) -> Request:
+        """like Request._replace, hooks which change a message get a Request"""
+        return self.to_tuple()._replace(**kwargs)
+
+    def _asdict(self) -> dict[str, Any]:
+        return self.to_tuple()._asdict()
+
+    def __iter__(self) -> Iterator[int | str]:
+        return iter(self.to_tuple())
+
+    def __repr__(self) -> str:
+        return f"RequestView{tuple(self.to_tuple())!r}"
+
+class RelayView:
+    """A received relay which only decodes a field when it is accessed
+
+    It has the same fields as Relay, use to_tuple() or to_raw() to get the NamedTuples
+    """
+    __slots__ = ("_frame",)
+    _fields = Relay._fields
+
+    def __init__(self, frame: bytes | bytearray | memoryview) -> None:
+        self._frame = memoryview(frame)
+
+    @property
+    def magic(self) -> int:
+        return _unpack_int(_NET_INT, self._frame, 0)
+
+    @property
+    def type(self) -> int:
+        return _unpack_int(_NET_INT, self._frame, 4)
+
+    @property
+    def size(self) -> int:
+        return _unpack_int(_NET_UINT, self._frame, 8)
+
+    @property
+    def uid(self) -> int:
+        return _unpack_int(_NET_INT, self._frame, 12)
+
+    @property
+    def session(self) -> int:
+        return _unpack_int(_NET_INT, self._frame, 16)
+
+    @property
+    def usrname(self) -> str:
+        return decode_str(self._frame[20:_USRNAME_END])
+
+    @property
+    def visible(self) -> str:
+        return decode_str(self._frame[_USRNAME_END:_VISIBLE_END])
+
+    @property
+    def msg(self) -> str:
+        return decode_str(self._frame[_VISIBLE_END:])
+
+    @property
+    def raw_msg(self) -> bytes:
+        return bytes(self._frame[_VISIBLE_END:])
+
+    def to_raw(self) -> RawRelay:
+        return RawRelay._make((*RELAY_HEADER_STRUCT.unpack_from(self._frame), self.raw_msg))
+
+    def to_tuple(self) -> Relay:
+        return Relay(self.magic, self.type, self.size, self.uid, self.session, self.usrname, self.visible, self.msg)
+
+    def _asdict(self) -> dict[str, Any]:
+        return self.to_tuple()._asdict()
+
+    def __iter__(self) -> Iterator[int | str]:
+        return iter(self.to_tuple())
+
+    def __repr__(self) -> str:
+        return f"RelayView{tuple(self.to_tuple())!r}"
+
+def decode_frame(frame: bytes | bytearray | memoryview) -> RequestView | RelayView:
+    return RequestView(frame) if is_request_frame(frame) else RelayView(frame)
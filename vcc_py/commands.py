@@ -11,12 +11,20 @@
 # You should have received a copy of the GNU General Public License along with vcc.py. If not, see 
 # <https://www.gnu.org/licenses/>. 
 
-from typing import Callable, Awaitable
+from typing import Any, Callable, Awaitable
+from datetime import datetime
+import asyncio
+import sqlite3
 import sys
+import time
 
 from .sock import Connection
 from .constants import *
-from .pretty import help_line, prompt, show_msg
+from .pretty import format_msg, help_line, prompt, show_msg
+from .bh import show_user
+from .metrics import REGISTRY
+from .profiling import PROFILER, Timer
+from .history import to_fts_query
 
 async def do_cmd_help(conn: Connection, args: list[str]) -> None:
     """Show information about every message. """
@@ -56,30 +64,31 @@ async def do_cmd_incr(conn: Connection, args: list[str]) -> None:
     else:
         username = input("username: ")
         incr = int(input("increment: "))
-    await conn.send(type=REQ.SYS_SCRINC, usrname=username, session=incr)
-    await conn.wait_until_recv()
+    await conn.request(type=REQ.SYS_SCRINC, usrname=username, session=incr)
 
 async def do_cmd_ls(conn: Connection, args: list[str]) -> None:
     """List the users or sessions"""
     match args:
         case ["-s" | "--session" | "s" | "session"]:
-            await conn.send(type=REQ.CTL_SESS, uid=0)
-            await conn.wait_until_recv()
+            await conn.request(type=REQ.CTL_SESS, uid=0)
         case ["-u" | "--user" | "u" | "user"] | []:
-            await conn.send(type=REQ.CTL_USRS, uid=0)
-            await conn.wait_until_recv()
+            await conn.request(type=REQ.CTL_USRS, uid=0)
         case _:
             pass
 
 async def do_cmd_uinfo(conn: Connection, args: list[str]) -> None:
     """Get user information"""
-    await conn.send(type=REQ.CTL_UINFO, uid=0, msg=input("Username: ") if not args else args[0])
-    await conn.wait_until_recv()
+    infos = await conn.data.users.lookup_many(conn, args if args else [input("Username: ")])
+    for info in infos.values():
+        show_user(info, conn.data)
 
 async def do_cmd_lself(conn: Connection, args: list[str]) -> None:
     """Reload information of myself"""
-    await conn.send(type=REQ.CTL_UINFO, uid=0, msg=conn.data.usrname)
-    await conn.wait_until_recv()
+    conn.data.users.invalidate(conn.data.usrname)
+    info = await conn.data.users.lookup(conn, conn.data.usrname)
+    if info is not None:
+        conn.data.level = info.level
+    show_user(info, conn.data)
 
 async def do_cmd_ml(conn: Connection, args: list[str]) -> None:
     """Run commands in multi-line"""
@@ -90,15 +99,16 @@ async def do_cmd_ml(conn: Connection, args: list[str]) -> None:
             lines.append(line)
     except EOFError:
         pass
-    for line in lines:
-        split_list = line.split(" ")
-        command = "-" + split_list[0]
-        args = split_list[1:]
-        try:
-            await do_cmd_map[command](conn, args)
-        except KeyError:
-            print(f"Unknown command \"{command}\"", file=sys.stderr)
-            return
+    async with conn.batch():
+        for line in lines:
+            split_list = line.split(" ")
+            command = "-" + split_list[0]
+            args = split_list[1:]
+            try:
+                await do_cmd_map[command](conn, args)
+            except KeyError:
+                print(f"Unknown command \"{command}\"", file=sys.stderr)
+                return
 
 async def do_cmd_send(conn: Connection, args: list[str]) -> None:
     """Send a message (designed for ml, slient for sender)"""
@@ -137,16 +147,12 @@ async def do_cmd_plg(conn: Connection, args: list[str]) -> None:
             print("usage: -plg [-i|-l|--install|--list|i|ls|install|list] [name]")
 
 async def get_id_by_name(conn: Connection, name: str) -> int:
-    if name in conn.data.sess_list:
-        return conn.data.sess_list.index(name) + 1
-    else:
+    async def list_sessions() -> None:
+        # the listing only updates the directory, don't print it
         conn.data.type = True
-        await conn.send(type=REQ.CTL_SESS, uid=0)
-        await conn.wait_until_recv()
-        if name in conn.data.sess_list:
-            return conn.data.sess_list.index(name) + 1
-        else:
-            return -1
+        await conn.request(type=REQ.CTL_SESS, uid=0)
+    id = await conn.data.sessions.id_of(name, list_sessions)
+    return -1 if id is None else id
 
 async def do_cmd_sess(conn: Connection, args: list[str]) -> None:
     """Session control"""
@@ -163,8 +169,7 @@ async def do_cmd_sess(conn: Connection, args: list[str]) -> None:
         case ["-p" | "--name" | "p" | "na" | "name", name]:
             # who knows what "-p" really means?
             sid = int(name)
-            await conn.send(type=REQ.CTL_SENAME, session=sid)
-            await conn.wait_until_recv()
+            await conn.request(type=REQ.CTL_SENAME, session=sid)
         case ["-i" | "--id" | "i" | "id", name]:
             if (id := await get_id_by_name(conn, name)) == -1:
                 print("No such session")
@@ -182,11 +187,108 @@ async def do_cmd_sess(conn: Connection, args: list[str]) -> None:
                 conn.data.sess = 0
             await conn.send(type=REQ.CTL_QUITS, usrname=conn.data.usrname, session=id)
         case ["-l", "--list", "ls", "list"]:
-            await conn.send(type=REQ.CTL_SESS, uid=0)
-            await conn.wait_until_recv()
+            await conn.request(type=REQ.CTL_SESS, uid=0)
         case _:
             pass
     
+def parse_history_args(args: list[str]) -> tuple[dict[str, Any], list[str]]:
+    """split the filters of -history and -grep from the other arguments"""
+    filters: dict[str, Any] = {}
+    rest: list[str] = []
+    it = iter(args)
+    for arg in it:
+        match arg:
+            case "-s" | "--session":
+                filters["session"] = int(next(it))
+            case "-u" | "--user":
+                filters["usrname"] = next(it)
+            case "-n" | "--count":
+                filters["limit"] = int(next(it))
+            case "-b" | "--before":
+                filters["before"] = int(next(it))
+            case "--since":
+                filters["since"] = datetime.fromisoformat(next(it)).timestamp()
+            case "--until":
+                filters["until"] = datetime.fromisoformat(next(it)).timestamp()
+            case _:
+                rest.append(arg)
+    return filters, rest
+
+async def show_history(conn: Connection, cmd: str, args: list[str], grep: bool = False, search: bool = False) -> None:
+    history = conn.data.history
+    if history is None:
+        print("The history is disabled")
+        return
+    usage = f"usage: {cmd} {'pattern ' if grep or search else ''}[-s session] [-u user] [-n count] [-b id] [--since time] [--until time]"
+    try:
+        filters, rest = parse_history_args(args)
+    except (StopIteration, ValueError):
+        print(usage)
+        return
+    if grep:
+        filters["contains"] = " ".join(rest) if rest else input("Pattern: ")
+    if search:
+        text = " ".join(rest) if rest else input("Words: ")
+        if not to_fts_query(text):
+            print(usage)
+            return
+    lag = 0
+    try:
+        await history.flush()
+        if search:
+            messages = await history.search(text, **filters)
+            lag = await history.index_lag()
+        else:
+            messages = await history.page(**filters)
+    except sqlite3.Error as e:
+        print(f"Cannot read the history: {e}", file=sys.stderr)
+        return
+    for i in messages:
+        print(format_msg(i.usrname, i.msg, i.session, i.flag, when=i.time))
+    if search:
+        print(f"({len(messages)} messages)")
+        if lag:
+            print(f"(the index is still catching up, about {lag} messages can't be found yet)")
+    elif messages:
+        print(f"({len(messages)} messages, the older ones: {cmd} ... -b {messages[0].id})")
+    else:
+        print("No messages")
+
+async def do_cmd_history(conn: Connection, args: list[str]) -> None:
+    """Show the messages stored in the history"""
+    await show_history(conn, "-history", args)
+
+async def do_cmd_grep(conn: Connection, args: list[str]) -> None:
+    """Find the messages containing some text in the history"""
+    await show_history(conn, "-grep", args, grep=True)
+
+async def do_cmd_search(conn: Connection, args: list[str]) -> None:
+    """Search the history for words, the best matches first"""
+    await show_history(conn, "-search", args, search=True)
+
+async def do_cmd_stats(conn: Connection, args: list[str]) -> None:
+    """Show the metrics of the client, only those whose name contains the argument if it's given"""
+    for line in REGISTRY.summary():
+        if not args or args[0] in line.partition("{")[0].partition(" ")[0]:
+            print(line)
+
+async def do_cmd_prof(conn: Connection, args: list[str]) -> None:
+    """Profile the client: -prof start, -prof stop, -prof dump [file to save the profile to]"""
+    action = args[0] if args else "dump"
+    try:
+        match action:
+            case "start":
+                PROFILER.start()
+                print("Profiling, \"-prof stop\" to stop")
+            case "stop":
+                PROFILER.stop()
+                print(PROFILER.dump())
+            case "dump":
+                print(PROFILER.dump(args[1] if len(args) > 1 else None))
+            case _:
+                print(f"Unknown action \"{action}\", use start, stop or dump", file=sys.stderr)
+    except (RuntimeError, OSError) as e:
+        print(e, file=sys.stderr)
 
 # async def do_cmd_encry(conn: Connection, args: list[str]) -> None:
 #     """Send an encrypted message"""
@@ -205,19 +307,44 @@ do_cmd_map: dict[str, Callable[[Connection, list[str]], Awaitable[None]]] = {
     "-rl": do_cmd_rl,
     "-plg": do_cmd_plg,
     "-sess": do_cmd_sess,
+    "-history": do_cmd_history,
+    "-grep": do_cmd_grep,
+    "-search": do_cmd_search,
+    "-stats": do_cmd_stats,
+    "-prof": do_cmd_prof,
     # "-encry": do_cmd_encry
 }
 
+command_timers: dict[str, Timer] = {}
+
 async def do_cmd(string: str, conn: Connection) -> None:
     """Run a command"""
     split_list = string.split(" ")
     command = split_list[0]
     args = split_list[1:]
     try:
-        await do_cmd_map[command](conn, args)
+        func = do_cmd_map[command]
+    except KeyError:
+        print(f"Unknown command \"{command}\"", file=sys.stderr)
+        return
+    timer = command_timers.get(command)
+    if timer is None:
+        histogram = REGISTRY.histogram("vcc_command_seconds", "time spent running a command", command=command)
+        timer = command_timers[command] = Timer(f"the command {command}", histogram)
+    start = time.perf_counter()
+    try:
+        await func(conn, args)
         prompt(conn.data.usrname, conn.data.sess, conn.data.level)
     except KeyError:
         print(f"Unknown command \"{command}\"", file=sys.stderr)
+    except asyncio.TimeoutError:
+        print(f"No response from the server for \"{command}\"", file=sys.stderr)
+    except LookupError as e:
+        print(f"\"{command}\" failed: {e}", file=sys.stderr)
+    except ConnectionError:
+        print(f"The connection was lost while running \"{command}\"", file=sys.stderr)
+    finally:
+        timer.stop(start)
 
 def new_commands(commands: dict[str, Callable[[Connection, list[str]], Awaitable[None]]]) -> None:
     do_cmd_map.update(commands)
@@ -19,18 +19,21 @@ import yaml
 from .readconf import parse
 
 class Configs:
-    def __init__(self) -> None:
+    def __init__(self, config: dict[str, Any] | None = None) -> None:
         readconf_config_path = Path.home() / ".vcc-config"
         yaml_config_path = Path.home() / ".vcc-config.yaml"
-        if readconf_config_path.exists():
+        self.config: dict[str, Any]
+        if config is not None:
+            self.config = config
+        elif readconf_config_path.exists():
             config_text = readconf_config_path.read_bytes().decode(errors="ignore")
-            self.config: dict[str, Any] = parse(config_text)
+            self.config = parse(config_text)
         else:
             config_text = yaml_config_path.read_bytes().decode(errors="ignore")
             self.config = yaml.safe_load(config_text)
         plugins: str | list[str] = self.config.get("plugins", "")
         if isinstance(plugins, str):
-            self.plugin_list = plugins.split(" ")
+            self.plugin_list = plugins.split()
         else:
             self.plugin_list = plugins
 
@@ -20,6 +20,9 @@ from dataclasses import dataclass
 
 if TYPE_CHECKING:
     from .plugin import Plugins
+    from .history import History
+    from .sessions import SessionDirectory
+    from .users import UserCache
 
 VCC_MAGIC: Final = 0x01328e22
 VCC_MAGIC_RL: Final = 0x01328e36
@@ -27,6 +30,8 @@ VCC_MAGIC_RL: Final = 0x01328e36
 VCC_PORT: Final = 46
 VCC_DEFAULT_IP: Final = "124.223.105.230"
 
+REQUEST_TIMEOUT: Final = 5.0
+
 REQ_SIZE: Final = 512
 USERNAME_SIZE: Final = 32
 PASSWD_SIZE: Final = 64
@@ -34,6 +39,8 @@ MSG_SIZE: Final = REQ_SIZE - 5 * 4 - USERNAME_SIZE
 
 VCC_REQUEST_FORMAT: Final = f"<iiiii{USERNAME_SIZE}s{MSG_SIZE}s"
 VCC_RELAY_HEADER_FORMAT: Final = f"<iiIii{USERNAME_SIZE}s{USERNAME_SIZE}s"
+# relays carry their size, a bigger one is taken for garbage instead of being buffered
+MAX_RELAY_SIZE: Final = 1 << 20
 
 MSG_NEW_RELAY: Final = 0b1
 MSG_NEW_ONLY_VISIBLE: Final = 0b10
@@ -57,6 +64,9 @@ class REQ(IntEnum):
     CTL_SENAME = 14
     CTL_QUITS = 15
 
+# the frames of the chat lane and of the global rate limit, everything else is a control frame
+CHAT_TYPES: Final = frozenset({REQ.MSG_SEND, REQ.REL_MSG})
+
 class Mode(Enum):
     NORMAL = 0
     ROBOT = 1
@@ -117,6 +127,9 @@ class MyData:
     level: int
     type: bool
     mode: Mode
+    sessions: SessionDirectory
+    users: UserCache
+    history: History | None = None
     
 class ExitError(Exception):
     pass
@@ -0,0 +1,213 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General 
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at 
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the 
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public 
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see 
+# <https://www.gnu.org/licenses/>. 
+
+# Run vcc without a terminal, for bots and services. Never import prompt_toolkit here.
+
+from __future__ import annotations
+
+from types import TracebackType
+from typing import Any, AsyncIterator, TypeAlias
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import sys
+
+from .sock import resolve
+from .reconnect import ReconnectingConnection
+from .ratelimit import RateLimiter
+from .codec import RequestView, RelayView
+from .constants import *
+from .config import Configs
+from .plugin import Plugins
+from .metrics import exporters
+from .profiling import monitor_loop
+from .wiretrace import trace_connection
+
+def load_configs() -> Configs | None:
+    try:
+        return Configs()
+    except FileNotFoundError:
+        return None
+
+def get_setting(configs: Configs | None, name: str, default: Any = None) -> Any:
+    """get a setting from $VCC_<NAME>, then from the config file"""
+    env = os.environ.get(f"VCC_{name.upper()}")
+    if env is not None:
+        return env
+    if configs is not None and name in configs.config:
+        return configs.config[name]
+    return default
+
+# a view decodes a field when it's read and has the same fields, hooks which change a message give a tuple
+Message: TypeAlias = Request | Relay | RequestView | RelayView
+
+class Bot:
+    """A connection which is logged in without a terminal
+
+    Iterate over it to get every message (after the plugin hooks), the responses of control requests
+    are only delivered to Connection.request()
+    """
+    def __init__(
+        self,
+        usrname: str,
+        password: str,
+        ip: str = VCC_DEFAULT_IP,
+        port: int = VCC_PORT,
+        sess: int = 0,
+        configs: Configs | None = None,
+        extra_plugin: str | None = None,
+        queue_size: int = 1024,
+        limiter: RateLimiter | None = None,
+    ) -> None:
+        if limiter is None and configs is not None:
+            limiter = RateLimiter.from_config_or_none(configs.config)
+        self.conn = ReconnectingConnection(resolve(ip), port, usrname, sess, mode=Mode.ROBOT, limiter=limiter)
+        self._password = password
+        self._configs = configs
+        self._extra_plugin = extra_plugin
+        self._plugs: Plugins | None = None
+        self._queue: asyncio.Queue[Message | None] = asyncio.Queue(queue_size)
+        self._error: BaseException | None = None
+
+    async def __aenter__(self) -> Bot:
+        await self.conn.__aenter__()
+        try:
+            await self.conn.login(self._password)
+            if self._configs is not None or self._extra_plugin is not None:
+                self._plugs = await Plugins(self.conn, self._extra_plugin, self._configs).__aenter__()
+                self.conn.data.plugs = self._plugs
+            if self.conn.data.sess:
+                await self.conn.send(type=REQ.CTL_JOINS, session=self.conn.data.sess)
+        except BaseException:
+            await self.conn.__aexit__(*sys.exc_info())
+            raise
+        self._recv_task = asyncio.create_task(self._recv_loop())
+        return self
+
+    async def __aexit__(self, exc_type: type[BaseException] | None, exc_val: BaseException | None, exc_tb: TracebackType | None) -> None:
+        self._recv_task.cancel()
+        try:
+            await self._recv_task
+        except asyncio.CancelledError:
+            pass
+        if self._plugs is not None:
+            await self._plugs.__aexit__(exc_type, exc_val, exc_tb)
+        await self.conn.__aexit__(exc_type, exc_val, exc_tb)
+
+    async def _recv_loop(self) -> None:
+        try:
+            while True:
+                view = await self.conn.recv_view()
+                if isinstance(view, RelayView):
+                    if view.type == REQ.CTL_USRS:
+                        continue
+                    await self._queue.put(view)
+                    continue
+                if view.type != REQ.MSG_NEW:
+                    continue
+                req: Request | RequestView = view
+                if self._plugs is not None:
+                    _req = await self._plugs.recv_msg(req)
+                    if _req is None:
+                        continue
+                    req = _req
+                await self._queue.put(req)
+        except (OSError, ValueError) as e:
+            self._error = e
+        except Exception as e:
+            logging.exception("the bot stopped receiving")
+            self._error = e
+        finally:
+            if self._error is None:
+                # cancelled by __aexit__
+                self._error = ConnectionError("the bot is closed")
+            # recv() must always see the end, even if the queue is full
+            if self._queue.full():
+                self._queue.get_nowait()
+            self._queue.put_nowait(None)
+
+    async def recv(self) -> Message:
+        """Wait for the next message, raise the error which closed the connection at the end"""
+        msg = await self._queue.get()
+        if msg is None:
+            self._queue.put_nowait(None)
+            assert self._error is not None
+            raise self._error
+        return msg
+
+    async def __aiter__(self) -> AsyncIterator[Message]:
+        while True:
+            try:
+                yield await self.recv()
+            except ConnectionError:
+                return
+
+    async def send(self, msg: str, session: int | None = None) -> None:
+        await self.conn.send(type=REQ.MSG_SEND, session=session, msg=msg)
+
+    async def reply(self, req: Message, msg: str) -> None:
+        """Send a message to the session which req comes from"""
+        await self.send(msg, req.session)
+
+    async def run(self) -> None:
+        """Run until the connection is closed, the messages are only seen by the plugins"""
+        async for _ in self:
+            pass
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run vcc without a terminal, credentials are read from $VCC_USER and $VCC_PASSWORD or the config file", prog="vcc-headless")
+    parser.add_argument("-D", "--debug", action="store_true", help="enable debug mode")
+    parser.add_argument("--plugin", type=str, metavar="plugin", help="load plugin automatically")
+    return parser.parse_args()
+
+async def main() -> None:
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARN, format="%(levelname)s: %(message)s")
+    configs = load_configs()
+    usrname = get_setting(configs, "user")
+    password = get_setting(configs, "password")
+    if not usrname or password is None:
+        logging.error("no credentials, set $VCC_USER and $VCC_PASSWORD or user and password in the config file")
+        sys.exit(1)
+    bot = Bot(
+        str(usrname),
+        str(password),
+        ip=str(get_setting(configs, "server", VCC_DEFAULT_IP)),
+        port=int(get_setting(configs, "port", VCC_PORT)),
+        sess=int(get_setting(configs, "session", 0)),
+        configs=configs,
+        extra_plugin=args.plugin,
+    )
+    config = {} if configs is None else configs.config
+    async with bot, exporters(config), monitor_loop(config), trace_connection(bot.conn, config):
+        bot.conn.register_metrics()
+        run_task = asyncio.create_task(bot.run())
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, run_task.cancel)
+            except NotImplementedError:
+                # windows
+                pass
+        try:
+            await run_task
+        except asyncio.CancelledError:
+            pass
+
+def amain() -> None:
+    asyncio.run(main())
+
+if __name__ == "__main__":
+    amain()
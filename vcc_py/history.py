@@ -0,0 +1,285 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see
+# <https://www.gnu.org/licenses/>.
+
+# The local message history, an append-only SQLite database in WAL mode. Messages are queued in memory
+# and written in batches by a background task, so the receive path never waits for the disk. The same
+# task feeds a FTS5 index behind the table and merges its segments when there is nothing to write.
+
+from __future__ import annotations
+
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Callable, NamedTuple, TypeVar
+import asyncio
+import logging
+import sqlite3
+import time
+
+T = TypeVar("T")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    session INTEGER NOT NULL,
+    usrname TEXT NOT NULL,
+    msg TEXT NOT NULL,
+    flag INTEGER NOT NULL DEFAULT 0,
+    outgoing INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS messages_session ON messages (session, id);
+CREATE INDEX IF NOT EXISTS messages_usrname ON messages (usrname, id);
+CREATE INDEX IF NOT EXISTS messages_time ON messages (time);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (msg, content='messages', content_rowid='id');
+CREATE TABLE IF NOT EXISTS fts_state (id INTEGER PRIMARY KEY CHECK (id = 0), indexed INTEGER NOT NULL);
+INSERT OR IGNORE INTO fts_state VALUES (0, 0);
+"""
+
+MESSAGE_COLUMNS = "messages.id, messages.time, messages.session, messages.usrname, messages.msg, messages.flag, messages.outgoing"
+
+class Message(NamedTuple):
+    id: int
+    time: float
+    session: int
+    usrname: str
+    msg: str
+    flag: int
+    outgoing: bool
+
+def connect(path: Path | str) -> sqlite3.Connection:
+    # the connections are used by one worker thread at a time
+    db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+def to_fts_query(text: str) -> str:
+    """quote every word, so the text is never taken as the FTS5 query syntax"""
+    return " ".join('"' + i.replace('"', '""') + '"' for i in text.split())
+
+class History:
+    """Store every message shown or sent
+
+    add() only appends to a list, at most queue_size messages wait for the writer and the rest are
+    dropped. The writing connection is used by one thread at a time, under _write_lock. Reading uses
+    another connection, WAL lets it run while a batch is being written.
+
+    The full-text index follows the table by at most index_batch messages a step, so a database from
+    an older version is indexed in the background too. Automatic merging is turned off, segments are
+    merged merge_pages at a time when the writer is idle
+    """
+    def __init__(
+        self,
+        path: Path | str,
+        batch_size: int = 512,
+        flush_interval: float = 0.5,
+        queue_size: int = 65536,
+        index_batch: int = 4096,
+        merge_pages: int = 64,
+    ) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.index_batch = index_batch
+        self.merge_pages = merge_pages
+        self.dropped = 0
+        self._rows: list[tuple[float, int, str, str, int, int]] = []
+        self._wakeup = asyncio.Event()
+        self._read_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        self._writer_task: asyncio.Task[None] | None = None
+        self._closing = False
+
+    async def __aenter__(self) -> History:
+        self._writer = await asyncio.to_thread(self._open)
+        self._reader = await asyncio.to_thread(connect, self.path)
+        self._writer_task = asyncio.create_task(self._write_loop())
+        return self
+
+    async def __aexit__(self, exc_type: type[BaseException] | None, exc_val: BaseException | None, exc_tb: TracebackType | None) -> None:
+        if self._writer_task is not None:
+            # not cancelled, a batch which is being written must finish first
+            self._closing = True
+            self._wakeup.set()
+            await self._writer_task
+            self._writer_task = None
+        self._writer.close()
+        self._reader.close()
+
+    def _open(self) -> sqlite3.Connection:
+        db = connect(self.path)
+        db.executescript(SCHEMA)
+        db.execute("INSERT INTO messages_fts (messages_fts, rank) VALUES ('automerge', 0)")
+        return db
+
+    def add(self, usrname: str, msg: str, session: int, flag: int = 0, outgoing: bool = False) -> None:
+        if len(self._rows) >= self.queue_size:
+            self.dropped += 1
+            return
+        self._rows.append((time.time(), session, usrname, msg, flag, int(outgoing)))
+        if len(self._rows) >= self.batch_size:
+            self._wakeup.set()
+
+    def _insert(self, rows: list[tuple[float, int, str, str, int, int]]) -> None:
+        with self._writer:
+            self._writer.execute("BEGIN")
+            self._writer.executemany("INSERT INTO messages (time, session, usrname, msg, flag, outgoing) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def _index(self) -> bool:
+        """index the next messages, return whether the index has caught up with the table"""
+        with self._writer:
+            self._writer.execute("BEGIN")
+            (indexed,), = self._writer.execute("SELECT indexed FROM fts_state")
+            rows = self._writer.execute("SELECT id, msg FROM messages WHERE id > ? ORDER BY id LIMIT ?", (indexed, self.index_batch)).fetchall()
+            if not rows:
+                return True
+            self._writer.executemany("INSERT INTO messages_fts (rowid, msg) VALUES (?, ?)", rows)
+            self._writer.execute("UPDATE fts_state SET indexed = ?", (rows[-1][0],))
+        return len(rows) < self.index_batch
+
+    def _merge(self) -> None:
+        # a positive count makes it only merge levels which have enough segments
+        with self._writer:
+            self._writer.execute("INSERT INTO messages_fts (messages_fts, rank) VALUES ('merge', ?)", (self.merge_pages,))
+
+    async def _write(self, func: Callable[[], T]) -> T:
+        async with self._write_lock:
+            return await asyncio.to_thread(func)
+
+    async def flush(self) -> None:
+        """write the queued messages, it can be called while the writer task runs"""
+        async with self._write_lock:
+            # taken under the lock, so the batches are written in order
+            rows, self._rows = self._rows, []
+            if rows:
+                await asyncio.to_thread(self._insert, rows)
+
+    async def _write_loop(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                # catching up with a big table goes on until there are new messages to write
+                while not (caught_up := await self._write(self._index)):
+                    if self._rows or self._closing:
+                        # write them and go on without waiting
+                        self._wakeup.set()
+                        break
+                if caught_up and not self._rows:
+                    await self._write(self._merge)
+            except sqlite3.Error:
+                logging.exception("cannot write the history")
+        await self.flush()
+        await self._write(self._index)
+
+    async def query(self, sql: str, params: list[Any]) -> list[Message]:
+        def run() -> list[Message]:
+            return [Message._make(i) for i in self._reader.execute(sql, params)]
+        async with self._read_lock:
+            return await asyncio.to_thread(run)
+
+    async def index_lag(self) -> int:
+        """about how many messages which are written can't be found by search() yet"""
+        def run() -> int:
+            (lag,), = self._reader.execute("SELECT coalesce((SELECT max(id) FROM messages), 0) - indexed FROM fts_state")
+            return max(0, int(lag))
+        async with self._read_lock:
+            return await asyncio.to_thread(run)
+
+    async def page(
+        self, *,
+        session: int | None = None,
+        usrname: str | None = None,
+        since: float | None = None,
+        until: float | None = None,
+        contains: str | None = None,
+        before: int | None = None,
+        limit: int = 20,
+    ) -> list[Message]:
+        """the newest limit messages matching every filter given, older than the id before
+
+        The result is the oldest first. Paging goes backwards by passing the id of the first message
+        as before, so every page is a range on an index
+        """
+        where: list[str] = []
+        params: list[Any] = []
+        if session is not None:
+            where.append("session = ?")
+            params.append(session)
+        if usrname is not None:
+            where.append("usrname = ?")
+            params.append(usrname)
+        if since is not None:
+            where.append("time >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("time < ?")
+            params.append(until)
+        if contains is not None:
+            where.append("instr(msg, ?) > 0")
+            params.append(contains)
+        if before is not None:
+            where.append("id < ?")
+            params.append(before)
+        sql = "SELECT id, time, session, usrname, msg, flag, outgoing FROM messages"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        result = await self.query(sql, params)
+        result.reverse()
+        return result
+
+    async def search(
+        self,
+        text: str, *,
+        session: int | None = None,
+        usrname: str | None = None,
+        since: float | None = None,
+        until: float | None = None,
+        before: int | None = None,
+        limit: int = 20,
+    ) -> list[Message]:
+        """the messages containing every word of text, the best match first
+
+        Only what is already indexed is searched, the writer task catches up in the background, see
+        index_lag()
+        """
+        where = ["messages_fts MATCH ?"]
+        params: list[Any] = [to_fts_query(text)]
+        if session is not None:
+            where.append("messages.session = ?")
+            params.append(session)
+        if usrname is not None:
+            where.append("messages.usrname = ?")
+            params.append(usrname)
+        if since is not None:
+            where.append("messages.time >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("messages.time < ?")
+            params.append(until)
+        if before is not None:
+            where.append("messages.id < ?")
+            params.append(before)
+        params.append(limit)
+        return await self.query(
+            f"SELECT {MESSAGE_COLUMNS} FROM messages_fts JOIN messages ON messages.id = messages_fts.rowid "
+            f"WHERE {' AND '.join(where)} ORDER BY messages_fts.rank LIMIT ?",
+            params,
+        )
@@ -0,0 +1,168 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General 
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at 
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the 
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public 
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see 
+# <https://www.gnu.org/licenses/>. 
+
+# An open-loop load generator: every connection sends at a fixed rate whatever the server does, and the
+# latency is measured from the time a message was scheduled, so a slow server can't hide it.
+#   python -m vcc_py.loadgen -c 100 -r 10 -d 30 127.0.0.1
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import random
+import sys
+from typing import Final
+
+from .constants import *
+from .codec import RelayView
+from .metrics import Histogram
+from .sock import Connection, resolve
+
+MARK: Final = "\x01lg "
+
+class LoadGenerator:
+    """Drive logged in connections at rate messages per second each
+
+    A message sent by connection i is timed when connection i + 1 receives it, so with one connection
+    the server has to echo messages back to the sender
+    """
+    def __init__(self, conns: list[Connection], rate: float, duration: float, relay_ratio: float = 0.0, size: int = 64) -> None:
+        self.conns = conns
+        self.rate = rate
+        self.duration = duration
+        self.relay_ratio = relay_ratio
+        self.size = size
+        self.sent = 0
+        self.received = 0
+        self.total = Histogram()
+        self.interval = Histogram()
+
+    def make_msg(self, index: int, seq: int, when: float) -> str:
+        msg = f"{MARK}{index} {seq} {int(when * 1e9)} "
+        return msg + "x" * max(0, self.size - len(msg))
+
+    async def send_loop(self, index: int, end: float) -> None:
+        conn = self.conns[index]
+        loop = asyncio.get_event_loop()
+        period = 1 / self.rate
+        # spread the connections over the first period
+        scheduled = loop.time() + random.random() * period
+        seq = 0
+        while scheduled < end:
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # open loop: everything which is due is sent now, even if we fell behind
+            async with conn.batch():
+                while scheduled <= loop.time() and scheduled < end:
+                    msg = self.make_msg(index, seq, scheduled)
+                    if self.relay_ratio and random.random() < self.relay_ratio:
+                        await conn.send_relay(msg=msg, visible="")
+                    else:
+                        await conn.send(msg=msg)
+                    self.sent += 1
+                    seq += 1
+                    scheduled += period
+
+    async def recv_loop(self, index: int) -> None:
+        conn = self.conns[index]
+        loop = asyncio.get_event_loop()
+        expected = (index - 1) % len(self.conns)
+        while True:
+            view = await conn.recv_view()
+            if view.type != (REQ.REL_NEW if isinstance(view, RelayView) else REQ.MSG_NEW):
+                continue
+            msg = view.msg
+            if not msg.startswith(MARK):
+                continue
+            sender, _, when, *_ = msg[len(MARK):].split(" ")
+            if int(sender) != expected:
+                continue
+            us = (loop.time() - int(when) / 1e9) * 1e6
+            self.received += 1
+            self.total.record(us)
+            self.interval.record(us)
+
+    async def report_loop(self, every: float = 1.0) -> None:
+        last_sent = last_received = 0
+        while True:
+            await asyncio.sleep(every)
+            print(
+                f"sent {(self.sent - last_sent) / every:.0f}/s recv {(self.received - last_received) / every:.0f}/s "
+                f"{self.interval.summary()}"
+            )
+            last_sent, last_received = self.sent, self.received
+            self.interval = Histogram()
+
+    async def run(self, drain: float = 2.0, report: bool = True) -> Histogram:
+        loop = asyncio.get_event_loop()
+        end = loop.time() + self.duration
+        receivers = [asyncio.create_task(self.recv_loop(i)) for i in range(len(self.conns))]
+        reporter = asyncio.create_task(self.report_loop()) if report else None
+        try:
+            await asyncio.gather(*[self.send_loop(i, end) for i in range(len(self.conns))])
+            # wait for the messages which are still on the way
+            deadline = loop.time() + drain
+            while self.received < self.sent and loop.time() < deadline:
+                await asyncio.sleep(0.05)
+        finally:
+            for task in receivers:
+                task.cancel()
+            if reporter is not None:
+                reporter.cancel()
+            await asyncio.gather(*receivers, *([reporter] if reporter is not None else []), return_exceptions=True)
+        return self.total
+
+async def connect_all(ip: str, port: int, count: int, usrname: str, password: str) -> list[Connection]:
+    """open count connections and log them in, usrname can contain {} for the index"""
+    async def connect(index: int) -> Connection:
+        conn = Connection(ip, port, usrname.replace("{}", str(index)))
+        await conn.__aenter__()
+        await conn.login(password)
+        return conn
+    return list(await asyncio.gather(*[connect(i) for i in range(count)]))
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Put an open-loop load on a vcc server", prog="vcc-loadgen")
+    parser.add_argument("-p", "--port", type=int, metavar="port", default=VCC_PORT, help="the port the server use (default: 46)")
+    parser.add_argument("-c", "--connections", type=int, metavar="count", default=10, help="connections to open (default: 10)")
+    parser.add_argument("-r", "--rate", type=float, metavar="rate", default=1.0, help="messages per second per connection (default: 1)")
+    parser.add_argument("-d", "--duration", type=float, metavar="seconds", default=10.0, help="how long to send (default: 10)")
+    parser.add_argument("--relay-ratio", type=float, metavar="ratio", default=0.0, help="part of the messages sent as relays (default: 0)")
+    parser.add_argument("--size", type=int, metavar="bytes", default=64, help="message size (default: 64)")
+    parser.add_argument("-u", "--user", type=str, metavar="username", default="load{}", help="username, {} is replaced by the index (default: load{})")
+    parser.add_argument("--password", type=str, metavar="password", default="", help="password of the users")
+    parser.add_argument(dest="ip", metavar="ip", nargs="?", default="127.0.0.1", help="the ip address of the server")
+    return parser.parse_args()
+
+async def main() -> None:
+    args = parse_args()
+    logging.basicConfig(level=logging.WARN, format="%(levelname)s: %(message)s")
+    conns = await connect_all(resolve(args.ip), args.port, args.connections, args.user, args.password)
+    try:
+        generator = LoadGenerator(conns, args.rate, args.duration, args.relay_ratio, args.size)
+        total = await generator.run()
+    finally:
+        for conn in conns:
+            await conn.__aexit__(None, None, None)
+    print(f"total: sent {generator.sent} recv {generator.received} lost {generator.sent - generator.received}")
+    print(f"latency: {total.summary()}")
+    if generator.received < generator.sent:
+        sys.exit(1)
+
+def amain() -> None:
+    asyncio.run(main())
+
+if __name__ == "__main__":
+    amain()
@@ -0,0 +1,262 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see
+# <https://www.gnu.org/licenses/>.
+
+# Counters, gauges and histograms of the client. Updating one is an addition (and a log2 for the
+# histograms), nothing runs while nothing happens unless an exporter is configured:
+#   metrics_file: ~/.vcc-metrics.prom        (Prometheus text, written every metrics_interval seconds)
+#   metrics_port: 9446                       (http://127.0.0.1:9446/metrics)
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Final, Iterator
+import asyncio
+import contextlib
+import logging
+import math
+import os
+
+class Histogram:
+    """A log-linear histogram of latencies in microseconds, 8 buckets for every power of 2"""
+    __slots__ = ("buckets", "count", "total", "max")
+    SUB_BUCKETS: Final = 8
+
+    def __init__(self) -> None:
+        self.buckets: dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, us: float) -> None:
+        index = int(math.log2(us) * self.SUB_BUCKETS) if us >= 1 else 0
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def merge(self, other: Histogram) -> None:
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    @classmethod
+    def upper_bound(cls, index: int) -> float:
+        return float(2 ** ((index + 1) / cls.SUB_BUCKETS))
+
+    def percentile(self, pct: float) -> float:
+        """upper bound of the bucket which holds the percentile"""
+        if not self.count:
+            return 0.0
+        target = self.count * pct
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= target:
+                return min(self.upper_bound(index), self.max)
+        return self.max
+
+    def summary(self) -> str:
+        if not self.count:
+            return "no samples"
+        return f"p50 {self.percentile(0.5) / 1000:.2f}ms p99 {self.percentile(0.99) / 1000:.2f}ms p999 {self.percentile(0.999) / 1000:.2f}ms max {self.max / 1000:.2f}ms"
+
+class Counter:
+    __slots__ = ("value",)
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+class Gauge:
+    """A value which is set, or read from func when it's exported"""
+    __slots__ = ("value", "func")
+    def __init__(self, func: Callable[[], float] | None = None) -> None:
+        self.value = 0.0
+        self.func = func
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def get(self) -> float:
+        return self.func() if self.func is not None else self.value
+
+labels_type = tuple[tuple[str, str], ...]
+
+INF_LABEL: Final = 'le="+Inf"'
+# the exported buckets are the same in every scrape, a power of 2 microseconds from 2us to about 67s.
+# Bucket index 8k - 1 ends at exactly 2^k, so each one is the sum of whole histogram buckets
+EXPORT_BUCKETS: Final = tuple((k * Histogram.SUB_BUCKETS - 1, f'le="{2 ** k / 1e6:.9g}"') for k in range(1, 27))
+
+class Family:
+    __slots__ = ("kind", "help", "children")
+    def __init__(self, kind: str, help: str) -> None:
+        self.kind = kind
+        self.help = help
+        self.children: dict[labels_type, Any] = {}
+
+def escape_label(value: str) -> str:
+    """escaped like the Prometheus text format wants"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labels: labels_type, extra: str = "") -> str:
+    items = [f'{name}="{escape_label(value)}"' for name, value in labels]
+    if extra:
+        items.append(extra)
+    return "{" + ",".join(items) + "}" if items else ""
+
+class Registry:
+    """The metrics by name and labels, histograms record microseconds and are exported in seconds"""
+    def __init__(self) -> None:
+        self._families: dict[str, Family] = {}
+
+    def _get(self, kind: str, name: str, help: str, labels: dict[str, str], factory: Callable[[], Any]) -> Any:
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = Family(kind, help)
+        elif family.kind != kind:
+            raise ValueError(f"{name} is a {family.kind}")
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        metric = family.children.get(key)
+        if metric is None:
+            metric = family.children[key] = factory()
+        return metric
+
+    def counter(self, name: str, help: str = "", **labels: str) -> Counter:
+        metric: Counter = self._get("counter", name, help, labels, Counter)
+        return metric
+
+    def gauge(self, name: str, help: str = "", func: Callable[[], float] | None = None, **labels: str) -> Gauge:
+        metric: Gauge = self._get("gauge", name, help, labels, lambda: Gauge(func))
+        if func is not None:
+            metric.func = func
+        return metric
+
+    def histogram(self, name: str, help: str = "", **labels: str) -> Histogram:
+        metric: Histogram = self._get("histogram", name, help, labels, Histogram)
+        return metric
+
+    def remove(self, name: str, **labels: str) -> None:
+        family = self._families.get(name)
+        if family is not None:
+            family.children.pop(tuple(sorted((k, str(v)) for k, v in labels.items())), None)
+
+    def _items(self) -> Iterator[tuple[str, Family, labels_type, Any]]:
+        for name, family in sorted(self._families.items()):
+            for labels, metric in sorted(family.children.items()):
+                yield name, family, labels, metric
+
+    def render(self) -> str:
+        """the metrics in the Prometheus text format"""
+        lines: list[str] = []
+        for name, family in sorted(self._families.items()):
+            if not family.children:
+                continue
+            if family.help:
+                lines.append(f"# HELP {name} {family.help}")
+            lines.append(f"# TYPE {name} {family.kind}")
+            for labels, metric in sorted(family.children.items()):
+                if isinstance(metric, Counter):
+                    lines.append(f"{name}{format_labels(labels)} {metric.value:g}")
+                elif isinstance(metric, Gauge):
+                    lines.append(f"{name}{format_labels(labels)} {metric.get():g}")
+                else:
+                    counts = sorted(metric.buckets.items())
+                    seen = 0
+                    i = 0
+                    for last, le in EXPORT_BUCKETS:
+                        while i < len(counts) and counts[i][0] <= last:
+                            seen += counts[i][1]
+                            i += 1
+                        lines.append(f"{name}_bucket{format_labels(labels, le)} {seen}")
+                    lines.append(f"{name}_bucket{format_labels(labels, INF_LABEL)} {metric.count}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {metric.total / 1e6:.9g}")
+                    lines.append(f"{name}_count{format_labels(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list[str]:
+        """one line for every metric, for people"""
+        lines: list[str] = []
+        for name, family, labels, metric in self._items():
+            if isinstance(metric, Counter):
+                text = f"{metric.value:g}"
+            elif isinstance(metric, Gauge):
+                text = f"{metric.get():g}"
+            else:
+                if not metric.count:
+                    continue
+                text = f"n {metric.count} {metric.summary()}"
+            lines.append(f"{name}{format_labels(labels)} {text}")
+        return lines
+
+REGISTRY: Final = Registry()
+
+def write_file(registry: Registry, path: Path) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(registry.render())
+    os.replace(tmp_path, path)
+
+async def write_loop(registry: Registry, path: Path, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(write_file, registry, path)
+        except OSError as e:
+            logging.warning(f"cannot write the metrics: {e}")
+
+async def start_server(registry: Registry, port: int, host: str = "127.0.0.1") -> asyncio.Server:
+    """answer every request with the metrics, it's only for a local scraper"""
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # the request itself doesn't matter
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5)
+            body = registry.render().encode()
+            writer.write(
+                b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, host, port)
+
+@contextlib.asynccontextmanager
+async def exporters(config: dict[str, Any], registry: Registry = REGISTRY) -> AsyncIterator[None]:
+    """run the exporters set in the config inside it"""
+    tasks: list[asyncio.Task[None]] = []
+    server: asyncio.Server | None = None
+    path = config.get("metrics_file")
+    if path:
+        interval = float(config.get("metrics_interval", 15))
+        tasks.append(asyncio.create_task(write_loop(registry, Path(os.path.expanduser(str(path))), interval)))
+    port = config.get("metrics_port")
+    if port:
+        # bound here, so a port which can't be used is reported at startup
+        try:
+            server = await start_server(registry, int(port))
+        except (OSError, ValueError) as e:
+            logging.error(f"cannot serve the metrics on port {port}: {e}")
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if server is not None:
+            server.close()
+            await server.wait_closed()
@@ -0,0 +1,237 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General 
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at 
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the 
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public 
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see 
+# <https://www.gnu.org/licenses/>. 
+
+# A small vccd which speaks the same framing as sock.py, for tests and benchmarks on a local machine
+
+from __future__ import annotations
+
+from types import TracebackType
+from typing import Final
+import argparse
+import asyncio
+import logging
+import struct
+
+from .constants import *
+from .codec import RequestView, RelayView, decode_frame, frame_size, htonl, pack_relay, pack_request
+
+MAX_SESSIONS: Final = MSG_SIZE // USERNAME_SIZE
+
+USER_STRUCT: Final = struct.Struct(f"<II{USERNAME_SIZE}s{PASSWD_SIZE}s")
+
+class UserInfo:
+    __slots__ = ("password", "score", "level")
+    def __init__(self, password: str | None = None, score: int = 0, level: int = 0) -> None:
+        self.password = password
+        self.score = score
+        self.level = level
+
+class ClientProtocol(asyncio.Protocol):
+    """One connection to the mock server, frames are cut out of a buffer like FrameReader does"""
+    def __init__(self, server: MockServer) -> None:
+        self.server = server
+        self.usrname = ""
+        self.uid = 0
+        self.sessions: set[int] = set()
+        self._buf = bytearray()
+        self.transport: asyncio.Transport | None = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        assert isinstance(transport, asyncio.Transport)
+        self.transport = transport
+        self.server.clients.add(self)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.server.drop(self)
+
+    def data_received(self, data: bytes) -> None:
+        self._buf += data
+        start = 0
+        try:
+            while (size := frame_size(self._buf, start)) is not None and len(self._buf) - start >= size:
+                self.server.handle(self, decode_frame(bytes(self._buf[start:start + size])))
+                start += size
+        except ValueError:
+            logging.debug("mockd: bad frame, closing the connection")
+            self.close()
+            return
+        del self._buf[:start]
+
+    def write(self, data: bytes | bytearray) -> None:
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(data)
+
+    def close(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+
+def pack_names(names: list[str]) -> bytes:
+    """pack names into USERNAME_SIZE slots like the session and user lists"""
+    return b"".join(name.encode()[:USERNAME_SIZE - 1].ljust(USERNAME_SIZE, b"\0") for name in names)
+
+def response(type: int, *, uid: int = 0, session: int = 0, usrname: str = "", msg: str | bytes = "") -> bytearray:
+    return pack_request(magic=VCC_MAGIC, type=type, uid=uid, session=session, flags=0, usrname=usrname, msg=msg)
+
+class MockServer:
+    """A local vccd
+
+    Every login is accepted unless users is given, session 0 holds everyone who is logged in.
+    Use it as an async context manager, the port is chosen by the system if it's 0
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, users: dict[str, str] | None = None, echo: bool = False) -> None:
+        self.host = host
+        self.port = port
+        self.echo = echo
+        self.check_password = users is not None
+        self.users: dict[str, UserInfo] = {name: UserInfo(password) for name, password in (users or {}).items()}
+        self.clients: set[ClientProtocol] = set()
+        self.sessions: list[str] = []
+        self.members: dict[int, set[ClientProtocol]] = {0: set()}
+        self._next_uid = 1
+
+    async def __aenter__(self) -> MockServer:
+        loop = asyncio.get_event_loop()
+        self._server = await loop.create_server(lambda: ClientProtocol(self), self.host, self.port, backlog=4096)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, exc_type: type[BaseException] | None, exc_val: BaseException | None, exc_tb: TracebackType | None) -> None:
+        self._server.close()
+        for client in list(self.clients):
+            client.close()
+        await self._server.wait_closed()
+
+    async def serve_forever(self) -> None:
+        await self._server.serve_forever()
+
+    def drop(self, client: ClientProtocol) -> None:
+        self.clients.discard(client)
+        for sid in client.sessions:
+            self.members.get(sid, set()).discard(client)
+
+    def broadcast(self, sid: int, data: bytes | bytearray, sender: ClientProtocol | None = None) -> None:
+        for client in self.members.get(sid, ()):
+            if client is not sender or self.echo:
+                client.write(data)
+
+    def handle(self, client: ClientProtocol, req: RequestView | RelayView) -> None:
+        if isinstance(req, RelayView):
+            self.handle_relay(client, req)
+            return
+        if not client.uid and req.type != REQ.CTL_LOGIN:
+            return
+        match req.type:
+            case REQ.CTL_LOGIN:
+                self.login(client, req)
+            case REQ.MSG_SEND:
+                if client in self.members.get(req.session, ()):
+                    self.broadcast(req.session, response(REQ.MSG_NEW, session=req.session, usrname=client.usrname, msg=req.msg), client)
+            case REQ.CTL_NEWSE:
+                self.new_session(client, req.usrname)
+            case REQ.CTL_JOINS:
+                ok = 0 < req.session <= len(self.sessions)
+                if ok:
+                    self.members[req.session].add(client)
+                    client.sessions.add(req.session)
+                client.write(response(REQ.CTL_JOINS, uid=0 if ok else -1, session=req.session))
+            case REQ.CTL_QUITS:
+                self.members.get(req.session, set()).discard(client)
+                client.sessions.discard(req.session)
+                client.write(response(REQ.CTL_QUITS, session=req.session))
+            case REQ.CTL_SESS:
+                client.write(response(REQ.CTL_SESS, uid=len(self.sessions), msg=pack_names(self.sessions)))
+            case REQ.CTL_SENAME:
+                if 0 < req.session <= len(self.sessions):
+                    client.write(response(REQ.CTL_SENAME, session=req.session, msg=self.sessions[req.session - 1]))
+                else:
+                    client.write(response(REQ.CTL_SENAME, session=-1))
+            case REQ.CTL_USRS:
+                names = [i.usrname for i in self.clients if i.uid]
+                client.write(pack_relay(magic=VCC_MAGIC_RL, type=REQ.CTL_USRS, uid=len(names), session=0, usrname="", visible="", msg=pack_names(names)))
+            case REQ.CTL_UINFO:
+                self.user_info(client, req.msg)
+            case REQ.SYS_SCRINC:
+                info = self.users.get(req.usrname)
+                if info is not None:
+                    info.score += req.session
+                client.write(response(REQ.SYS_SCRINC, uid=0 if info is not None else 1))
+            case _:
+                logging.debug(f"mockd: unknown request type {req.type}")
+
+    def login(self, client: ClientProtocol, req: RequestView) -> None:
+        usrname = req.usrname
+        info = self.users.get(usrname)
+        if self.check_password and (info is None or info.password != req.msg):
+            client.write(response(REQ.CTL_LOGIN, uid=0))
+            return
+        if info is None:
+            self.users[usrname] = UserInfo()
+        client.usrname = usrname
+        client.uid = self._next_uid
+        self._next_uid += 1
+        self.members[0].add(client)
+        client.sessions.add(0)
+        client.write(response(REQ.CTL_LOGIN, uid=client.uid))
+
+    def new_session(self, client: ClientProtocol, name: str) -> None:
+        if len(self.sessions) >= MAX_SESSIONS or name in self.sessions:
+            client.write(response(REQ.CTL_NEWSE, session=-1, msg=name))
+            return
+        self.sessions.append(name)
+        sid = len(self.sessions)
+        self.members[sid] = {client}
+        client.sessions.add(sid)
+        client.write(response(REQ.CTL_NEWSE, session=sid, msg=name))
+
+    def user_info(self, client: ClientProtocol, usrname: str) -> None:
+        info = self.users.get(usrname)
+        if info is None:
+            client.write(response(REQ.CTL_UINFO, uid=-1))
+            return
+        body = USER_STRUCT.pack(htonl(info.score), htonl(info.level), usrname.encode(), b"")
+        client.write(response(REQ.CTL_UINFO, msg=body))
+
+    def handle_relay(self, client: ClientProtocol, req: RelayView) -> None:
+        if not client.uid or req.type != REQ.REL_MSG:
+            return
+        visible = req.visible
+        data = pack_relay(magic=VCC_MAGIC_RL, type=REQ.REL_NEW, uid=1 if visible else 0, session=req.session, usrname=client.usrname, visible=visible, msg=req.raw_msg)
+        if visible:
+            for i in self.members.get(req.session, ()):
+                if i.usrname == visible:
+                    i.write(data)
+        else:
+            self.broadcast(req.session, data, client)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run a local vccd for tests and benchmarks", prog="vcc-mockd")
+    parser.add_argument("-p", "--port", type=int, metavar="port", default=VCC_PORT, help="the port to listen on (default: 46)")
+    parser.add_argument("-e", "--echo", action="store_true", help="send messages back to the sender too")
+    parser.add_argument("-D", "--debug", action="store_true", help="enable debug mode")
+    parser.add_argument(dest="host", metavar="host", nargs="?", default="127.0.0.1", help="the address to listen on")
+    return parser.parse_args()
+
+async def main() -> None:
+    args = parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARN, format="%(levelname)s: %(message)s")
+    async with MockServer(args.host, args.port, echo=args.echo) as server:
+        await server.serve_forever()
+
+def amain() -> None:
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    amain()
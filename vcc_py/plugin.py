@@ -12,46 +12,198 @@
 # <https://www.gnu.org/licenses/>. 
 
 from __future__ import annotations
+import asyncio
+import inspect
 import logging
+import time
 
 from types import TracebackType
-from typing import Awaitable, Callable, Generator, TypeAlias, overload, Any
+from typing import Awaitable, Callable, Container, Generator, Iterable, Literal, TypeAlias, cast, overload, Any
 import runpy
 
 from .sock import Connection
+from .codec import RequestView
 from .constants import *
 from .config import Configs
 from .commands import new_commands
+from .metrics import REGISTRY, Histogram
+from .profiling import Timer
 
-send_hook_type: TypeAlias = Callable[[str], str | None]
-recv_hook_type: TypeAlias = Callable[[Request], Request | None]
+send_hook_type: TypeAlias = Callable[[str], str | None | Awaitable[str | None]]
+recv_hook_type: TypeAlias = Callable[[Request | RequestView], Request | RequestView | None | Awaitable[Request | RequestView | None]]
 cmd_type: TypeAlias = Callable[[Connection, list[str]], Awaitable[None]]
 init_func_type: TypeAlias = Callable[[MyData], Generator[None, None, None]]
+close_func_type: TypeAlias = Callable[[], Awaitable[None]]
+
+overflow_type: TypeAlias = Literal["drop", "block"]
+
+def hook_timer(plugin: str, kind: str, index: int, func: Callable[..., Any]) -> Timer:
+    """index is the place of the hook among the ones of its kind in the plugin, hooks are often all named _"""
+    histogram = REGISTRY.histogram("vcc_hook_seconds", "time spent in a hook", plugin=plugin, kind=kind, hook=str(index))
+    return Timer(f"the {kind} hook #{index} ({func.__qualname__}) of {plugin}", histogram)
+
+class HookRunner:
+    """Run the observing hooks of a plugin in worker tasks
+
+    At most concurrency hooks run at the same time, and at most queue_size messages wait for them.
+    When the queue is full, messages are dropped or the receiver waits, depending on overflow
+    """
+    def __init__(self, name: str, concurrency: int, queue_size: int, overflow: overflow_type) -> None:
+        self.name = name
+        self.concurrency = concurrency
+        self.overflow = overflow
+        self.dropped = 0
+        self._queue: asyncio.Queue[tuple[RecvHook, Request | RequestView]] = asyncio.Queue(queue_size)
+        self._workers: list[asyncio.Task[None]] = []
+
+    async def submit(self, hook: RecvHook, req: Request | RequestView) -> None:
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        if self.overflow == "block":
+            await self._queue.put((hook, req))
+            return
+        try:
+            self._queue.put_nowait((hook, req))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logging.debug("hooks of %s are too slow, %d messages dropped", self.name, self.dropped)
+
+    async def _work(self) -> None:
+        while True:
+            hook, req = await self._queue.get()
+            start = time.perf_counter()
+            try:
+                result = hook.func(req)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                logging.exception(f"a hook of {self.name} failed")
+            finally:
+                hook.timer.stop(start)
+                self._queue.task_done()
+
+    async def close(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+class RecvHook:
+    """A recv hook and the messages it wants, None means no filter
+
+    The type and session filters are matched against the message as it's received. An observing
+    hook can't change or drop messages, it's run by the HookRunner of its plugin
+    """
+    __slots__ = ("func", "sessions", "types", "usrnames", "prefixes", "is_async", "runner", "timer")
+    def __init__(
+        self,
+        func: recv_hook_type,
+        sessions: Iterable[int] | None = None,
+        types: Iterable[int] | None = None,
+        usrnames: Container[str] | None = None,
+        prefixes: str | tuple[str, ...] | None = None,
+        runner: HookRunner | None = None,
+        timer: Timer | None = None,
+    ) -> None:
+        self.func = func
+        self.timer = Timer(func.__qualname__, Histogram()) if timer is None else timer
+        self.is_async = inspect.iscoroutinefunction(func)
+        self.runner = runner
+        self.sessions = None if sessions is None else frozenset(sessions)
+        self.types = None if types is None else frozenset(types)
+        # not copied, so a set which changes later can be used
+        self.usrnames = usrnames
+        self.prefixes = prefixes
+
+    def wants(self, type: int, session: int) -> bool:
+        return (self.types is None or type in self.types) and (self.sessions is None or session in self.sessions)
 
 class Plugin:
-    def __init__(self, data: MyData, configs: Configs) -> None:
+    def __init__(self, data: MyData, configs: Configs, name: str = "plugin") -> None:
+        self.name = name
         self._data = data
         self.configs = configs
         self._send_hooks: list[send_hook_type] = []
-        self._recv_hooks: list[recv_hook_type] = []
+        self._recv_hooks: list[RecvHook] = []
+        self._on_change: Callable[[], None] | None = None
+        self._runner: HookRunner | None = None
+        # limits of the observing hooks, change them before registering any
+        self.concurrency = 4
+        self.queue_size = 256
+        self.overflow: overflow_type = "drop"
         self.cmds: dict[str, cmd_type] = {}
         self._init_funcs: list[init_func_type] = []
         self._init_results: list[Generator[None, None, None]] = []
+        self._close_funcs: list[close_func_type] = []
 
     def get_send_hooks(self) -> list[send_hook_type]:
         return self._send_hooks
 
     def register_send_hook(self, func: send_hook_type) -> send_hook_type:
         self._send_hooks.append(func)
+        self._changed()
         return func
 
     def get_recv_hooks(self) -> list[recv_hook_type]:
-        return self._recv_hooks
+        return [i.func for i in self._recv_hooks]
+
+    @overload
+    def register_recv_hook(self, func: recv_hook_type) -> recv_hook_type: ...
+
+    @overload
+    def register_recv_hook(
+        self,
+        func: None = None, *,
+        sessions: Iterable[int] | None = None,
+        types: Iterable[int] | None = None,
+        usrnames: Container[str] | None = None,
+        prefixes: str | tuple[str, ...] | None = None,
+        observe: bool = False,
+    ) -> Callable[[recv_hook_type], recv_hook_type]: ...
+
+    def register_recv_hook(
+        self,
+        func: recv_hook_type | None = None, *,
+        sessions: Iterable[int] | None = None,
+        types: Iterable[int] | None = None,
+        usrnames: Container[str] | None = None,
+        prefixes: str | tuple[str, ...] | None = None,
+        observe: bool = False,
+    ) -> Callable[[recv_hook_type], recv_hook_type] | recv_hook_type:
+        """Register a recv hook, which is only called for the messages matching every filter given
+
+        It can be a coroutine function. If observe is true, its result is ignored and it runs
+        concurrently with receiving, see HookRunner
+        """
+        def register(hook_func: recv_hook_type) -> recv_hook_type:
+            runner = self.get_runner() if observe else None
+            timer = hook_timer(self.name, "recv", len(self._recv_hooks), hook_func)
+            self._recv_hooks.append(RecvHook(hook_func, sessions, types, usrnames, prefixes, runner, timer))
+            self._changed()
+            return hook_func
+        return register if func is None else register(func)
+
+    def get_runner(self) -> HookRunner:
+        if self._runner is None:
+            self._runner = HookRunner(self.name, self.concurrency, self.queue_size, self.overflow)
+        return self._runner
 
-    def register_recv_hook(self, func: recv_hook_type) -> recv_hook_type:
-        self._recv_hooks.append(func)
+    def register_close_func(self, func: close_func_type) -> close_func_type:
+        """Register a coroutine function which is awaited when the plugin is unloaded"""
+        self._close_funcs.append(func)
         return func
 
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.close()
+        for i in self._close_funcs:
+            await i()
+        self._close_funcs.clear()
+
+    def _changed(self) -> None:
+        if self._on_change is not None:
+            self._on_change()
+
     def get_init_funcs(self) -> list[init_func_type]:
         return self._init_funcs
 
@@ -89,19 +241,26 @@ class Plugin:
         return func if isinstance(name_or_func, str) else func(name_or_func)
 
 class Plugins:
-    def __init__(self, conn: Connection, extra_plugin: str | None = None) -> None:
+    def __init__(self, conn: Connection, extra_plugin: str | None = None, configs: Configs | None = None) -> None:
         self.connection = conn
         self.extra_plugin = extra_plugin
+        self._configs = configs
+        self.plugs: list[Plugin] = []
+        self._send_chain: list[tuple[send_hook_type, bool, Timer]] = []
+        self._recv_hooks: list[RecvHook] = []
+        # (type, session) -> the hooks which may want such messages
+        self._recv_chains: dict[tuple[int, int], list[RecvHook]] = {}
 
     async def __aenter__(self) -> Plugins:
-        self.configs = Configs()
+        self.configs = Configs() if self._configs is None else self._configs
         self.module_names = self.configs.plugin_list
         if self.extra_plugin is not None:
             self.module_names.append(self.extra_plugin)
         self.modules: list[dict[str, Any]] = []
-        self.plugs: list[Plugin] = []
+        self.plugs = []
         for name in self.module_names:
-            plug = Plugin(self.connection.data, self.configs)
+            plug = Plugin(self.connection.data, self.configs, name)
+            plug._on_change = self.rebuild
             self.modules.append(runpy.run_module(f"vcc_py.plugins.{name}", {
                 "plugin": plug
             }))
@@ -116,37 +275,75 @@ class Plugins:
             #     await result
             
             # self.plugs.append(plug)
+        self.rebuild()
         new_commands(self.get_commands())
         return self
 
     async def add_plugin(self, name: str) -> None:
-        plug = Plugin(self.connection.data, self.configs)
+        plug = Plugin(self.connection.data, self.configs, name)
+        plug._on_change = self.rebuild
         self.modules.append(runpy.run_module(f"vcc_py.plugins.{name}", {
             "plugin": plug
         }))
+        plug.init()
         self.plugs.append(plug)
+        self.rebuild()
         new_commands(plug.cmds)
 
+    def rebuild(self) -> None:
+        """Flatten the hooks of every plugin, call it after changing plugs"""
+        self._send_chain = [
+            (j, inspect.iscoroutinefunction(j), hook_timer(i.name, "send", index, j)) for i in self.plugs for index, j in enumerate(i._send_hooks)
+        ]
+        self._recv_hooks = [j for i in self.plugs for j in i._recv_hooks]
+        self._recv_chains.clear()
+
+    def _recv_chain(self, type: int, session: int) -> list[RecvHook]:
+        if len(self._recv_chains) >= 4096:
+            self._recv_chains.clear()
+        chain = self._recv_chains[type, session] = [i for i in self._recv_hooks if i.wants(type, session)]
+        return chain
+
     async def __aexit__(self, exc_type: type[BaseException] | None, exc_val: BaseException | None, exc_tb: TracebackType | None) -> None:
         for plug in self.plugs:
+            await plug.close()
             plug.deinit()
 
-    def send_msg(self, msg_: str) -> str | None:
+    async def send_msg(self, msg_: str) -> str | None:
         msg: str | None = msg_
-        for i in self.plugs:
-            for j in i.get_send_hooks():
-                if msg is None:
-                    break
-                msg = j(msg)
+        for func, is_async, timer in self._send_chain:
+            if msg is None:
+                break
+            start = time.perf_counter()
+            if is_async:
+                msg = await cast(Awaitable[str | None], func(msg))
+            else:
+                msg = cast(str | None, func(msg))
+            timer.stop(start)
         return msg
 
-    def recv_msg(self, msg_: Request) -> Request | None:
-        msg: Request | None = msg_
-        for i in self.plugs:
-            for j in i.get_recv_hooks():
-                if msg is None:
-                    break
-                msg = j(msg)
+    async def recv_msg(self, msg_: Request | RequestView) -> Request | RequestView | None:
+        """Run the hooks on a message, a view is passed as it is unless a hook changes it"""
+        chain = self._recv_chains.get((msg_.type, msg_.session))
+        if chain is None:
+            chain = self._recv_chain(msg_.type, msg_.session)
+        msg: Request | RequestView | None = msg_
+        for i in chain:
+            if msg is None:
+                break
+            if i.usrnames is not None and msg.usrname not in i.usrnames:
+                continue
+            if i.prefixes is not None and not msg.msg.startswith(i.prefixes):
+                continue
+            if i.runner is not None:
+                await i.runner.submit(i, msg)
+                continue
+            start = time.perf_counter()
+            if i.is_async:
+                msg = await cast(Awaitable[Request | RequestView | None], i.func(msg))
+            else:
+                msg = cast(Request | RequestView | None, i.func(msg))
+            i.timer.stop(start)
         return msg
 
     def get_commands(self) -> dict[str, cmd_type]:
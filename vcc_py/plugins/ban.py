@@ -11,37 +11,175 @@
 # You should have received a copy of the GNU General Public License along with vcc.py. If not, see 
 # <https://www.gnu.org/licenses/>. 
 
+from pathlib import Path
+import fnmatch
+import json
+import os
+import re
+
+from vcc_py.codec import RequestView
 from vcc_py.plugin import Plugin
 from vcc_py.sock import Connection
-from vcc_py.constants import Request
+from vcc_py.constants import Request, REQ
 
 # Well, a dirty hack to ignore the Unbound, you can remove it if you don't want to use typing
 plugin: Plugin = globals()["plugin"]
 
-ban_list: set[str] = set()
+# The rules are kept in ban_file (default: ~/.vcc-ban.json). Usernames are a set, and the globs, the
+# regexes and the phrases are each joined into one regex, so checking a message costs the same
+# however many rules there are. The flags at the start of a regex rule are scoped to it, and a rule
+# with groups is refused since their numbers and names would clash once joined. The matchers are
+# built before the rules are changed, a bad rule changes nothing.
+
+KINDS = ("users", "globs", "regexes", "phrases")
+
+_GLOBAL_FLAGS = re.compile(r"\(\?([aiLmsux]+)\)")
+
+def scoped_regex(rule: str) -> str:
+    """rule as a group which can be joined with others, raise re.error or ValueError if it can't"""
+    if re.compile(rule).groups:
+        raise ValueError(f"the regex {rule!r} has groups, use (?:...) instead of (...)")
+    flags = ""
+    while (match := _GLOBAL_FLAGS.match(rule)) is not None:
+        flags += match[1]
+        rule = rule[match.end():]
+    # a comment of the verbose mode ends at a newline, not at the closing parenthesis
+    end = "\n)" if "x" in flags else ")"
+    return f"(?{''.join(dict.fromkeys(flags))}:{rule}{end}"
+
+def check_not_empty(values: list[str]) -> None:
+    # an empty phrase would ban every message
+    if any(not i.strip() for i in values):
+        raise ValueError("a rule can't be empty")
+
+class BanFilter:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.set_rules({kind: set() for kind in KINDS})
+
+    def set_rules(self, rules: dict[str, set[str]]) -> None:
+        """compile rules and use them, raise re.error or ValueError and keep the old ones if a regex is bad"""
+        regexes = [scoped_regex(i) for i in sorted(rules["regexes"])]
+        regex_re = re.compile("|".join(regexes)) if regexes else None
+        globs = [fnmatch.translate(i) for i in rules["globs"]]
+        glob_re = re.compile("|".join(globs)) if globs else None
+        # the longest phrase first, so the alternation doesn't stop at a prefix of it
+        phrases = sorted(rules["phrases"], key=len, reverse=True)
+        phrase_re = re.compile("|".join(re.escape(i) for i in phrases), re.IGNORECASE) if phrases else None
+        self.rules = rules
+        self.users = frozenset(rules["users"])
+        self.glob_re = glob_re
+        self.regex_re = regex_re
+        self.phrase_re = phrase_re
+
+    def banned(self, usrname: str, msg: str) -> bool:
+        return (
+            usrname in self.users
+            or (self.glob_re is not None and self.glob_re.match(usrname) is not None)
+            or (self.regex_re is not None and self.regex_re.fullmatch(usrname) is not None)
+            or (self.phrase_re is not None and self.phrase_re.search(msg) is not None)
+        )
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        content = json.loads(self.path.read_text())
+        self.set_rules({kind: set(content.get(kind, [])) for kind in KINDS})
 
-@plugin.register_recv_hook
-def _(a: Request) -> Request | None:
-    if a.usrname in ban_list:
+    def save(self) -> None:
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps({kind: sorted(self.rules[kind]) for kind in KINDS}, indent=4))
+        os.replace(tmp_path, self.path)
+
+    def update(self, kind: str, values: list[str], add: bool) -> None:
+        rules = {k: set(v) for k, v in self.rules.items()}
+        if add:
+            check_not_empty(values)
+            rules[kind].update(values)
+        else:
+            rules[kind].difference_update(values)
+        self.set_rules(rules)
+        self.save()
+
+    def import_file(self, path: Path) -> int:
+        """import rules from a file, one a line: a username, glob:<pattern>, re:<regex> or phrase:<text>"""
+        prefixes = {"glob:": "globs", "re:": "regexes", "phrase:": "phrases"}
+        new: dict[str, list[str]] = {kind: [] for kind in KINDS}
+        for line in path.read_text().splitlines():
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            for prefix, kind in prefixes.items():
+                if line.startswith(prefix):
+                    new[kind].append(line[len(prefix):])
+                    break
+            else:
+                new["users"].append(line)
+        for values in new.values():
+            check_not_empty(values)
+        self.set_rules({kind: self.rules[kind] | set(new[kind]) for kind in KINDS})
+        self.save()
+        return sum(len(i) for i in new.values())
+
+ban_filter = BanFilter(Path(os.path.expanduser(str(plugin.configs.config.get("ban_file", "~/.vcc-ban.json")))))
+try:
+    ban_filter.load()
+except (OSError, ValueError, re.error) as e:
+    print(f"Cannot load the ban list: {e}")
+
+@plugin.register_recv_hook(types={REQ.MSG_NEW})
+def _(a: Request | RequestView) -> Request | RequestView | None:
+    if ban_filter.banned(a.usrname, a.msg):
         return None
     return a
 
+KIND_FLAGS = {
+    "-g": "globs", "--glob": "globs",
+    "-e": "regexes", "--regex": "regexes",
+    "-w": "phrases", "--phrase": "phrases",
+}
+
+def ban_usage(cmd: str) -> None:
+    print(f"usage: {cmd} [-g|--glob|-e|--regex|-w|--phrase] [rule]")
+    print(f"       {cmd} -l|--list")
+    if cmd == "-ban":
+        print(f"       {cmd} -r|--reload")
+        print(f"       {cmd} -i|--import file")
+
+async def change_rules(cmd: str, args: list[str], add: bool) -> None:
+    match args:
+        case ["-l" | "--list"]:
+            for kind in KINDS:
+                for rule in sorted(ban_filter.rules[kind]):
+                    print(f"{kind}\t{rule}")
+        case ["-r" | "--reload"] if add:
+            ban_filter.load()
+            print(f"{sum(len(i) for i in ban_filter.rules.values())} rules loaded")
+        case ["-i" | "--import", path] if add:
+            print(f"{ban_filter.import_file(Path(path).expanduser())} rules imported")
+        case [flag, *rest] if flag in KIND_FLAGS:
+            rule = " ".join(rest) if rest else input("Enter the rule: ")
+            ban_filter.update(KIND_FLAGS[flag], [rule], add)
+        case [flag, *_] if flag.startswith("-"):
+            ban_usage(cmd)
+        case [name, *_]:
+            ban_filter.update("users", [name], add)
+        case []:
+            prompt = "Enter the people you would like to ban: " if add else "Enter the people you would like to unban: "
+            ban_filter.update("users", [input(prompt)], add)
+
 @plugin.register_cmd("-ban")
 async def _(conn: Connection, args: list[str]) -> None:
-    """Ban someone so you won't receive messages from him/her"""
-    if args:
-        ban_people = args[0]
-    else:
-        ban_people = input("Enter the people you would like to ban: ")
-    ban_list.add(ban_people)
+    """Ban someone or something so you won't receive messages from him/her"""
+    try:
+        await change_rules("-ban", args, True)
+    except (OSError, ValueError, re.error) as e:
+        print(f"Cannot change the ban list: {e}")
 
 @plugin.register_cmd("-unban")
 async def _(conn: Connection, args: list[str]) -> None:
-    """Unban someone so you will be able to receive more messages from him/her"""
-    if args:
-        unban_people = args[0]
-    else:
-        unban_people = input("Enter the people you would like to unban: ")
-    ban_list.discard(unban_people)
-
-
+    """Unban someone or something so you will be able to receive more messages from him/her"""
+    try:
+        await change_rules("-unban", args, False)
+    except (OSError, ValueError, re.error) as e:
+        print(f"Cannot change the ban list: {e}")
@@ -11,23 +11,107 @@
 # You should have received a copy of the GNU General Public License along with vcc.py. If not, see 
 # <https://www.gnu.org/licenses/>. 
 
+import asyncio
+import logging
 import sys
-from subprocess import Popen, DEVNULL
 
+from vcc_py.codec import RequestView
 from vcc_py.plugin import Plugin
-from vcc_py.constants import Request
+from vcc_py.constants import Request, REQ
+
+# Messages are collected for beep_window seconds (default: 1) and shown in one notification per
+# session. A user is counted at most once every beep_user_interval seconds (default: 5), and at most
+# beep_max_procs (default: 2) notify-send run at the same time.
 
 plugin: Plugin = globals()["plugin"]
 
-@plugin.register_recv_hook
-def _(req: Request) -> Request | None:
-    print("\a", file=sys.stderr)
-    msg = req.msg
-    if len(msg) > 10:
-        msg = msg[:10] + "..."
-    if not sys.platform.startswith("win32"):
-        with Popen(["notify-send", "vcc", f"{req.usrname}: {msg}"], stdout=DEVNULL, stderr=DEVNULL):
-            pass
-    return req
+config = plugin.configs.config
+
+window = float(config.get("beep_window", 1))
+user_interval = float(config.get("beep_user_interval", 5))
+max_procs = int(config.get("beep_max_procs", 2))
+
+class Notifier:
+    def __init__(self) -> None:
+        # session -> usrname -> messages
+        self.pending: dict[int, dict[str, list[str]]] = {}
+        self.last_seen: dict[str, float] = {}
+        self.running = 0
+        self.tasks: set[asyncio.Task[None]] = set()
+        self.flush_handle: asyncio.TimerHandle | None = None
+
+    def add(self, req: Request | RequestView) -> None:
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        users = self.pending.get(req.session)
+        if users is None or req.usrname not in users:
+            if now - self.last_seen.get(req.usrname, -user_interval) < user_interval:
+                return
+            self.last_seen[req.usrname] = now
+            if users is None:
+                users = self.pending[req.session] = {}
+        users.setdefault(req.usrname, []).append(req.msg)
+        if self.flush_handle is None:
+            self.flush_handle = loop.call_later(window, self.flush)
+
+    def flush(self) -> None:
+        self.flush_handle = None
+        # the users who can't make it beep again anyway
+        now = asyncio.get_event_loop().time()
+        self.last_seen = {k: v for k, v in self.last_seen.items() if now - v < user_interval}
+        for sess in [k for k, v in self.pending.items() if not v]:
+            del self.pending[sess]
+        if not self.pending:
+            return
+        print("\a", end="", file=sys.stderr, flush=True)
+        if sys.platform.startswith("win32"):
+            self.pending.clear()
+            return
+        for sess in list(self.pending):
+            if self.running >= max_procs:
+                # keep the rest for the next window
+                self.flush_handle = asyncio.get_event_loop().call_later(window, self.flush)
+                return
+            task = asyncio.create_task(self.notify(self.summary(sess, self.pending.pop(sess))))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
 
+    @staticmethod
+    def summary(sess: int, users: dict[str, list[str]]) -> str:
+        count = sum(len(i) for i in users.values())
+        if count == 1:
+            (usrname, (msg,)), = users.items()
+            if len(msg) > 10:
+                msg = msg[:10] + "..."
+            return f"{usrname}: {msg}"
+        return f"{count} new messages from {len(users)} user{'s' if len(users) > 1 else ''} in #{sess:03}"
+
+    async def notify(self, text: str) -> None:
+        self.running += 1
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "notify-send", "vcc", text,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            await proc.wait()
+        except OSError as e:
+            logging.debug(f"beep: cannot run notify-send: {e!r}")
+        finally:
+            self.running -= 1
+
+    def close(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+notifier = Notifier()
+
+@plugin.register_recv_hook(types={REQ.MSG_NEW})
+def _(req: Request | RequestView) -> Request | RequestView | None:
+    notifier.add(req)
+    return req
 
+@plugin.register_close_func
+async def _() -> None:
+    notifier.close()
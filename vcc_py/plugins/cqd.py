@@ -11,7 +11,8 @@
 # You should have received a copy of the GNU General Public License along with vcc.py. If not, see 
 # <https://www.gnu.org/licenses/>. 
 
-from vcc_py.constants import Request
+from vcc_py.constants import Request, REQ
+from vcc_py.codec import RequestView
 from vcc_py.plugin import Plugin
 from vcc_py.sock import Connection
 from vcc_py.pretty import use_theme, Color, BLACK, RED, MODE_BLINK
@@ -29,11 +30,9 @@ async def _(conn: Connection, args: list[str]) -> None:
     """Send a "cqd", that's an interesting thing"""
     await conn.send(msg=f"-cqd#{args[0] if args else 'CQD'}\n")
 
-@plugin.register_recv_hook
-def _(req: Request) -> Request | None:
-    if req.msg.startswith("-cqd#"):
-        print_cqd(req.usrname, req.msg[5:-1])
-        return None
-    return req
+@plugin.register_recv_hook(types={REQ.MSG_NEW}, prefixes="-cqd#")
+def _(req: Request | RequestView) -> Request | RequestView | None:
+    print_cqd(req.usrname, req.msg[5:-1])
+    return None
 
 
@@ -11,8 +11,8 @@
 # You should have received a copy of the GNU General Public License along with vcc.py. If not, see 
 # <https://www.gnu.org/licenses/>. 
 
-from subprocess import Popen, PIPE
-
+import asyncio
+import logging
 import sys
 
 from vcc_py.plugin import Plugin
@@ -22,26 +22,80 @@ plugin: Plugin = globals()["plugin"]
 
 if sys.platform.startswith("win32"):
     exit()
+
+# no identifier characters, so no macro can match it
+DELIM = "\x02\x03\x02"
+TIMEOUT = 2
+
+class M4:
+    """A long-lived m4 which expands one message at a time, the macros are loaded once it starts"""
+    def __init__(self) -> None:
+        self.definitions = ""
+        self._proc: asyncio.subprocess.Process | None = None
+        self._lock = asyncio.Lock()
+
+    async def _start(self) -> None:
+        # --interactive makes the output unbuffered
+        self._proc = await asyncio.create_subprocess_exec(
+            "/bin/m4", "--interactive",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE
+        )
+        await self._exchange(self.definitions)
+
+    async def _exchange(self, text: str) -> str:
+        assert self._proc is not None and self._proc.stdin is not None and self._proc.stdout is not None
+        self._proc.stdin.write(f"{text}\n{DELIM}\n".encode())
+        await self._proc.stdin.drain()
+        output = await self._proc.stdout.readuntil(f"{DELIM}\n".encode())
+        return output[:-len(DELIM) - 1].decode(errors="ignore").removesuffix("\n")
+
+    async def expand(self, text: str) -> str:
+        """Expand text, it's returned as it is if m4 fails or hangs (e.g. an unclosed quote)"""
+        async with self._lock:
+            try:
+                if self._proc is None or self._proc.returncode is not None:
+                    await asyncio.wait_for(self._start(), TIMEOUT)
+                return await asyncio.wait_for(self._exchange(text), TIMEOUT)
+            except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+                logging.warning(f"m4 failed ({e!r}), restarting it")
+                self.stop()
+                return text
+
+    def stop(self) -> None:
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.kill()
+        self._proc = None
+
+    async def close(self) -> None:
+        proc = self._proc
+        self.stop()
+        if proc is not None:
+            await proc.wait()
+
+m4 = M4()
 loaded = False
-command = ""
+
+@plugin.register_close_func
+async def _() -> None:
+    await m4.close()
+
 @plugin.register_cmd("-m4def")
 async def _(conn: Connection, args: list[str]) -> None:
     """Define a macro which i will remember"""
     global loaded
-    global command
     command = ""
     while a := input("m4> "):
         if a == "finish":
             break
         command += a
+    m4.definitions = command
+    # the macros are loaded when m4 starts
+    m4.stop()
     loaded = True
     
 @plugin.register_send_hook
-def _(s: str) -> str:
+async def _(s: str) -> str:
     if s.startswith("-") or not loaded:
         return s
-    with Popen(["/bin/m4"], stdin=PIPE, stdout=PIPE, universal_newlines=True) as proc:
-        output, _ = proc.communicate(command + s)
-        return output
-
-
+    return await m4.expand(s)
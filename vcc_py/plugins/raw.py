@@ -13,10 +13,12 @@
 
 import asyncio
 import argparse
+from getpass import getpass
 
 from vcc_py.plugin import Plugin
 from vcc_py.constants import *
 from vcc_py.sock import Connection
+from vcc_py.loadgen import LoadGenerator, connect_all
 
 # Designed for testing and debuging
 
@@ -26,11 +28,12 @@ connection_list: list[Connection] = []
 
 @plugin.register_cmd("-radd")
 async def _(conn: Connection, args: list[str]) -> None:
-    """Create new connections"""
+    """Create new connections and log them in"""
     global connection_list
     count = int(args[0] if args else input("count: "))
+    password = args[1] if len(args) > 1 else getpass("password: ")
     data = conn.data
-    connection_list += list(await asyncio.gather(*[asyncio.create_task(Connection(conn.ip, conn.port, data.usrname, data.sess).__aenter__()) for _ in range(count)]))
+    connection_list += await connect_all(conn.ip, conn.port, count, data.usrname, password)
 
 @plugin.register_cmd("-rsend")
 async def _(conn: Connection, args: list[str]) -> None:
@@ -47,18 +50,30 @@ async def _(conn: Connection, args: list[str]) -> None:
     parser.add_argument(dest="msg", metavar="msg", nargs="?")
     args_ns = parser.parse_args(args)
     print(args_ns)
-    await asyncio.gather(*[asyncio.create_task(i.send(
+    reqs = [Request(
         magic = args_ns.magic,
         type = args_ns.type,
         uid = args_ns.uid,
-        session = args_ns.uid,
+        session = args_ns.session,
         flags = args_ns.flags,
         usrname = args_ns.usrname,
-        msg = args_ns.msg
-    )) for i in connection_list for _ in range(args_ns.repeat)])
-
-
-
-
-
+        msg = args_ns.msg or ""
+    )] * args_ns.repeat
+    await asyncio.gather(*[i.send_many(reqs) for i in connection_list])
 
+@plugin.register_cmd("-rload")
+async def _(conn: Connection, args: list[str]) -> None:
+    """Send messages from every connection at a fixed rate and show the latency"""
+    parser = argparse.ArgumentParser(add_help=False, exit_on_error=False)
+    parser.add_argument("--rate", type=float, metavar="rate", default=1.0)
+    parser.add_argument("--duration", type=float, metavar="duration", default=10.0)
+    parser.add_argument("--relay-ratio", type=float, metavar="ratio", default=0.0)
+    parser.add_argument("--size", type=int, metavar="size", default=64)
+    args_ns = parser.parse_args(args)
+    if not connection_list:
+        print("no connections, use -radd first")
+        return
+    generator = LoadGenerator(connection_list, args_ns.rate, args_ns.duration, args_ns.relay_ratio, args_ns.size)
+    total = await generator.run()
+    print(f"sent {generator.sent} recv {generator.received} lost {generator.sent - generator.received}")
+    print(f"latency: {total.summary()}")
@@ -11,35 +11,154 @@
 # You should have received a copy of the GNU General Public License along with vcc.py. If not, see 
 # <https://www.gnu.org/licenses/>. 
 
-from typing import Generator
+from typing import Any, Generator
+import asyncio
+import json
+import logging
 import os
+import signal
 
 from vcc_py.constants import *
+from vcc_py.codec import RequestView
 from vcc_py.plugin import Plugin
 
 # This is not encourged to use, you had better write a plugin instead
 
+# vcr_mode = exec (default): run vcr_executable for every message, it gets it from $VCR_TYPE,
+#     $VCR_USER, $VCR_MSG and $VCR_SID
+# vcr_mode = worker: run vcr_workers (default: 1) copies of vcr_executable once, every message is
+#     written to one of them as a line of JSON: {"type": ..., "user": ..., "msg": ..., "sid": ...}.
+#     Every line it prints is sent to the session, either as it is or as JSON: {"msg": ..., "session": ...}
+# At most vcr_queue_size (default: 256) messages wait for vcr_executable, more are dropped, or
+# received later if vcr_overflow = block
+
 plugin: Plugin = globals()["plugin"]
 
 config = plugin.configs.config
 
 sid = config["vcr_listen_sid"]
+executable: str = config["vcr_executable"]
+mode = config.get("vcr_mode", "exec")
+workers_count = int(config.get("vcr_workers", 1))
+
+plugin.concurrency = workers_count if mode == "worker" else 1
+plugin.queue_size = int(config.get("vcr_queue_size", 256))
+plugin.overflow = "block" if config.get("vcr_overflow") == "block" else "drop"
+
+def parse_reply(text: str) -> tuple[str, int] | None:
+    """the message and the session of a line printed by a worker, None if it's invalid"""
+    try:
+        reply: Any = json.loads(text)
+    except ValueError:
+        return text, sid
+    if not isinstance(reply, dict) or "msg" not in reply:
+        return text, sid
+    session = reply.get("session", sid)
+    if isinstance(session, str) and session.isascii() and session.isdigit():
+        session = int(session)
+    if isinstance(session, bool) or not isinstance(session, int) or not 0 <= session < 2 ** 31:
+        logging.warning(f"vcr: the session of the reply isn't a session id, skipped: {text}")
+        return None
+    return str(reply["msg"]), session
+
+class Workers:
+    """The vcr_executable processes of worker mode, started when the first message comes"""
+    def __init__(self, data: MyData) -> None:
+        self.data = data
+        self.procs: list[asyncio.subprocess.Process] = []
+        self.readers: list[asyncio.Task[None]] = []
+        self.idle: asyncio.Queue[int] = asyncio.Queue()
+        # several feeds run at once, only the first one starts the pool
+        self.starting = asyncio.Lock()
+
+    async def start(self, index: int) -> None:
+        proc = await asyncio.create_subprocess_shell(
+            executable,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env={**os.environ, "VCR_SID": str(sid)},
+            # vcr_executable runs in a shell, kill the whole group when stopping
+            start_new_session=True
+        )
+        if index < len(self.procs):
+            self.procs[index] = proc
+            self.readers[index].cancel()
+            self.readers[index] = asyncio.create_task(self.read_replies(proc))
+        else:
+            self.procs.append(proc)
+            self.readers.append(asyncio.create_task(self.read_replies(proc)))
+
+    async def read_replies(self, proc: asyncio.subprocess.Process) -> None:
+        assert proc.stdout is not None
+        while line := await proc.stdout.readline():
+            reply = parse_reply(line.decode(errors="ignore").rstrip("\n"))
+            if reply is None:
+                continue
+            text, session = reply
+            try:
+                await self.data.plugs.connection.send(type=REQ.MSG_SEND, session=session, msg=text)
+            except Exception:
+                # a bad reply mustn't stop the replies after it
+                logging.exception("vcr: cannot send the reply")
+
+    async def feed(self, req: Request | RequestView) -> None:
+        if not self.procs:
+            async with self.starting:
+                if not self.procs:
+                    for i in range(workers_count):
+                        await self.start(i)
+                        self.idle.put_nowait(i)
+        index = await self.idle.get()
+        try:
+            proc = self.procs[index]
+            if proc.returncode is not None:
+                logging.warning("vcr: the worker exited, restarting it")
+                await self.start(index)
+                proc = self.procs[index]
+            assert proc.stdin is not None
+            proc.stdin.write(json.dumps({"type": req.type, "user": req.usrname, "msg": req.msg, "sid": sid}).encode() + b"\n")
+            await proc.stdin.drain()
+        except (OSError, ValueError):
+            logging.exception("vcr: cannot write to the worker")
+        finally:
+            self.idle.put_nowait(index)
+
+    async def stop(self) -> None:
+        for reader in self.readers:
+            reader.cancel()
+        for proc in self.procs:
+            if proc.stdin is not None:
+                proc.stdin.close()
+            try:
+                await asyncio.wait_for(proc.wait(), 1)
+            except asyncio.TimeoutError:
+                os.killpg(proc.pid, signal.SIGKILL)
+                await proc.wait()
+
+workers: Workers | None = None
 
 @plugin.register_init_func
 def _(data: MyData) -> Generator[None, None, None]:
+    global workers
+    if mode == "worker":
+        workers = Workers(data)
     yield
-    os.unsetenv("VCR_TYPE")
-    os.unsetenv("VCR_USER")
-    os.unsetenv("VCR_MSG")
-    os.unsetenv("VCR_SID")
-
-@plugin.register_recv_hook
-def _(req: Request) -> Request:
-    if req.session != sid:
-        return req
-    os.putenv("VCR_TYPE", str(req.type))
-    os.putenv("VCR_USER", req.usrname)
-    os.putenv("VCR_MSG", req.msg)
-    os.putenv("VCR_SID", str(sid))
-    os.system(f"{config['vcr_executable']}")
-    return req
+
+@plugin.register_close_func
+async def _() -> None:
+    if workers is not None:
+        await workers.stop()
+
+@plugin.register_recv_hook(sessions={sid}, observe=True)
+async def _(req: Request | RequestView) -> None:
+    if workers is not None:
+        await workers.feed(req)
+        return
+    proc = await asyncio.create_subprocess_shell(executable, env={
+        **os.environ,
+        "VCR_TYPE": str(req.type),
+        "VCR_USER": req.usrname,
+        "VCR_MSG": req.msg,
+        "VCR_SID": str(sid),
+    })
+    await proc.wait()
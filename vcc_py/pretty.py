@@ -12,9 +12,18 @@
 # <https://www.gnu.org/licenses/>. 
 
 
-from datetime import datetime
+from collections import deque
+from typing import Callable, TextIO
+import asyncio
+import sys
+import time
 
 from .constants import MSG_NEW_RELAY, MSG_NEW_ONLY_VISIBLE
+from .metrics import REGISTRY
+
+RENDERED_LINES = REGISTRY.counter("vcc_rendered_lines_total", "lines written by the renderer")
+SKIPPED_LINES = REGISTRY.counter("vcc_skipped_lines_total", "lines the renderer had no time for")
+RENDER_TIME = REGISTRY.histogram("vcc_render_seconds", "time to write the buffered lines")
 
 # Colors
 BLACK = 0
@@ -33,6 +42,7 @@ MODE_LINE = 4
 MODE_BLINK = 5
 
 REMOVE_THIS_LINE = "\033[2K\r"
+RESET = "\033[0m"
 
 def to_fg(color: int) -> int:
     return color + 30
@@ -42,11 +52,12 @@ def to_bg(color: int) -> int:
 
 class Color:
     """the color theme"""
-    __slots__ = ("fg", "bg", "mode")
+    __slots__ = ("fg", "bg", "mode", "prefix")
     def __init__(self, *, fg: int, bg: int, mode: int):
         self.fg = to_fg(fg)
         self.bg = to_bg(bg)
         self.mode = mode
+        self.prefix = f"\033[{self.mode};{self.fg};{self.bg}m"
 
 usrname_theme = Color(fg=LIGHTBLUE, bg=BLACK, mode=MODE_LINE)
 msg_theme = Color(fg=YELLOW, bg=BLACK, mode=MODE_HIGHLIGHT)
@@ -59,23 +70,47 @@ relay_theme = Color(fg=BLUE, bg=BLACK, mode=MODE_HIGHLIGHT)
 
 def use_theme(theme: Color, text: str) -> str:
     """change some text to the color"""
-    return f"\033[{theme.mode};{theme.fg};{theme.bg}m{text}\033[0m"
-
-def show_msg(username: str, message: str, sess: int, newlinefirst: bool=False, flag: int=0) -> None:
-    """display someone's message"""
-    time = datetime.now()
+    return theme.prefix + text + RESET
+
+RELAY_TEXT = use_theme(relay_theme, "[relay] [broadcast] ")
+RELAY_VISIBLE_TEXT = use_theme(relay_theme, "[relay] [to-you-only] ")
+
+_clock_text = ""
+_clock_until = 0.0
+
+def clock() -> str:
+    """the themed time, it's only formatted again when the minute changes"""
+    global _clock_text, _clock_until
+    now = time.time()
+    if now >= _clock_until:
+        local = time.localtime(now)
+        _clock_text = use_theme(time_theme, f"{local.tm_hour:02}:{local.tm_min:02}")
+        _clock_until = now - local.tm_sec - now % 1 + 60
+    return _clock_text
+
+def format_msg(username: str, message: str, sess: int, flag: int=0, when: float | None=None) -> str:
+    """someone's message as a line, without the newline, when is the time of an old message"""
     if flag & MSG_NEW_RELAY:
-        relay_text = use_theme(relay_theme, "[relay] " + ("[to-you-only] " if flag & MSG_NEW_ONLY_VISIBLE else "[broadcast] "))
+        relay_text = RELAY_VISIBLE_TEXT if flag & MSG_NEW_ONLY_VISIBLE else RELAY_TEXT
     else:
         relay_text = ""
-    
-    str = f"[{use_theme(time_theme, f'{time.hour:02}:{time.minute:02}')}] {session(sess)} {relay_text}{use_theme(usrname_theme, username)}@: {use_theme(msg_theme, message)}"
+    time_text = clock() if when is None else use_theme(time_theme, time.strftime("%Y-%m-%d %H:%M", time.localtime(when)))
+    return f"[{time_text}] {session(sess)} {relay_text}{usrname_theme.prefix}{username}{RESET}@: {msg_theme.prefix}{message}{RESET}"
+
+def show_msg(username: str, message: str, sess: int, newlinefirst: bool=False, flag: int=0) -> None:
+    """display someone's message"""
+    str = format_msg(username, message, sess, flag)
     str = "\r" + str if newlinefirst else str + "\n"
     print(str, end="")
 
+_session_texts: dict[int, str] = {}
+
 def session(sess: int) -> str:
     """display the session"""
-    return use_theme(session_theme, f'#{sess:03}')
+    text = _session_texts.get(sess)
+    if text is None:
+        text = _session_texts[sess] = use_theme(session_theme, f'#{sess:03}')
+    return text
 
 def level(level: int) -> str:
     """display the level"""
@@ -86,7 +121,96 @@ def help_line(cmd: str, description: str) -> None:
     cmd = f"{cmd + ': ':<8}"
     print(f"{use_theme(help_cmd_theme, cmd)}{use_theme(help_text_theme, description)}")
 
+def prompt_text(username: str, sess: int, lvl: int) -> str:
+    return f"{REMOVE_THIS_LINE}{level(lvl)} {session(sess)} {use_theme(usrname_theme, username)}$: "
+
 def prompt(username: str, sess: int, lvl: int) -> None:
     """display the prompt"""
-    print(f"{REMOVE_THIS_LINE}{level(lvl)} {session(sess)} {use_theme(usrname_theme, username)}$: ", end="")
+    print(prompt_text(username, sess, lvl), end="")
+
+class Renderer:
+    """Show received messages at most rate times a second
+
+    Lines are buffered and written at once, then the prompt is drawn again. If more than max_lines
+    are waiting, the oldest ones are replaced by a "N messages skipped" line, so receiving never
+    waits for the terminal. The terminal is written in a thread and the lines which come meanwhile
+    wait for the next write, an out which is given is written directly. Call drain() before
+    printing anything else, so it comes after the lines which are waiting
+    """
+    def __init__(self, prompt: Callable[[], str], rate: float = 30, max_lines: int = 200, out: TextIO | None = None) -> None:
+        self.prompt = prompt
+        self.interval = 1 / rate
+        self.max_lines = max_lines
+        self.out = sys.stdout if out is None else out
+        self.threaded = out is None
+        self.skipped = 0
+        self._lines: deque[str] = deque()
+        self._handle: asyncio.TimerHandle | None = None
+        self._writing: asyncio.Task[None] | None = None
+        self._last_flush = 0.0
+
+    def show_msg(self, username: str, message: str, sess: int, flag: int=0) -> None:
+        self.add(format_msg(username, message, sess, flag))
+
+    def add(self, line: str) -> None:
+        self._lines.append(line)
+        if len(self._lines) > self.max_lines:
+            self._lines.popleft()
+            self.skipped += 1
+            SKIPPED_LINES.inc()
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._handle is None:
+            loop = asyncio.get_event_loop()
+            delay = self._last_flush + self.interval - loop.time()
+            self._handle = loop.call_later(max(0.0, delay), self.flush)
+
+    def flush(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._writing is not None and not self._writing.done():
+            # the lines wait for the write, max_lines still holds
+            return
+        if not self._lines and not self.skipped:
+            return
+        start = time.perf_counter()
+        RENDERED_LINES.inc(len(self._lines))
+        parts = [REMOVE_THIS_LINE]
+        if self.skipped:
+            parts.append(use_theme(help_text_theme, f"... {self.skipped} messages skipped") + "\n")
+            self.skipped = 0
+        parts.append("\n".join(self._lines))
+        parts.append("\n")
+        parts.append(self.prompt())
+        self._lines.clear()
+        if self.threaded:
+            self._writing = asyncio.get_event_loop().create_task(self._write_in_thread("".join(parts)))
+        else:
+            self._write("".join(parts))
+        self._last_flush = asyncio.get_event_loop().time()
+        RENDER_TIME.record((time.perf_counter() - start) * 1e6)
+
+    def _write(self, text: str) -> None:
+        self.out.write(text)
+        self.out.flush()
+
+    async def _write_in_thread(self, text: str) -> None:
+        try:
+            await asyncio.to_thread(self._write, text)
+        except OSError:
+            # the terminal is gone, nothing can be shown anyway
+            self._lines.clear()
+            return
+        if self._lines or self.skipped:
+            self._schedule()
+
+    async def drain(self) -> None:
+        """write every line which is waiting and wait until it's written"""
+        while True:
+            self.flush()
+            if self._writing is None or self._writing.done():
+                return
+            await asyncio.shield(self._writing)
 
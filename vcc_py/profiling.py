@@ -0,0 +1,180 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see
+# <https://www.gnu.org/licenses/>.
+
+# Finding what makes the client stutter, everything is off unless it's set in the config file:
+#   slow_hook_ms: 50          (log the hooks and commands which take longer)
+#   loop_lag_ms: 200          (log what was running when the event loop was blocked for longer)
+# and -prof start|stop|dump runs cProfile and tracemalloc in a live session
+
+from __future__ import annotations
+
+from typing import Any, AsyncIterator, Final
+import asyncio
+import contextlib
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+
+from .metrics import REGISTRY, Histogram
+
+class Timer:
+    """The histogram of a hook or a command, and the time above which a call is logged"""
+    __slots__ = ("name", "histogram")
+    # seconds, None doesn't log anything
+    threshold: float | None = None
+
+    def __init__(self, name: str, histogram: Histogram) -> None:
+        self.name = name
+        self.histogram = histogram
+
+    def stop(self, start: float) -> None:
+        """record a call which started at start, a time.perf_counter()"""
+        elapsed = time.perf_counter() - start
+        self.histogram.record(elapsed * 1e6)
+        if Timer.threshold is not None and elapsed > Timer.threshold:
+            logging.warning(f"{self.name} took {elapsed * 1000:.1f}ms")
+
+def set_threshold(config: dict[str, Any]) -> None:
+    ms = float(config.get("slow_hook_ms", 0))
+    Timer.threshold = ms / 1000 if ms > 0 else None
+
+LOOP_LAG: Final = REGISTRY.histogram("vcc_loop_lag_seconds", "how late the loop lag monitor woke up")
+
+class LoopMonitor:
+    """Notice when the event loop is blocked
+
+    A task on the loop updates a heartbeat every interval seconds. A thread checks it, and when it's
+    older than threshold seconds, it logs the stack of the loop thread, which is what is blocking it
+    """
+    def __init__(self, threshold: float, interval: float | None = None) -> None:
+        self.threshold = threshold
+        self.interval = threshold / 4 if interval is None else interval
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, args=(threading.get_ident(),), name="vcc-loop-monitor", daemon=True)
+        self._thread.start()
+
+    async def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+
+    async def _heartbeat(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG.record(max(0.0, now - expected) * 1e6)
+            self._beat = now
+
+    def _watch(self, loop_thread: int) -> None:
+        reported = 0.0
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat
+            # one report for every stall
+            if blocked < self.threshold or beat == reported:
+                continue
+            reported = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "unknown\n"
+            logging.warning(f"the event loop has been blocked for {blocked * 1000:.0f}ms so far, it's running:\n{stack}")
+
+@contextlib.asynccontextmanager
+async def monitor_loop(config: dict[str, Any]) -> AsyncIterator[LoopMonitor | None]:
+    """run a LoopMonitor inside it if loop_lag_ms is set"""
+    set_threshold(config)
+    ms = float(config.get("loop_lag_ms", 0))
+    if ms <= 0:
+        yield None
+        return
+    monitor = LoopMonitor(ms / 1000)
+    monitor.start()
+    try:
+        yield monitor
+    finally:
+        await monitor.stop()
+
+class Profiler:
+    """cProfile and tracemalloc for -prof"""
+    def __init__(self) -> None:
+        self.profile: cProfile.Profile | None = None
+        self.snapshot: tracemalloc.Snapshot | None = None
+        # of the last run which was stopped
+        self.last: cProfile.Profile | None = None
+        self.allocations: list[str] = []
+
+    @property
+    def running(self) -> bool:
+        return self.profile is not None
+
+    def start(self) -> None:
+        if self.profile is not None:
+            raise RuntimeError("the profiler is already running")
+        self.profile = cProfile.Profile()
+        tracemalloc.start()
+        self.snapshot = tracemalloc.take_snapshot()
+        self.profile.enable()
+
+    def stop(self) -> None:
+        if self.profile is None:
+            raise RuntimeError("the profiler isn't running")
+        self.profile.disable()
+        self.last = self.profile
+        self.allocations = self._allocations()
+        tracemalloc.stop()
+        self.profile = None
+
+    def _allocations(self, limit: int = 15) -> list[str]:
+        snapshot = tracemalloc.take_snapshot()
+        if self.snapshot is None:
+            return [str(i) for i in snapshot.statistics("lineno")[:limit]]
+        return [str(i) for i in snapshot.compare_to(self.snapshot, "lineno")[:limit]]
+
+    def dump(self, path: str | None = None, limit: int = 25) -> str:
+        """the slowest functions and the biggest allocations, the raw profile is saved to path"""
+        if self.profile is not None:
+            profile = self.profile
+            allocations = self._allocations()
+        elif self.last is not None:
+            profile = self.last
+            allocations = self.allocations
+        else:
+            raise RuntimeError("nothing was profiled")
+        if path is not None:
+            profile.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        if profile is self.profile:
+            # collecting the stats disables it
+            profile.enable()
+        return out.getvalue() + "allocations since start:\n" + "\n".join(allocations) + "\n"
+
+PROFILER: Final = Profiler()
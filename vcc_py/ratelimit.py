@@ -0,0 +1,151 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see
+# <https://www.gnu.org/licenses/>.
+
+# Token buckets for the send path. A frame which finds a bucket empty isn't rejected, it reserves the
+# next tokens and its sender sleeps until then, so a burst comes out at the rate of the bucket. In the
+# config file:
+#   rate_limit: 10/20                         (10 chat frames a second, bursts of 20)
+#   rate_limit_session: 2/5                   (chat frames of each session)
+#   rate_limit_types: MSG_SEND=5/10 REL_MSG=1/2
+# Control frames (login, user information, sessions...) are only limited by rate_limit_types, so a
+# burst of chat never holds them back.
+
+from __future__ import annotations
+
+from typing import Any
+import asyncio
+import logging
+import time
+
+from .constants import *
+
+class TokenBucket:
+    """rate tokens a second, at most burst of them are saved"""
+    __slots__ = ("rate", "burst", "tokens", "updated")
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, count: float = 1, now: float | None = None) -> float:
+        """how long count tokens would have to wait, without taking them"""
+        self._refill(time.monotonic() if now is None else now)
+        return max(0.0, (count - self.tokens) / self.rate)
+
+    def reserve(self, count: float = 1, now: float | None = None) -> float:
+        """take count tokens, return how long to wait before using them"""
+        delay = self.wait_time(count, now)
+        # may go below zero, the next callers wait for the tokens taken here
+        self.tokens -= count
+        return delay
+
+def parse_rate(text: str) -> tuple[float, float]:
+    """"rate/burst" or "rate", the burst is the rate if it's not given, raise ValueError if it's bad"""
+    rate_text, _, burst_text = text.partition("/")
+    try:
+        rate = float(rate_text)
+        burst = float(burst_text) if burst_text else max(1.0, rate)
+    except ValueError:
+        raise ValueError(f"bad rate \"{text}\", it should be like 10/20") from None
+    if not (rate > 0 and burst >= 1):
+        raise ValueError(f"bad rate \"{text}\", the rate must be positive and the burst at least 1")
+    return rate, burst
+
+class RateLimiter:
+    """A global bucket and a bucket for each session for chat frames, a bucket for some types, all optional
+
+    Give the same RateLimiter to several Connections to share the budgets
+    """
+    def __init__(
+        self,
+        total: tuple[float, float] | None = None,
+        session: tuple[float, float] | None = None,
+        types: dict[int, tuple[float, float]] | None = None,
+    ) -> None:
+        self.total = None if total is None else TokenBucket(*total)
+        self.session = session
+        self.sessions: dict[int, TokenBucket] = {}
+        self.types = {type: TokenBucket(*limit) for type, limit in (types or {}).items()}
+        self.waited = 0.0
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any]) -> RateLimiter | None:
+        """read rate_limit, rate_limit_session and rate_limit_types, None if none of them is set
+
+        Raise ValueError if one of them is bad
+        """
+        total = config.get("rate_limit")
+        session = config.get("rate_limit_session")
+        types_text = config.get("rate_limit_types")
+        if total is None and session is None and types_text is None:
+            return None
+        types: dict[int, tuple[float, float]] = {}
+        for item in str(types_text or "").split():
+            name, _, limit = item.partition("=")
+            try:
+                type = REQ[name.upper()]
+            except KeyError:
+                raise ValueError(f"unknown type \"{name}\" in rate_limit_types") from None
+            types[type] = parse_rate(limit)
+        return cls(
+            None if total is None else parse_rate(str(total)),
+            None if session is None else parse_rate(str(session)),
+            types,
+        )
+
+    @classmethod
+    def from_config_or_none(cls, config: dict[str, Any]) -> RateLimiter | None:
+        """from_config(), a bad setting is logged and turns the limits off"""
+        try:
+            return cls.from_config(config)
+        except ValueError as e:
+            logging.error(f"rate limiting is off: {e}")
+            return None
+
+    def _buckets(self, type: int, session: int) -> list[TokenBucket]:
+        buckets: list[TokenBucket] = []
+        bucket = self.types.get(type)
+        if bucket is not None:
+            buckets.append(bucket)
+        if type not in CHAT_TYPES:
+            return buckets
+        if self.total is not None:
+            buckets.append(self.total)
+        if self.session is not None:
+            bucket = self.sessions.get(session)
+            if bucket is None:
+                bucket = self.sessions[session] = TokenBucket(*self.session)
+            buckets.append(bucket)
+        return buckets
+
+    def wait_time(self, type: int = REQ.MSG_SEND, session: int = 0, count: int = 1) -> float:
+        """how long sending count frames now would wait"""
+        now = time.monotonic()
+        return max((i.wait_time(count, now) for i in self._buckets(type, session)), default=0.0)
+
+    def reserve(self, type: int, session: int, count: int = 1) -> float:
+        now = time.monotonic()
+        return max((i.reserve(count, now) for i in self._buckets(type, session)), default=0.0)
+
+    async def acquire(self, type: int, session: int, count: int = 1) -> None:
+        await self.sleep(self.reserve(type, session, count))
+
+    async def sleep(self, delay: float) -> None:
+        if delay > 0:
+            self.waited += delay
+            await asyncio.sleep(delay)
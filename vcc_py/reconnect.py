@@ -0,0 +1,162 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see
+# <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from collections import deque
+from types import TracebackType
+from typing import Any
+import asyncio
+import contextlib
+import logging
+import random
+
+from .constants import *
+from .codec import RequestView, RelayView, frame_size, is_request_frame, pack_request
+from .sock import Connection
+
+class ReconnectError(ConnectionError):
+    """The server is back but doesn't accept the login any more"""
+
+class ReconnectingConnection(Connection):
+    """A Connection which comes back by itself
+
+    When receiving or writing fails, recv_view() connects again with jittered exponential backoff,
+    logs in with the password given to login(), joins data.sess again and asks for the information
+    of myself like vcc does at startup. Frames sent while it's offline wait in an outbox of at most
+    max_outbox frames, the oldest are dropped, and they are sent in order once it's logged in.
+    Requests which were waiting for a response when it went offline fail with the error, and
+    ReconnectError is raised if the login is refused
+    """
+    def __init__(
+        self,
+        *args: Any,
+        min_delay: float = 0.5,
+        max_delay: float = 30.0,
+        max_outbox: int = 256,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.online = False
+        self.reconnects = 0
+        self.dropped = 0
+        self._outbox: deque[bytes | bytearray] = deque(maxlen=max_outbox)
+        self._password: str | None = None
+        self._closing = False
+
+    async def __aenter__(self) -> ReconnectingConnection:
+        await super().__aenter__()
+        self.online = True
+        return self
+
+    async def __aexit__(self, exc_type: type[BaseException] | None, exc_val: BaseException | None, exc_tb: TracebackType | None) -> None:
+        self._closing = True
+        if self._outbox:
+            logging.warning(f"{len(self._outbox)} messages are not sent")
+        with contextlib.suppress(OSError):
+            await super().__aexit__(exc_type, exc_val, exc_tb)
+
+    async def login(self, password: str) -> None:
+        await super().login(password)
+        self._password = password
+
+    def _write(self, data: bytes | bytearray, control: bool = False) -> asyncio.Future[None]:
+        if self.online:
+            return super()._write(data, control)
+        self._queue(data)
+        future: asyncio.Future[None] = asyncio.get_event_loop().create_future()
+        future.set_result(None)
+        return future
+
+    def _queue(self, data: bytes | bytearray) -> None:
+        # a write can hold many frames, the limit is on frames
+        start = 0
+        while start < len(data):
+            size = frame_size(data, start)
+            if size is None or start + size > len(data):
+                size = len(data) - start
+            if len(self._outbox) == self._outbox.maxlen:
+                self.dropped += 1
+                logging.warning(f"the outbox is full, {self.dropped} messages dropped")
+            self._outbox.append(data[start:start + size])
+            start += size
+
+    def _write_failed(self, data: bytearray) -> bool:
+        if self._closing or self._password is None:
+            return False
+        # the receive side may not notice for a while, the keepalive probes make it fail too
+        self.online = False
+        self._queue(data)
+        return True
+
+    async def recv_view(self) -> RequestView | RelayView:
+        while True:
+            try:
+                return await super().recv_view()
+            except (OSError, ValueError) as e:
+                if self._closing or self._password is None:
+                    raise
+                logging.warning(f"connection lost: {e!r}")
+                await self.reconnect()
+
+    def _close_socket(self) -> None:
+        with contextlib.suppress(OSError):
+            self._sock.close()
+
+    async def _login_again(self) -> RequestView | RelayView:
+        assert self._password is not None
+        await self._open()
+        # it's still offline, so write to the socket directly
+        await asyncio.get_event_loop().sock_sendall(self._sock, pack_request(
+            magic=VCC_MAGIC, type=REQ.CTL_LOGIN, uid=0, session=0, flags=0, usrname=self.data.usrname, msg=self._password
+        ))
+        return await super().recv_view()
+
+    async def reconnect(self) -> None:
+        """Connect and log in again, it only returns once it has succeeded"""
+        assert self._password is not None
+        self.online = False
+        self._close_socket()
+        attempt = 0
+        while True:
+            delay = min(self.max_delay, self.min_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+            attempt += 1
+            logging.warning(f"reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            try:
+                response = await asyncio.wait_for(self._login_again(), REQUEST_TIMEOUT)
+            except (OSError, ValueError, asyncio.TimeoutError) as e:
+                logging.warning(f"cannot reconnect: {e!r}")
+                self._close_socket()
+                continue
+            if response.type != REQ.CTL_LOGIN or not response.uid:
+                self._close_socket()
+                raise ReconnectError("login failed after reconnecting")
+            break
+        self.online = True
+        self.reconnects += 1
+        for lane in self._lanes:
+            lane.last = None
+        logging.warning("reconnected")
+        async with self.batch():
+            # the requests sent while offline expected their responses first, so they go first, and
+            # the chat ones still go after the join because the control lane is written first
+            while self._outbox:
+                frame = self._outbox.popleft()
+                self._write(frame, is_request_frame(frame) and RequestView(frame).type not in CHAT_TYPES)
+            if self.data.sess:
+                await self.send(type=REQ.CTL_JOINS, session=self.data.sess)
+            # tracked, a lookup which is waiting mustn't get this response
+            await self.send_tracked(type=REQ.CTL_UINFO, uid=0, msg=self.data.usrname)
@@ -0,0 +1,108 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see
+# <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from typing import Awaitable, Callable, Final
+import asyncio
+import time
+
+from .constants import *
+from .codec import RequestView, decode_str
+
+SESSION_TYPES: Final = frozenset({REQ.CTL_SESS, REQ.CTL_NEWSE, REQ.CTL_SENAME, REQ.CTL_JOINS, REQ.CTL_QUITS})
+
+class SessionDirectory:
+    """The sessions on the server, indexed by id and by name
+
+    Connection.recv_view() passes every session response to observe(), so the directory follows
+    whoever sent the request. An entry older than ttl seconds is checked with the server again
+    """
+    def __init__(self, ttl: float = 300.0) -> None:
+        self.ttl = ttl
+        self.by_id: dict[int, str] = {}
+        self.by_name: dict[str, int] = {}
+        self.joined: set[int] = set()
+        self._stamps: dict[int, float] = {}
+        self._refreshing: asyncio.Task[object] | None = None
+
+    def names(self) -> list[str]:
+        """the names in the order of their ids"""
+        return [self.by_id[i] for i in sorted(self.by_id)]
+
+    def set(self, sid: int, name: str, now: float | None = None) -> None:
+        old = self.by_id.get(sid)
+        if old is not None and self.by_name.get(old) == sid:
+            del self.by_name[old]
+        self.by_id[sid] = name
+        self.by_name[name] = sid
+        self._stamps[sid] = time.monotonic() if now is None else now
+
+    def forget(self, sid: int) -> None:
+        name = self.by_id.pop(sid, None)
+        if name is not None and self.by_name.get(name) == sid:
+            del self.by_name[name]
+        self._stamps.pop(sid, None)
+
+    def replace(self, count: int, raw: bytes) -> None:
+        """replace everything with a CTL_SESS listing, session i + 1 is in slot i"""
+        now = time.monotonic()
+        self.by_id.clear()
+        self.by_name.clear()
+        self._stamps.clear()
+        view = memoryview(raw)
+        for i in range(min(count, len(raw) // USERNAME_SIZE)):
+            self.set(i + 1, decode_str(view[i * USERNAME_SIZE:(i + 1) * USERNAME_SIZE]), now)
+
+    def observe(self, view: RequestView) -> None:
+        match view.type:
+            case REQ.CTL_SESS:
+                self.replace(view.uid, view.raw_msg)
+            case REQ.CTL_NEWSE:
+                if view.session != -1:
+                    self.set(view.session, view.msg)
+                    self.joined.add(view.session)
+            case REQ.CTL_SENAME:
+                if view.session != -1:
+                    self.set(view.session, view.msg)
+            case REQ.CTL_JOINS:
+                if view.uid:
+                    self.joined.discard(view.session)
+                    self.forget(view.session)
+                else:
+                    self.joined.add(view.session)
+            case REQ.CTL_QUITS:
+                self.joined.discard(view.session)
+
+    def fresh(self, sid: int) -> bool:
+        stamp = self._stamps.get(sid)
+        return stamp is not None and time.monotonic() - stamp < self.ttl
+
+    async def refresh(self, request: Callable[[], Awaitable[object]]) -> None:
+        """list the sessions again, concurrent callers wait for the same request"""
+        if self._refreshing is None:
+            async def run() -> object:
+                try:
+                    return await request()
+                finally:
+                    self._refreshing = None
+            self._refreshing = asyncio.create_task(run())
+        await asyncio.shield(self._refreshing)
+
+    async def id_of(self, name: str, request: Callable[[], Awaitable[object]]) -> int | None:
+        """the id of a session, request lists the sessions when the name is unknown or too old"""
+        sid = self.by_name.get(name)
+        if sid is not None and self.fresh(sid):
+            return sid
+        await self.refresh(request)
+        return self.by_name.get(name)
@@ -13,19 +13,35 @@
 from __future__ import annotations
 
 from types import TracebackType
-from typing import TYPE_CHECKING, Any, cast, overload
+from typing import TYPE_CHECKING, AsyncIterator, Final, Iterable, cast, overload
 import asyncio
+import collections
+import contextlib
 import logging
-import struct
 import socket
 import ipaddress
+import time
 
 from .constants import *
+from .codec import RELAY_HEADER_STRUCT, frame_size, RequestView, RelayView, decode_frame, pack_request, pack_request_into, pack_relay
+from .sessions import SESSION_TYPES, SessionDirectory
+from .users import USER_TYPES, UserCache
+from .ratelimit import RateLimiter
+from .metrics import REGISTRY, Registry
+from .wiretrace import WireTrace, RECV, SEND
 
 # Can't import it directly, that will cause a circular import
 if TYPE_CHECKING:
     from .plugin import Plugins
 
+def resolve(host: str) -> str:
+    """get the ip of a host, raise socket.gaierror if it can't be resolved"""
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return socket.gethostbyname(host)
+    return host
+
 def bad_bytes(string: bytes) -> str:
     return string.decode(errors="ignore")
 
@@ -35,15 +51,119 @@ def bad_ntohl(value: int) -> int:
     except OverflowError:
         return -1
 
+RELAY_HEADER_SIZE: Final = RELAY_HEADER_STRUCT.size
+
+# responses which update the caches in MyData
+OBSERVED_TYPES: Final = SESSION_TYPES | USER_TYPES
+
+FRAMES_SENT: Final = REGISTRY.counter("vcc_frames_sent_total", "frames queued for sending")
+BYTES_SENT: Final = REGISTRY.counter("vcc_bytes_sent_total", "bytes written to the server")
+WRITE_WAIT: Final = REGISTRY.histogram("vcc_write_wait_seconds", "time from queueing a write to starting it")
+FRAMES_RECEIVED: Final = REGISTRY.counter("vcc_frames_received_total", "frames received")
+BYTES_RECEIVED: Final = REGISTRY.counter("vcc_bytes_received_total", "bytes of the frames received")
+DECODE_TIME: Final = REGISTRY.histogram("vcc_decode_seconds", "time to decode a frame and update the caches")
+
+# seconds, a dead connection which is idle fails after about KEEPALIVE_IDLE + KEEPALIVE_INTERVAL * KEEPALIVE_COUNT
+KEEPALIVE_IDLE: Final = 30
+KEEPALIVE_INTERVAL: Final = 10
+KEEPALIVE_COUNT: Final = 3
+
+def _enable_keepalive(sock: socket.socket) -> None:
+    """a reader waiting on a connection which died quietly gets an error instead of waiting forever"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    # not every platform has them
+    for name, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL), ("TCP_KEEPCNT", KEEPALIVE_COUNT)):
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+class Lane:
+    """Frames waiting for the flush task, see Connection._write"""
+    __slots__ = ("buf", "waiter", "last", "since")
+    def __init__(self) -> None:
+        self.buf = bytearray()
+        # done when buf is written, and the same for the last buf
+        self.waiter: asyncio.Future[None] | None = None
+        self.last: asyncio.Future[None] | None = None
+        # when the first byte in buf was queued
+        self.since = 0.0
+
+class FrameReader:
+    """Read whole frames from a non-blocking socket
+
+    Data is received in large chunks into one reusable buffer, so several frames that arrive
+    together only cost one syscall, and a frame split across segments is never cut in the middle
+    """
+    def __init__(self, sock: socket.socket, bufsize: int = 65536) -> None:
+        self._sock = sock
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def _frame_size(self) -> int | None:
+        return frame_size(self._buf, self._start, self._end)
+
+    def next_frame(self) -> bytes | None:
+        """Cut a frame out of the buffer without touching the socket"""
+        size = self._frame_size()
+        if size is None or self._end - self._start < size:
+            return None
+        frame = bytes(self._view[self._start:self._start + size])
+        self._start += size
+        if self._start == self._end:
+            self._start = self._end = 0
+        return frame
+
+    def _make_room(self) -> None:
+        size = self._frame_size() or RELAY_HEADER_SIZE
+        if self._start and len(self._buf) - self._start < size:
+            # move the incomplete frame to the front, the view must go before resizing
+            self._view.release()
+            del self._buf[:self._start]
+            self._buf.extend(bytes(self._start))
+            self._start, self._end = 0, self._end - self._start
+            self._view = memoryview(self._buf)
+        if len(self._buf) - self._start < size:
+            self._view.release()
+            self._buf.extend(bytes(size - len(self._buf) + self._start))
+            self._view = memoryview(self._buf)
+
+    async def read_frame(self) -> bytes:
+        loop = asyncio.get_event_loop()
+        while (frame := self.next_frame()) is None:
+            if self._end == len(self._buf):
+                self._make_room()
+            received = await loop.sock_recv_into(self._sock, self._view[self._end:])
+            if not received:
+                raise ConnectionResetError("connection closed by the server")
+            self._end += received
+        return frame
+
 class Connection:
     """A wrapper of socket which can recv or send messages and it's most method is asynchronous"""
     # plugs: Plugins
-    def __init__(self, ip: str=VCC_DEFAULT_IP, port: int=VCC_PORT, usrname: str="", sess: int=0, mode: Mode=Mode.NORMAL) -> None:
+    def __init__(self, ip: str=VCC_DEFAULT_IP, port: int=VCC_PORT, usrname: str="", sess: int=0, mode: Mode=Mode.NORMAL, max_queued: int=262144, limiter: RateLimiter | None=None) -> None:
         ip_address = ipaddress.ip_address(ip)
         self.version = ip_address.version
         self.ip = ip
         self.port = port
-        self._waiting_for_recv = False
+        self._next_frame_waiters: list[asyncio.Future[RequestView | RelayView]] = []
+        # control requests, then chat, senders of chat wait when max_queued bytes are waiting
+        self._lanes = (Lane(), Lane())
+        self.max_queued = max_queued
+        # can be shared by several connections
+        self.limiter = limiter
+        self.tracer: WireTrace | None = None
+        # set by a receive loop which calls dispatched() once it has handled a frame
+        self.dispatching = False
+        self._room = asyncio.Event()
+        self.writes = 0
+        self.write_wait_total = 0.0
+        self.write_wait_max = 0.0
+        self.blocked = 0
+        self._flush_task: asyncio.Task[None] | None = None
+        self._batching = 0
+        self._pending: collections.defaultdict[int, collections.deque[asyncio.Future[RequestView | RelayView]]] = collections.defaultdict(collections.deque)
         self.data = MyData(
             plugs = cast("Plugins", None),
             usrname = usrname,
@@ -51,10 +171,16 @@ class Connection:
             sess_list = [],
             level = 0,
             type = False,
-            mode = mode
+            mode = mode,
+            sessions = SessionDirectory(),
+            users = UserCache(),
         )
     
     async def __aenter__(self) -> Connection:
+        await self._open()
+        return self
+
+    async def _open(self) -> None:
         loop = asyncio.get_event_loop()
         if self.version == 4:
             self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -66,14 +192,144 @@ class Connection:
             self._sock.setblocking(False)
             self._sock.bind(("::", 0))
             await loop.sock_connect(self._sock, (self.ip, self.port, 0, 0))
-
-        return self
+        _enable_keepalive(self._sock)
+        self._reader = FrameReader(self._sock)
 
     async def __aexit__(self, exc_type: type[BaseException] | None, exc_val: BaseException | None, exc_tb: TracebackType | None) -> None:
+        with contextlib.suppress(OSError):
+            await self.flush()
         self._sock.shutdown(socket.SHUT_RDWR)
         self._sock.close()
 
     
+    async def login(self, password: str) -> None:
+        """Log in as data.usrname, raise an exception if it fails"""
+        await self.send(
+            type=REQ.CTL_LOGIN,
+            usrname=self.data.usrname,
+            msg=password
+        )
+        logging.debug("send the login request")
+        response = await self.recv_view()
+        logging.debug("recv the login response")
+        if response.type != REQ.CTL_LOGIN:
+            raise Exception("Invalid response received")
+        if not response.uid:
+            raise Exception("login failed: wrong password or user doesn't exists")
+        logging.debug("login successfully")
+
+    def _write(self, data: bytes | bytearray, control: bool = False) -> asyncio.Future[None]:
+        """Buffer data and get a future which is done once it is written
+
+        Everything written to a lane before the loop gets back to the flush task goes out in one
+        syscall, the control lane is always written first
+        """
+        loop = asyncio.get_event_loop()
+        lane = self._lanes[0 if control else 1]
+        if not lane.buf:
+            lane.since = loop.time()
+        lane.buf += data
+        if lane.waiter is None:
+            lane.waiter = lane.last = loop.create_future()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_loop())
+        return lane.waiter
+
+    async def _flush_loop(self) -> None:
+        loop = asyncio.get_event_loop()
+        control, chat = self._lanes
+        while True:
+            lane = control if control.buf else chat
+            if not lane.buf:
+                return
+            data, lane.buf = lane.buf, bytearray()
+            waiter, lane.waiter = lane.waiter, None
+            wait = loop.time() - lane.since
+            self.writes += 1
+            self.write_wait_total += wait
+            if wait > self.write_wait_max:
+                self.write_wait_max = wait
+            WRITE_WAIT.record(wait * 1e6)
+            if self.tracer is not None:
+                # before, the data may be partly written when it fails
+                self.tracer.record(SEND, data)
+            try:
+                await loop.sock_sendall(self._sock, data)
+            except BaseException as e:
+                if self.tracer is not None:
+                    self.tracer.record_failure(e)
+                waiters = [waiter, control.waiter, chat.waiter]
+                handled = isinstance(e, OSError) and self._write_failed(data + control.buf + chat.buf)
+                for i in self._lanes:
+                    i.buf.clear()
+                    i.waiter = None
+                for future in waiters:
+                    if future is not None and not future.done():
+                        if handled:
+                            future.set_result(None)
+                        elif isinstance(e, asyncio.CancelledError):
+                            future.cancel()
+                        else:
+                            future.set_exception(e)
+                self._room.set()
+                if not isinstance(e, Exception):
+                    # the cancellation of the flush task, or KeyboardInterrupt
+                    raise
+                return
+            BYTES_SENT.inc(len(data))
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+            if lane is chat:
+                self._room.set()
+
+    def _write_failed(self, data: bytearray) -> bool:
+        """Called with the data which couldn't be written, return True if it's taken care of"""
+        return False
+
+    async def _wait_for_room(self, size: int) -> None:
+        """Wait until the chat lane has room for size bytes, a frame always fits an empty lane"""
+        chat = self._lanes[1]
+        while chat.buf and len(chat.buf) + size > self.max_queued:
+            self.blocked += 1
+            self._room.clear()
+            await self._room.wait()
+
+    def queue_stats(self) -> dict[str, float]:
+        """Bytes waiting in each lane and how long writes have waited, in seconds"""
+        return {
+            "control_bytes": len(self._lanes[0].buf),
+            "chat_bytes": len(self._lanes[1].buf),
+            "writes": self.writes,
+            "wait_avg": self.write_wait_total / self.writes if self.writes else 0.0,
+            "wait_max": self.write_wait_max,
+            "blocked": self.blocked,
+        }
+
+    def register_metrics(self, registry: Registry = REGISTRY) -> None:
+        """export the state of this connection as gauges, for the main connection of a process"""
+        control, chat = self._lanes
+        registry.gauge("vcc_queued_bytes", "bytes waiting to be written", lambda: len(control.buf), lane="control")
+        registry.gauge("vcc_queued_bytes", "bytes waiting to be written", lambda: len(chat.buf), lane="chat")
+        registry.gauge("vcc_blocked_sends", "times a sender waited for room in the queue", lambda: self.blocked)
+        registry.gauge("vcc_pending_requests", "requests waiting for a response", lambda: sum(len(i) for i in self._pending.values()))
+
+    async def flush(self) -> None:
+        """Wait until everything buffered is written"""
+        for lane in self._lanes:
+            # cancelled with the flush task, it will never be written
+            if lane.last is not None and not lane.last.cancelled():
+                await lane.last
+
+    @contextlib.asynccontextmanager
+    async def batch(self) -> AsyncIterator[None]:
+        """Sends inside it don't wait for the write, so they are coalesced, it's flushed on exit"""
+        self._batching += 1
+        try:
+            yield
+        finally:
+            self._batching -= 1
+        await self.flush()
+
     async def send(
         self, *, 
         magic: int = VCC_MAGIC, 
@@ -84,47 +340,72 @@ class Connection:
         usrname: str | None = None, 
         msg: str | bytes = "",
     ) -> None:
-        loop = asyncio.get_event_loop()
-
         if session is None:
             session = self.data.sess
 
         if usrname is None:
             usrname = self.data.usrname
-        logging.debug(f"msgic: {magic}, type: {type}, uid: {uid}, session: {session}, flags: {flags}, usrname: {usrname}, msg: {msg!r}")
-        if isinstance(msg, str):
-            msg += "\0"
-            msg = msg.encode()
-        await loop.sock_sendall(self._sock, struct.pack(
-            VCC_REQUEST_FORMAT,
-            socket.htonl(magic), 
-            socket.htonl(type),
-            socket.htonl(uid),
-            socket.htonl(session),
-            flags,
-            (usrname + "\0").encode(),
-            msg
-        ))
+        logging.debug("magic: %d, type: %d, uid: %d, session: %d, flags: %d, usrname: %s, msg: %r", magic, type, uid, session, flags, usrname, msg)
+        frame = pack_request(
+            magic=magic,
+            type=type,
+            uid=uid,
+            session=session,
+            flags=flags,
+            usrname=usrname,
+            msg=msg
+        )
+        if self.limiter is not None:
+            await self.limiter.acquire(type, session)
+        FRAMES_SENT.inc()
+        control = type not in CHAT_TYPES
+        if not control:
+            await self._wait_for_room(len(frame))
+        waiter = self._write(frame, control)
+        if not self._batching:
+            await waiter
+
+    async def send_many(self, reqs: Iterable[Request]) -> None:
+        """Send many requests with one write"""
+        reqs = list(reqs)
+        buf = bytearray(REQ_SIZE * len(reqs))
+        for i, req in enumerate(reqs):
+            pack_request_into(
+                buf, i * REQ_SIZE,
+                magic=req.magic,
+                type=req.type,
+                uid=req.uid,
+                session=req.session,
+                flags=req.flags,
+                usrname=req.usrname,
+                msg=req.msg
+            )
+        logging.debug("send %d requests in a batch", len(reqs))
+        if self.limiter is not None:
+            limiter = self.limiter
+            delays = [limiter.reserve(req.type, req.session) for req in reqs]
+            await limiter.sleep(max(delays, default=0.0))
+        FRAMES_SENT.inc(len(reqs))
+        control = all(req.type not in CHAT_TYPES for req in reqs)
+        if not control:
+            await self._wait_for_room(len(buf))
+        waiter = self._write(buf, control)
+        if not self._batching:
+            await waiter
 
     async def send_relay(self, *, magic: int = VCC_MAGIC_RL, uid: int = 0, session: int | None = None, usrname: str | None = None, msg: str, visible: str) -> None:
-        loop = asyncio.get_event_loop()
         session = self.data.sess if session is None else session
         usrname = self.data.usrname if usrname is None else usrname
-        length = struct.calcsize(VCC_RELAY_HEADER_FORMAT) + len(msg.encode()) + 1
+        buf = pack_relay(magic=magic, type=REQ.REL_MSG, uid=uid, session=session, usrname=usrname, visible=visible, msg=msg)
     
-        logging.debug(f"msgic: {magic}, uid: {uid}, session: {session}, length: {length}, usrname: {usrname}, msg: {msg}, visible: {visible}")
-        await loop.sock_sendall(self._sock, struct.pack(
-            VCC_RELAY_HEADER_FORMAT, 
-            socket.htonl(magic), 
-            socket.htonl(REQ.REL_MSG), 
-            socket.htonl(length),
-            socket.htonl(uid),
-            socket.htonl(session), 
-            usrname.encode() + b"\0",
-            visible.encode() + b"\0"
-        ))
-
-        await loop.sock_sendall(self._sock, msg.encode() + b"\0")
+        logging.debug("magic: %d, uid: %d, session: %d, length: %d, usrname: %s, msg: %s, visible: %s", magic, uid, session, len(buf), usrname, msg, visible)
+        if self.limiter is not None:
+            await self.limiter.acquire(REQ.REL_MSG, session)
+        FRAMES_SENT.inc()
+        await self._wait_for_room(len(buf))
+        waiter = self._write(buf)
+        if not self._batching:
+            await waiter
 
     @classmethod
     @overload
@@ -141,36 +422,126 @@ class Connection:
         else:
             return content.decode(errors="ignore").split("\x00")[0]
 
-    async def recv(self) -> tuple[RawRequest, Request] | tuple[RawRelay, Relay]:
-        loop = asyncio.get_event_loop()
+    async def recv_view(self) -> RequestView | RelayView:
+        """Receive a frame without decoding it, fields are decoded when they are accessed"""
+        try:
+            frame = await self._reader.read_frame()
+        except (OSError, ValueError) as e:
+            self._fail_pending(e)
+            raise
+        if self.tracer is not None:
+            self.tracer.record(RECV, frame)
+        start = time.perf_counter()
+        view = decode_frame(frame)
+        if isinstance(view, RequestView) and view.type in OBSERVED_TYPES:
+            if view.type in SESSION_TYPES:
+                self.data.sessions.observe(view)
+            else:
+                self.data.users.observe(view)
+        DECODE_TIME.record((time.perf_counter() - start) * 1e6)
+        FRAMES_RECEIVED.inc()
+        BYTES_RECEIVED.inc(len(frame))
+        if not self.dispatching:
+            self._resolve(view)
+        return view
+
+    def dispatched(self, view: RequestView | RelayView) -> None:
+        """Give a frame to the requests waiting for it, after the hooks and the handlers have run"""
+        self._resolve(view)
+
+    def expect(self, type: int) -> asyncio.Future[RequestView | RelayView]:
+        """Get a future which will be resolved with the next response of the type
+
+        Call it before sending the request, responses of the same type are matched in FIFO order
+        """
+        future: asyncio.Future[RequestView | RelayView] = asyncio.get_event_loop().create_future()
+        self._pending[type].append(future)
+        return future
+
+    async def request(
+        self, *,
+        type: int,
+        uid: int = 0,
+        session: int | None = None,
+        usrname: str | None = None,
+        msg: str | bytes = "",
+        timeout: float | None = REQUEST_TIMEOUT,
+    ) -> RequestView | RelayView:
+        """Send a control request and wait for its response, raise asyncio.TimeoutError if it doesn't come"""
+        future = self.expect(type)
+        try:
+            await self.send(type=type, uid=uid, session=session, usrname=usrname, msg=msg)
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            if not future.done():
+                future.cancel()
+            queue = self._pending.get(type)
+            if queue is not None and future in queue:
+                queue.remove(future)
+                if not queue:
+                    del self._pending[type]
 
-        raw_recv_data = await loop.sock_recv(self._sock, struct.calcsize(VCC_RELAY_HEADER_FORMAT))
-        relay_header_data = RawRelayHeader(*struct.unpack(VCC_RELAY_HEADER_FORMAT, raw_recv_data))
+    async def send_tracked(
+        self, *,
+        type: int,
+        uid: int = 0,
+        session: int | None = None,
+        usrname: str | None = None,
+        msg: str | bytes = "",
+    ) -> asyncio.Future[RequestView | RelayView]:
+        """Send a control request without waiting for its response
+
+        The response still takes its place in the FIFO matching, so it can't be taken for the
+        response of a request() of the same type sent later
+        """
+        future = self.expect(type)
+        # nobody may wait for it, don't complain about an exception which isn't retrieved
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        await self.send(type=type, uid=uid, session=session, usrname=usrname, msg=msg)
+        return future
+
+    def _resolve(self, view: RequestView | RelayView) -> None:
+        waiters, self._next_frame_waiters = self._next_frame_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(view)
+        if not self._pending:
+            return
+        type = view.type
+        queue = self._pending.get(type)
+        while queue:
+            future = queue.popleft()
+            if not future.done():
+                future.set_result(view)
+                break
+        if queue is not None and not queue:
+            del self._pending[type]
 
-        if socket.ntohl(relay_header_data.magic) != VCC_MAGIC:
+    def _fail_pending(self, exc: BaseException) -> None:
+        futures = self._next_frame_waiters + [future for queue in self._pending.values() for future in queue]
+        self._next_frame_waiters = []
+        self._pending.clear()
+        for future in futures:
+            if not future.done():
+                future.set_exception(exc)
+
+    async def recv(self) -> tuple[RawRequest, Request] | tuple[RawRelay, Relay]:
+        view = await self.recv_view()
+        if isinstance(view, RelayView):
             # handle a relay response
-            logging.debug(f"raw relay header content: {repr(relay_header_data)}")
-            size = bad_ntohl(relay_header_data.size) - struct.calcsize(VCC_RELAY_HEADER_FORMAT)
-            logging.debug(f"{size}")
-            raw_recv_data += await loop.sock_recv(self._sock, size)
-            self._waiting_for_recv = False
-            raw_relay_data = RawRelay(*struct.unpack(VCC_RELAY_HEADER_FORMAT + f"{size}s", raw_recv_data))
-            relay_tuple_data = Relay(**{key: cast(Any, self.to_normal(value)) for key, value in raw_relay_data._asdict().items()})
-            logging.debug(f"raw relay content: {repr(raw_relay_data)}")
-            logging.debug(f"relay content: {repr(relay_tuple_data)}")
+            raw_relay_data, relay_tuple_data = view.to_raw(), view.to_tuple()
+            logging.debug("raw relay content: %r", raw_relay_data)
+            logging.debug("relay content: %r", relay_tuple_data)
             return raw_relay_data, relay_tuple_data
-        
+
         # handle a normal response
-        raw_recv_data += await loop.sock_recv(self._sock, REQ_SIZE - struct.calcsize(VCC_RELAY_HEADER_FORMAT))
-        tuple_data = struct.unpack(VCC_REQUEST_FORMAT, raw_recv_data)
-        self._waiting_for_recv = False
-        raw_request = RawRequest(*tuple_data)
-        request = Request(**{key: cast(Any, self.to_normal(value) if key != "flags" else value) for key, value in raw_request._asdict().items()})
-        logging.debug(f"raw request content: {repr(raw_request)}")
-        logging.debug(f"request content: {repr(request)}")
+        raw_request, request = view.to_raw(), view.to_tuple()
+        logging.debug("raw request content: %r", raw_request)
+        logging.debug("request content: %r", request)
         return raw_request, request
     
     async def wait_until_recv(self) -> None:
-        self._waiting_for_recv = True
-        while self._waiting_for_recv:
-            await asyncio.sleep(0.1)
+        """Wait until the next frame is received, use request() to wait for a certain response"""
+        future: asyncio.Future[RequestView | RelayView] = asyncio.get_event_loop().create_future()
+        self._next_frame_waiters.append(future)
+        await future
@@ -0,0 +1,130 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see
+# <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Final, Iterable, NamedTuple
+import asyncio
+import logging
+import struct
+import time
+
+from .constants import *
+from .codec import RequestView, decode_str
+
+if TYPE_CHECKING:
+    from .sock import Connection
+
+USER_TYPES: Final = frozenset({REQ.CTL_UINFO, REQ.SYS_SCRINC})
+
+# score and level are in network byte order
+USER_STRUCT: Final = struct.Struct(f"!ii{USERNAME_SIZE}s")
+
+class UserInfo(NamedTuple):
+    usrname: str
+    score: int
+    level: int
+
+def parse_user(uid: int, msg: bytes) -> UserInfo | None:
+    """the user in a CTL_UINFO response, None if the user isn't found"""
+    if uid == -1:
+        return None
+    score, level, usrname = USER_STRUCT.unpack_from(msg)
+    if score < 0 or level < 0:
+        return None
+    return UserInfo(decode_str(usrname), score, level)
+
+class UserCache:
+    """User information by username, at most size users for ttl seconds
+
+    The least recently used user is evicted first, users who don't exist are cached too.
+    Connection.recv_view() passes every CTL_UINFO and SYS_SCRINC response to observe(), a score
+    change empties the cache because the response doesn't say whose score has changed
+    """
+    def __init__(self, ttl: float = 60.0, size: int = 1024) -> None:
+        self.ttl = ttl
+        self.size = size
+        self._users: OrderedDict[str, tuple[UserInfo | None, float]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task[UserInfo | None]] = {}
+
+    def get(self, usrname: str) -> tuple[bool, UserInfo | None]:
+        """(whether it's cached, the user)"""
+        entry = self._users.get(usrname)
+        if entry is None:
+            return False, None
+        if time.monotonic() - entry[1] >= self.ttl:
+            del self._users[usrname]
+            return False, None
+        self._users.move_to_end(usrname)
+        return True, entry[0]
+
+    def put(self, usrname: str, info: UserInfo | None) -> None:
+        self._users[usrname] = (info, time.monotonic())
+        self._users.move_to_end(usrname)
+        if len(self._users) > self.size:
+            self._users.popitem(last=False)
+
+    def invalidate(self, usrname: str | None = None) -> None:
+        if usrname is None:
+            self._users.clear()
+        else:
+            self._users.pop(usrname, None)
+
+    def observe(self, view: RequestView) -> None:
+        if view.type == REQ.SYS_SCRINC:
+            if not view.uid:
+                self.invalidate()
+            return
+        info = parse_user(view.uid, view.raw_msg)
+        if info is not None:
+            self.put(info.usrname, info)
+
+    async def lookup(self, conn: Connection, usrname: str) -> UserInfo | None:
+        """the information of a user, concurrent lookups of a user share one request"""
+        return await self._start(conn, usrname)
+
+    def _start(self, conn: Connection, usrname: str) -> asyncio.Future[UserInfo | None]:
+        cached, info = self.get(usrname)
+        if cached:
+            future: asyncio.Future[UserInfo | None] = asyncio.get_event_loop().create_future()
+            future.set_result(info)
+            return future
+        task = self._inflight.get(usrname)
+        if task is None:
+            task = self._inflight[usrname] = asyncio.create_task(self._fetch(conn, usrname))
+        # a cancelled lookup mustn't cancel the others
+        return asyncio.shield(task)
+
+    async def _fetch(self, conn: Connection, usrname: str, attempts: int = 3) -> UserInfo | None:
+        try:
+            for _ in range(attempts):
+                view = await conn.request(type=REQ.CTL_UINFO, uid=0, msg=usrname)
+                info = parse_user(view.uid, view.raw_msg)
+                if info is None or info.usrname == usrname:
+                    self.put(usrname, info)
+                    return info
+                # the response of a request which someone sent with send()
+                logging.debug("got the information of %s while looking up %s", info.usrname, usrname)
+            raise LookupError(f"no response about {usrname}")
+        finally:
+            del self._inflight[usrname]
+
+    async def lookup_many(self, conn: Connection, usrnames: Iterable[str]) -> dict[str, UserInfo | None]:
+        """look up many users, the requests which are needed are sent in one write"""
+        names = list(dict.fromkeys(usrnames))
+        async with conn.batch():
+            futures = [self._start(conn, i) for i in names]
+            # let every request be buffered before the batch is flushed
+            await asyncio.sleep(0)
+        return dict(zip(names, await asyncio.gather(*futures)))
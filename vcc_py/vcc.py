@@ -13,25 +13,32 @@
 # <https://www.gnu.org/licenses/>. 
 
 import asyncio
+import contextlib
 import sys
 from getpass import getpass
 import argparse
 import logging
 import os.path
 import signal
-import ipaddress
 import socket
 from types import FrameType
-from typing import Callable
+from typing import AsyncIterator, Callable
 
 from prompt_toolkit import PromptSession
 from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
 
-from .sock import Connection
+from .sock import Connection, resolve
+from .reconnect import ReconnectingConnection
+from .codec import RelayView
 from .constants import *
 from .commands import do_cmd
 from .bh import do_bh
 from .plugin import Plugins
+from .history import History
+from .ratelimit import RateLimiter
+from .metrics import exporters
+from .profiling import monitor_loop
+from .wiretrace import trace_connection
 from . import pretty
 
 def parse_args() -> argparse.Namespace:
@@ -44,42 +51,54 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(dest="ip", metavar="ip", nargs="?", default=VCC_DEFAULT_IP, help="the ip address of the server")
     return parser.parse_args()
 
-async def recv_loop(conn: Connection, plugs: Plugins) -> None:
+async def recv_loop(conn: Connection, plugs: Plugins, renderer: pretty.Renderer) -> None:
+    history = conn.data.history
+    conn.dispatching = True
     try:
         while True:
-            req_raw, req = await conn.recv()
-            if isinstance(req_raw, RawRelay) and isinstance(req, Relay):
-                flag = MSG_NEW_RELAY
-                if req.uid:
-                    flag |= MSG_NEW_ONLY_VISIBLE
-                if conn.data.mode == Mode.ROBOT:
-                    continue
-                try:
-                    do_bh(req, req_raw, conn.data)
-                except Exception:
-                    pretty.show_msg(req.usrname, req.msg, req.session, newlinefirst=True, flag=flag)
-            else:
-                assert isinstance(req_raw, RawRequest) and isinstance(req, Request)
-                _req = plugs.recv_msg(req)
-                if _req is None:
-                    continue
-                req = _req
-                if conn.data.mode == Mode.ROBOT:
-                    continue
-                if req.type == REQ.MSG_NEW:
-                    pretty.show_msg(req.usrname, req.msg, req.session, newlinefirst=True)
+            view = await conn.recv_view()
+            try:
+                if isinstance(view, RelayView):
+                    if conn.data.mode == Mode.ROBOT:
+                        continue
+                    req_raw, req = view.to_raw(), view.to_tuple()
+                    flag = MSG_NEW_RELAY
+                    if req.uid:
+                        flag |= MSG_NEW_ONLY_VISIBLE
+                    if req.type == REQ.CTL_USRS:
+                        # do_bh prints it, after the messages which are waiting
+                        await renderer.drain()
+                    try:
+                        do_bh(req, req_raw, conn.data)
+                    except Exception:
+                        renderer.show_msg(req.usrname, req.msg, req.session, flag=flag)
+                        if history is not None:
+                            history.add(req.usrname, req.msg, req.session, flag)
                 else:
-                    do_bh(req, req_raw, conn.data)
+                    _req = await plugs.recv_msg(view)
+                    if _req is None:
+                        continue
+                    if conn.data.mode == Mode.ROBOT:
+                        continue
+                    if _req.type == REQ.MSG_NEW:
+                        renderer.show_msg(_req.usrname, _req.msg, _req.session)
+                        if history is not None:
+                            history.add(_req.usrname, _req.msg, _req.session)
+                    else:
+                        await renderer.drain()
+                        do_bh(_req if isinstance(_req, Request) else _req.to_tuple(), view.to_raw(), conn.data)
+            finally:
+                # commands waiting for the response see it handled
+                conn.dispatched(view)
     except asyncio.CancelledError:
         return
+    except OSError as e:
+        logging.error(f"disconnected: {e}")
 
-async def input_send_loop(conn: Connection, plugs: Plugins, quit_func: Callable[[], bool]) -> None:
+async def input_send_loop(conn: Connection, plugs: Plugins, renderer: pretty.Renderer, quit_func: Callable[[], bool]) -> None:
     session: PromptSession[str] = PromptSession()
     try:
         while True:
-            if conn.data.mode == Mode.ROBOT:
-                await asyncio.sleep(1)
-                continue
             pretty.prompt(curr_usrname, conn.data.sess, conn.data.level)
             try:
                 msg = await session.prompt_async("", auto_suggest=AutoSuggestFromHistory())
@@ -88,13 +107,14 @@ async def input_send_loop(conn: Connection, plugs: Plugins, quit_func: Callable[
             except EOFError:
                 quit_func()
                 return
-            _msg = plugs.send_msg(msg)
+            _msg = await plugs.send_msg(msg)
             if _msg is None:
                 continue
             msg = _msg
             if not msg:
                 continue
             if msg[0] == "-":
+                await renderer.drain()
                 try:
                     await do_cmd(msg, conn)
                 except ExitError:
@@ -106,7 +126,9 @@ async def input_send_loop(conn: Connection, plugs: Plugins, quit_func: Callable[
                 usrname=curr_usrname,
                 msg=msg
             )
-            pretty.show_msg(curr_usrname, msg, conn.data.sess)
+            renderer.show_msg(curr_usrname, msg, conn.data.sess)
+            if conn.data.history is not None:
+                conn.data.history.add(curr_usrname, msg, conn.data.sess, outgoing=True)
     except asyncio.CancelledError:
         return
 
@@ -133,6 +155,15 @@ def get_username_and_password_or_session() -> tuple[str, str]:
         return curr_usrname, password
         
 
+@contextlib.asynccontextmanager
+async def open_history(path: str | None) -> AsyncIterator[History | None]:
+    """the history in path, an empty path disables it"""
+    if not path:
+        yield None
+        return
+    async with History(os.path.expanduser(path)) as history:
+        yield history
+
 async def main() -> None:
     global args
     global curr_usrname
@@ -146,49 +177,44 @@ async def main() -> None:
         logging.error("stdout, stderr or stdin is redirected. ")
         sys.exit(1)
 
-    ip: str
     try:
-        ipaddress.ip_address(args.ip)
-    except ValueError:
-        try:
-            ip = socket.gethostbyname(args.ip)
-        except socket.gaierror:
-            logging.error("not a valid ip or host. ")
-            sys.exit(1)
-    else:
-        ip = args.ip
+        ip = resolve(args.ip)
+    except socket.gaierror:
+        logging.error("not a valid ip or host. ")
+        sys.exit(1)
     
     curr_usrname, password = get_username_and_password_or_session()
 
-    async with Connection(ip, args.port, curr_usrname, mode=Mode.ROBOT if args.robot else Mode.NORMAL) as connection:
+    async with ReconnectingConnection(ip, args.port, curr_usrname, mode=Mode.ROBOT if args.robot else Mode.NORMAL) as connection:
         logging.debug("init the socket successfully")
-        await connection.send(
-            type=REQ.CTL_LOGIN,
-            usrname=curr_usrname,
-            msg=password
-        )
-        logging.debug("send the login request")
-        _, (_, type, uid, *_) = await connection.recv()
-        logging.debug("recv the login response")
-        if type != REQ.CTL_LOGIN:
-            raise Exception("Invalid response received")
-        if not uid:
-            raise Exception("login failed: wrong password or user doesn't exists")
-        logging.debug("login successfully")
-        async with Plugins(connection, extra_plugin=args.plugin) as plugs:
+        await connection.login(password)
+        async with (
+            Plugins(connection, extra_plugin=args.plugin) as plugs,
+            open_history(plugs.configs.config.get("history_file", "~/.vcc-history.db")) as history,
+            exporters(plugs.configs.config),
+            monitor_loop(plugs.configs.config),
+            trace_connection(connection, plugs.configs.config),
+        ):
             connection.data.plugs = plugs
-            recv_loop_task = asyncio.create_task(recv_loop(connection, plugs))
-            input_send_loop_task = asyncio.create_task(input_send_loop(connection, plugs, lambda: recv_loop_task.cancel()))
+            connection.data.history = history
+            connection.limiter = RateLimiter.from_config_or_none(plugs.configs.config)
+            connection.register_metrics()
+            data = connection.data
+            renderer = pretty.Renderer(lambda: pretty.prompt_text(curr_usrname, data.sess, data.level))
+            tasks = [asyncio.create_task(recv_loop(connection, plugs, renderer))]
+            # nothing can be sent once receiving has stopped
+            tasks[0].add_done_callback(lambda _: [i.cancel() for i in tasks[1:]])
+            if connection.data.mode != Mode.ROBOT:
+                # robot mode reads nothing from the terminal
+                tasks.append(asyncio.create_task(input_send_loop(connection, plugs, renderer, lambda: tasks[0].cancel())))
             def sigint_handler(sig: int, frame: FrameType | None) -> None:
-                recv_loop_task.cancel()
-                input_send_loop_task.cancel()
+                for task in tasks:
+                    task.cancel()
             signal.signal(signal.SIGINT, sigint_handler)
-            runloop: asyncio.Future[tuple[None, None]] = asyncio.gather(
-                recv_loop_task,
-                input_send_loop_task
-            )
-            await connection.send(type=REQ.CTL_UINFO, uid=0, msg=connection.data.usrname)
+            runloop: asyncio.Future[list[None]] = asyncio.gather(*tasks)
+            await connection.send_tracked(type=REQ.CTL_UINFO, uid=0, msg=connection.data.usrname)
             await runloop
+            await renderer.drain()
     
 def amain() -> None:
     asyncio.run(main())
@@ -0,0 +1,221 @@
+# This file is part of vcc.py.
+
+# vcc.py is free software: you can redistribute it and/or modify it under the terms of the GNU General
+# Public License as published by the Free Software Foundation, either version 3 of the License, or (at
+# your option) any later version.
+
+# vcc.py is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+# implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public
+# License for more details.
+
+# You should have received a copy of the GNU General Public License along with vcc.py. If not, see
+# <https://www.gnu.org/licenses/>.
+
+# Record every frame a Connection sends or receives, set in the config file:
+#   wire_trace: ~/vcc.trace
+# The file starts with TRACE_MAGIC, then every frame is a record header followed by the raw frame.
+# Every run appends a START record holding the wall-clock time, the times of the records after it
+# are monotonic and only mean something next to the START before them. Frames are recorded before
+# they are written, a write which fails adds a SEND_FAILED record with the error.
+# Passwords in login requests are blanked. Read a trace with:
+#   vcc-wiretrace ~/vcc.trace -t MSG_SEND -u someone
+
+from __future__ import annotations
+
+from pathlib import Path
+from types import TracebackType
+from typing import TYPE_CHECKING, Any, AsyncIterator, BinaryIO, Final, Iterator, NamedTuple
+from datetime import datetime
+import argparse
+import contextlib
+import os
+import struct
+import sys
+import time
+
+from .constants import *
+from .codec import RequestView, RelayView, frame_size, is_request_frame
+
+if TYPE_CHECKING:
+    from .sock import Connection
+
+TRACE_MAGIC: Final = b"VCCTRACE1\n"
+# monotonic time in seconds, kind, length of the frame
+RECORD_STRUCT: Final = struct.Struct("!dBI")
+# the payload of START, time.time() when time.monotonic() was the time of the record
+WALL_STRUCT: Final = struct.Struct("!d")
+
+RECV: Final = 0
+SEND: Final = 1
+START: Final = 2
+SEND_FAILED: Final = 3
+DIRECTIONS: Final = ("recv", "send")
+KIND_NAMES: Final = ("recv", "send", "start", "send failed")
+
+# usrname is followed by msg in a request frame
+_LOGIN_MSG_OFFSET: Final = REQ_SIZE - MSG_SIZE
+
+class WireTrace:
+    """Append frames to a trace file
+
+    Writes go to a large buffer, so recording a frame is usually a copy and the file is written
+    in big chunks. Data given to record() may hold several frames, which are recorded one by one
+    """
+    def __init__(self, path: str | Path, buffer_size: int = 1 << 20) -> None:
+        self.path = Path(path)
+        self.buffer_size = buffer_size
+        self.frames = 0
+
+    def __enter__(self) -> WireTrace:
+        self._file: BinaryIO = open(self.path, "ab", buffering=self.buffer_size)
+        if self._file.tell() == 0:
+            self._file.write(TRACE_MAGIC)
+        self._file.write(RECORD_STRUCT.pack(time.monotonic(), START, WALL_STRUCT.size))
+        self._file.write(WALL_STRUCT.pack(time.time()))
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc_val: BaseException | None, exc_tb: TracebackType | None) -> None:
+        self._file.close()
+
+    def record(self, direction: int, data: bytes | bytearray | memoryview) -> None:
+        now = time.monotonic()
+        write = self._file.write
+        view = memoryview(data)
+        start = 0
+        while start < len(view):
+            size = frame_size(view, start)
+            if size is None or start + size > len(view):
+                # not a whole frame, keep it as it is
+                size = len(view) - start
+            frame = view[start:start + size]
+            if size == REQ_SIZE and is_request_frame(frame) and RequestView(frame).type == REQ.CTL_LOGIN:
+                blanked = bytearray(frame)
+                blanked[_LOGIN_MSG_OFFSET:] = bytes(MSG_SIZE)
+                frame = memoryview(blanked)
+            write(RECORD_STRUCT.pack(now, direction, size))
+            write(frame)
+            self.frames += 1
+            start += size
+
+    def record_failure(self, error: BaseException) -> None:
+        """the last frames recorded with SEND may not have been written, or only partly"""
+        text = repr(error).encode()
+        self._file.write(RECORD_STRUCT.pack(time.monotonic(), SEND_FAILED, len(text)))
+        self._file.write(text)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+@contextlib.asynccontextmanager
+async def trace_connection(conn: Connection, config: dict[str, Any]) -> AsyncIterator[WireTrace | None]:
+    """record the frames of conn inside it if wire_trace is set"""
+    path = config.get("wire_trace")
+    if not path:
+        yield None
+        return
+    with WireTrace(os.path.expanduser(str(path))) as tracer:
+        conn.tracer = tracer
+        try:
+            yield tracer
+        finally:
+            conn.tracer = None
+
+class TraceRecord(NamedTuple):
+    time: float
+    direction: int
+    frame: bytes
+
+    def view(self) -> RequestView | RelayView:
+        return RequestView(self.frame) if is_request_frame(self.frame) else RelayView(self.frame)
+
+def read_trace(file: BinaryIO) -> Iterator[TraceRecord]:
+    if file.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+        raise ValueError("not a vcc trace")
+    while True:
+        header = file.read(RECORD_STRUCT.size)
+        if len(header) < RECORD_STRUCT.size:
+            # the end, or a record cut by a crash
+            return
+        when, direction, size = RECORD_STRUCT.unpack(header)
+        if direction >= len(KIND_NAMES):
+            raise ValueError(f"bad record kind {direction} at byte {file.tell() - RECORD_STRUCT.size}, the trace is corrupt from there")
+        frame = file.read(size)
+        if len(frame) < size:
+            return
+        yield TraceRecord(when, direction, frame)
+
+def describe(record: TraceRecord, start: float) -> str:
+    """a line about the record, start is the monotonic time of the START of its run"""
+    if record.direction == START:
+        (wall,) = WALL_STRUCT.unpack(record.frame)
+        return f"---- run started at {datetime.fromtimestamp(wall).isoformat(sep=' ', timespec='milliseconds')}"
+    prefix = f"{record.time - start:12.6f} {KIND_NAMES[record.direction]}"
+    if record.direction == SEND_FAILED:
+        return f"{prefix}: {record.frame.decode(errors='replace')}, the frames sent before may not have been written"
+    try:
+        view = record.view()
+        try:
+            type_name = REQ(view.type).name
+        except ValueError:
+            type_name = str(view.type)
+        if isinstance(view, RelayView):
+            return f"{prefix} {type_name} uid={view.uid} session={view.session} usrname={view.usrname!r} visible={view.visible!r} msg={view.msg!r}"
+        return f"{prefix} {type_name} uid={view.uid} session={view.session} flags={view.flags} usrname={view.usrname!r} msg={view.msg!r}"
+    except (ValueError, struct.error):
+        return f"{prefix} {len(record.frame)} bad bytes {record.frame[:32].hex()}"
+
+def matches(record: TraceRecord, args: argparse.Namespace) -> bool:
+    if record.direction in (START, SEND_FAILED):
+        return True
+    if args.direction is not None and DIRECTIONS[record.direction] != args.direction:
+        return False
+    if args.type is None and args.user is None and args.session is None:
+        return True
+    try:
+        view = record.view()
+        return (
+            (args.type is None or view.type in args.type)
+            and (args.user is None or view.usrname == args.user)
+            and (args.session is None or view.session == args.session)
+        )
+    except (ValueError, struct.error):
+        return False
+
+def parse_type(name: str) -> int:
+    try:
+        return REQ[name.upper()]
+    except KeyError:
+        raise argparse.ArgumentTypeError(f"unknown type {name}") from None
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Decode a trace recorded with wire_trace", prog="vcc-wiretrace")
+    parser.add_argument("-t", "--type", type=parse_type, action="append", metavar="type", help="only frames of the type, like MSG_SEND, can be repeated")
+    parser.add_argument("-u", "--user", type=str, metavar="username", help="only frames with the username")
+    parser.add_argument("-s", "--session", type=int, metavar="session", help="only frames of the session")
+    parser.add_argument("-d", "--direction", choices=DIRECTIONS, help="only frames sent or received")
+    parser.add_argument("--raw", action="store_true", help="print the frames in hex too")
+    parser.add_argument(dest="file", metavar="file", help="the trace file")
+    return parser.parse_args()
+
+def main() -> None:
+    args = parse_args()
+    try:
+        with open(args.file, "rb") as file:
+            start: float | None = None
+            for record in read_trace(file):
+                if record.direction == START or start is None:
+                    # an old trace may have no START
+                    start = record.time
+                if not matches(record, args):
+                    continue
+                print(describe(record, start))
+                if args.raw:
+                    print(record.frame.hex())
+    except BrokenPipeError:
+        pass
+    except (OSError, ValueError, struct.error) as e:
+        print(f"{args.file}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()